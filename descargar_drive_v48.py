@@ -5,18 +5,24 @@
 # + creación automática de carpetas por responsable y actividad
 # ============================================================
 
+import argparse
 import os
 import io
+import re
 import gspread
 import pandas as pd
-import time
 from datetime import datetime
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-from gspread.utils import rowcol_to_a1
+from gspread.utils import ValueInputOption, ValueRenderOption, rowcol_to_a1
 from pathlib import Path
 
+from planificador_descargas import (
+    TASA_MAXIMA, ManifiestoDescargas, PlanificadorDescargas, Progreso, ejecutar_lotes, es_reintentable,
+    md5_archivo
+)
+
 # ------------------------------------------------------------
 # CONFIGURACIÓN BASE
 # ------------------------------------------------------------
@@ -26,6 +32,17 @@ from pathlib import Path
 CRED_PATH = r"C:\Users\hector.gaviria\Desktop\Control_ANS\control-ans-elite-f4ea102db569.json"
 SHEET_ID = "1bPLGVVz50k6PlNp382isJrqtW_3IsrrhGW0UUlMf-bM"
 
+# Descargas en paralelo (ver planificador_descargas.py): hilos y llamadas/segundo a Drive
+# (por defecto el 75 % de la cuota por usuario); --trabajadores / --tasa los cambian
+TRABAJADORES_DESCARGA = 8
+TASA_DRIVE = TASA_MAXIMA
+
+# Manifiesto de descargas (id de Drive, md5, tamaño, ruta): permite reanudar sin repetir
+RUTA_MANIFIESTO = Path(__file__).resolve().parent / "data_clean" / "MANIFIESTO_DESCARGAS.db"
+
+# Marca de agua del formulario (última fila procesada); --completo la ignora
+MARCA_FORMULARIO = "formulario_v48"
+
 # ------------------------------------------------------------
 # 🔄 DETECCIÓN AUTOMÁTICA DE ENTORNO (Empresa / Personal)
 # ------------------------------------------------------------
@@ -89,6 +106,7 @@ def leer_google_sheet(service):
             status, done = downloader.next_chunk()
         fh.seek(0)
         df = pd.read_csv(fh)
+        df.index = range(2, len(df) + 2)  # número de fila en la hoja (la 1 es el encabezado)
         print("✅ Hoja leída correctamente.\n")
         print(df.head())
         return df
@@ -96,10 +114,67 @@ def leer_google_sheet(service):
         print(f"❌ Error al leer Google Sheet: {e}")
         return None
 
+# ------------------------------------------------------------
+# LEER SOLO LAS RESPUESTAS NUEVAS (desde la marca de agua)
+# ------------------------------------------------------------
+def letra_columna(n):
+    return re.sub(r"\d", "", rowcol_to_a1(1, n))
+
+
+def leer_respuestas(sheet, desde_fila=2):
+    """Respuestas desde `desde_fila` como DataFrame indexado por número de fila de la hoja."""
+    encabezados = sheet.row_values(1)
+    filas = sheet.get_values(f"A{desde_fila}:{letra_columna(len(encabezados))}")
+    filas = [list(f) + [""] * (len(encabezados) - len(f)) for f in filas]
+    return pd.DataFrame(filas, columns=encabezados, index=range(desde_fila, desde_fila + len(filas)))
+
+
+def marca_temporal(fila):
+    """Valor de la columna "Marca temporal" de una fila (antes o después de normalizar encabezados)."""
+    columna = next((c for c in fila.index if "temporal" in str(c).lower() or "timestamp" in str(c).lower()), None)
+    return str(fila[columna]).strip() if columna is not None else ""
+
+# ------------------------------------------------------------
+# ÍNDICE LOCAL DE EVIDENCIAS (un solo recorrido del árbol)
+# ------------------------------------------------------------
+def indexar_evidencias(raiz):
+    """nombre de archivo → ruta, recorriendo una sola vez las subcarpetas de `raiz` con os.scandir."""
+    indice = {}
+    raiz = Path(raiz)
+    if not raiz.is_dir():
+        return indice
+
+    pendientes = [e.path for e in os.scandir(raiz) if e.is_dir(follow_symlinks=False)]
+    while pendientes:
+        try:
+            with os.scandir(pendientes.pop()) as entradas:
+                for entrada in entradas:
+                    if entrada.is_dir(follow_symlinks=False):
+                        pendientes.append(entrada.path)
+                    else:
+                        indice.setdefault(entrada.name, Path(entrada.path))
+        except OSError as e:
+            print(f"⚠️ No se pudo leer la carpeta {e.filename}: {e.strerror}")
+    print(f"🗂️ Índice local de evidencias: {len(indice)} archivos.")
+    return indice
+
 # ------------------------------------------------------------
 # DESCARGAR Y RENOMBRAR PDFS POR RESPONSABLE Y ACTIVIDAD
 # ------------------------------------------------------------
-def descargar_pdfs(service, df):
+def nombre_con_id(nombre, file_id):
+    """'EPM - pedido - técnico (id).pdf': nombre de una segunda evidencia con el mismo pedido y técnico."""
+    ruta = Path(nombre)
+    return f"{ruta.stem} ({file_id}){ruta.suffix}"
+
+
+def descargar_pdfs(df, crear=crear_servicio, trabajadores=TRABAJADORES_DESCARGA, tasa=TASA_DRIVE,
+                   indice=None, manifiesto=None):
+    """Descarga los PDF faltantes; los que terminan bien se agregan a `indice` (nombre → ruta).
+
+    Devuelve los números de fila con error reintentable (None si faltan columnas):
+    la marca de agua no las pasa. Los errores permanentes (archivo borrado, sin
+    permiso...) quedan en el manifiesto como 'error' y en el log; solo se
+    vuelven a revisar con --completo."""
     # Normalizar encabezados
     df.columns = (
         df.columns.str.strip()
@@ -163,10 +238,29 @@ def descargar_pdfs(service, df):
     log_errores = CARPETA_FECHA / "log_errores_descarga.txt"
     errores = 0
     descargados = 0
+    existentes = 0
+    filas_con_error = []
+
+    def registrar_error(pedido, tecnico, error):
+        print(f"❌ Error al descargar EPM - {pedido} - {tecnico}.pdf: {error}")
+        with open(log_errores, "a", encoding="utf-8") as log:
+            log.write(f"{pedido} - {tecnico}: {error}\n")
+
+    def anotar_error(fila, pedido, tecnico, error):
+        nonlocal errores
+        errores += 1
+        # Cuota, 5xx, red o tamaño / md5 distinto (el archivo cambió en Drive): se
+        # reintenta en la próxima ejecución. Los demás no se arreglan reintentando.
+        if es_reintentable(error) or isinstance(error, ValueError):
+            filas_con_error.append(fila)
+            registrar_error(pedido, tecnico, error)
+        else:
+            registrar_error(pedido, tecnico, f"{error} [permanente; se revisa con --completo]")
 
     # ------------------------------------------------------------
-    # Proceso de descarga
+    # Evidencias referenciadas en el formulario
     # ------------------------------------------------------------
+    candidatos = []
     for i, fila in df.iterrows():
         pedido = str(fila.get(col_pedido, "")).strip()
         tecnico = str(fila.get(col_tecnico, "")).strip()
@@ -174,42 +268,123 @@ def descargar_pdfs(service, df):
         url = str(fila.get(col_url, "")).strip()
 
         if not (pedido and tecnico and url):
-            print(f"⚠️ Fila {i+1} incompleta, se omite.")
+            print(f"⚠️ Fila {i} incompleta, se omite.")
             continue
 
         if "id=" not in url:
-            print(f"⚠️ URL inválida en la fila {i+1}: {url}")
+            print(f"⚠️ URL inválida en la fila {i}: {url}")
             continue
 
         file_id = url.split("id=")[-1]
         nombre_archivo = f"EPM - {pedido} - {tecnico}.pdf"
-        ruta_destino = obtener_ruta_destino(actividad)
-        ruta_local = ruta_destino / nombre_archivo
+        candidatos.append((i, pedido, tecnico, file_id, obtener_ruta_destino(actividad) / nombre_archivo))
+
+    # ------------------------------------------------------------
+    # Metadatos de Drive (md5 / tamaño) en solicitudes batch: es la única
+    # llamada de red para los archivos que ya están descargados
+    # ------------------------------------------------------------
+    planificador = PlanificadorDescargas(crear, trabajadores=trabajadores, tasa=tasa)
+    if manifiesto is None:
+        manifiesto = ManifiestoDescargas(RUTA_MANIFIESTO)
+
+    metadatos = ejecutar_lotes(planificador, {
+        file_id: (lambda service, file_id=file_id:
+                  service.files().get(fileId=file_id, fields="id, name, md5Checksum, size"))
+        for _, _, _, file_id, _ in candidatos
+    })
+
+    def ruta_ya_descargada(file_id, md5, tamano, ruta_local):
+        """Ruta local válida si el archivo ya está descargado (manifiesto o archivo previo verificado)."""
+        ruta = manifiesto.verificado(file_id, md5, tamano)
+        if ruta is not None:
+            return ruta
+
+        # Descargas previas al manifiesto o carpetas movidas: se verifican una vez y se registran
+        posibles = [ruta_local]
+        registro = manifiesto.registro(file_id)
+        if indice is not None:
+            posibles += [indice.get(Path(registro["ruta"]).name) if registro else None, indice.get(ruta_local.name)]
+        for ruta in dict.fromkeys(p for p in posibles if p is not None):
+            if (ruta.is_file() and (tamano is None or ruta.stat().st_size == int(tamano))
+                    and (not md5 or md5_archivo(ruta) == md5)):
+                manifiesto.registrar(file_id, ruta.name, md5, tamano, ruta)
+                return ruta
+        return None
 
-        if ruta_local.exists():
-            print(f"[INFO] Ya existe: {nombre_archivo}, se omite descarga.")
+    reservados = {}  # ruta local → id de Drive que la va a ocupar en esta ejecución
+
+    def destino_libre(file_id, ruta_local):
+        """Ruta de descarga de `file_id`; si otro archivo de Drive ya ocupa el nombre
+        (mismo pedido y técnico con otra evidencia) se le agrega el id, así dos hilos
+        nunca escriben el mismo archivo."""
+        dueno = reservados.get(ruta_local)
+        if dueno is None and ruta_local.exists():
+            registro = manifiesto.registro(file_id)
+            if registro is None or Path(registro["ruta"]) != ruta_local:
+                dueno = "otro archivo"
+        if dueno not in (None, file_id):
+            ruta_local = ruta_local.with_name(nombre_con_id(ruta_local.name, file_id))
+        reservados[ruta_local] = file_id
+        return ruta_local
+
+    tareas = []
+    en_cola = set()
+    for fila, pedido, tecnico, file_id, ruta_local in candidatos:
+        meta, error = metadatos[file_id]
+        if error is not None:
+            anotar_error(fila, pedido, tecnico, error)
+            registro = manifiesto.registro(file_id)
+            if registro is None or registro["estado"] != "ok":
+                manifiesto.registrar(file_id, ruta_local.name, None, None, ruta_local, estado="error")
             continue
 
+        md5, tamano = meta.get("md5Checksum"), meta.get("size")
+        ruta = ruta_ya_descargada(file_id, md5, tamano, ruta_local)
+        if ruta is not None:
+            existentes += 1
+            reservados.setdefault(ruta, file_id)
+            if indice is not None:
+                # el enlace apunta al archivo aunque cambie el nombre
+                indice[nombre_con_id(ruta_local.name, file_id)] = ruta
+                indice.setdefault(ruta_local.name, ruta)
+            continue
+
+        if file_id in en_cola:
+            continue  # la misma evidencia en dos filas: se descarga una vez
+        en_cola.add(file_id)
+        tareas.append((fila, pedido, tecnico, file_id, destino_libre(file_id, ruta_local), md5, tamano))
+
+    print(f"[INFO] {existentes} PDF ya descargados y verificados, se omite su descarga.")
+    print(f"⬇️ {len(tareas)} PDF por descargar con {trabajadores} hilos...")
+
+    # ------------------------------------------------------------
+    # Proceso de descarga (en paralelo, con límite de tasa y reintentos;
+    # cada PDF se verifica por tamaño y md5 antes de quedar en su ruta)
+    # ------------------------------------------------------------
+    progreso = Progreso(len(tareas), "PDF")
+
+    def descargar_tarea(tarea):
+        _, _, _, file_id, ruta_local, md5, tamano = tarea
         try:
-            print(f"⬇️ Descargando {nombre_archivo} en {ruta_destino} ...")
-            request = service.files().get_media(fileId=file_id)
-            with io.FileIO(ruta_local, "wb") as fh:
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-                    if status:
-                        progreso = int(status.progress() * 100)
-                        print(f"   Progreso: {progreso}%")
-            print(f"✅ Guardado en: {ruta_local}\n")
+            n_bytes = planificador.descargar(file_id, ruta_local, md5=md5, tamano=tamano)
+        except Exception:
+            manifiesto.registrar(file_id, ruta_local.name, md5, tamano, ruta_local, estado="error")
+            progreso.sumar("error")
+            raise
+        manifiesto.registrar(file_id, ruta_local.name, md5, tamano, ruta_local)
+        progreso.sumar("ok", n_bytes)
+        return n_bytes
+
+    for (fila, pedido, tecnico, file_id, ruta_local, _, _), _, error in planificador.ejecutar(tareas, descargar_tarea):
+        if error is None:
             descargados += 1
-            time.sleep(0.8)
-
-        except Exception as e:
-            errores += 1
-            print(f"❌ Error al descargar {nombre_archivo}: {e}")
-            with open(log_errores, "a", encoding="utf-8") as log:
-                log.write(f"{pedido} - {tecnico}: {e}\n")
+            if indice is not None:
+                indice[ruta_local.name] = ruta_local
+                indice[nombre_con_id(f"EPM - {pedido} - {tecnico}.pdf", file_id)] = ruta_local
+            continue
+        anotar_error(fila, pedido, tecnico, error)
+    if tareas:
+        print(progreso.linea())
 
     print("\n---------------------------------------------")
     print(f"✅ Descargas completadas: {descargados}")
@@ -217,12 +392,50 @@ def descargar_pdfs(service, df):
     if errores > 0:
         print(f"📄 Ver log: {log_errores}")
     print("---------------------------------------------\n")
+    return sorted(filas_con_error)
 
 # ------------------------------------------------------------
 # ACTUALIZAR RUTAS EN GOOGLE SHEET
 # ------------------------------------------------------------
-def actualizar_rutas_locales(df):
+# Celdas y tamaño aproximado máximo por cada batch_update (la API recomienda < 2 MB)
+CELDAS_POR_LOTE = 500
+BYTES_POR_LOTE = 1024 * 1024
+
+PATRON_HIPERVINCULO = re.compile(r'(?:HIPERVINCULO|HYPERLINK)\(\s*"([^"]*)"', re.IGNORECASE)
+
+
+def destino_hipervinculo(valor):
+    """URL de una fórmula =HIPERVINCULO(...) de la hoja (None si la celda no tiene enlace)."""
+    coincidencia = PATRON_HIPERVINCULO.search(str(valor or ""))
+    return coincidencia.group(1) if coincidencia else None
+
+
+def ruta_web(ruta_local):
+    return str(ruta_local).replace(
+        r"C:\Users\hector.gaviria\OneDrive - Elite Ingenieros SAS",
+        "https://eliteingenierosas-my.sharepoint.com/personal/h_gaviria_eliteingenieros_com_co/Documents"
+    ).replace("\\", "/")
+
+
+def lotes_actualizacion(cambios):
+    """Agrupa los cambios de celdas respetando CELDAS_POR_LOTE y BYTES_POR_LOTE."""
+    lote, tamano = [], 0
+    for cambio in cambios:
+        peso = len(cambio["range"]) + len(cambio["values"][0][0]) + 32
+        if lote and (len(lote) >= CELDAS_POR_LOTE or tamano + peso > BYTES_POR_LOTE):
+            yield lote
+            lote, tamano = [], 0
+        lote.append(cambio)
+        tamano += peso
+    if lote:
+        yield lote
+
+
+def actualizar_rutas_locales(df, indice=None, desde_fila=2):
+    """Enlaza los PDF de las filas desde `desde_fila`; devuelve True si la hoja quedó actualizada."""
     print("\n🔄 Iniciando actualización de rutas en Google Sheet...")
+    if indice is None:
+        indice = indexar_evidencias(CARPETA_FECHA)
 
     try:
         sheet = conectar_gspread()
@@ -230,8 +443,8 @@ def actualizar_rutas_locales(df):
         print(f"❌ Error conectando a Google Sheet: {e}")
         return
 
-    data = sheet.get_all_records()
-    encabezados_original = sheet.row_values(1)
+    respuestas = leer_respuestas(sheet, desde_fila)
+    encabezados_original = list(respuestas.columns)
 
     col_evidencia_index = None
     for idx, name in enumerate(encabezados_original, start=1):
@@ -244,42 +457,117 @@ def actualizar_rutas_locales(df):
         print("❌ No se detectó la columna de evidencia.")
         return
 
-    total_registros = len(data)
-    enlaces_actualizados = 0
+    # Fórmulas actuales de la columna: solo se escriben los enlaces que cambian
+    letra = letra_columna(col_evidencia_index)
+    formulas_actuales = sheet.get_values(
+        f"{letra}{desde_fila}:{letra}", value_render_option=ValueRenderOption.formula
+    )
+
+    enlaces_sin_cambio = 0
     enlaces_no_encontrados = 0
+    cambios = []
 
-    for i, fila in enumerate(data, start=2):
+    for i, fila in respuestas.iterrows():
         pedido = str(fila.get("Número del pedido", "")).strip()
         tecnico = str(fila.get("Nombre del técnico", "")).strip()
         if not pedido or not tecnico:
             continue
 
         nombre_pdf = f"EPM - {pedido} - {tecnico}.pdf"
-        ruta_local = next(CARPETA_FECHA.glob(f"*/**/{nombre_pdf}"), None)
-
-        if ruta_local and ruta_local.exists():
-            celda = rowcol_to_a1(i, col_evidencia_index)
-            ruta_web = str(ruta_local).replace(
-                r"C:\Users\hector.gaviria\OneDrive - Elite Ingenieros SAS",
-                "https://eliteingenierosas-my.sharepoint.com/personal/h_gaviria_eliteingenieros_com_co/Documents"
-            ).replace("\\", "/")
-            sheet.update_acell(celda, f'=HIPERVINCULO("{ruta_web}"; "Abrir PDF")')
-            enlaces_actualizados += 1
-            print(f"✅ Enlace actualizado: {nombre_pdf}")
+        # La fila que aún tiene su URL de Drive se enlaza con su propio archivo (nombre con id
+        # cuando otra evidencia del mismo pedido y técnico ya ocupaba el nombre)
+        url_drive = str(fila.iloc[col_evidencia_index - 1])
+        ruta_local = None
+        if "id=" in url_drive:
+            ruta_local = indice.get(nombre_con_id(nombre_pdf, url_drive.split("id=")[-1].strip()))
+        ruta_local = ruta_local or indice.get(nombre_pdf)
+
+        if ruta_local:
+            url = ruta_web(ruta_local)
+            actual = formulas_actuales[i - desde_fila] if i - desde_fila < len(formulas_actuales) else ""
+            actual = actual[0] if actual else ""
+            if destino_hipervinculo(actual) == url:
+                enlaces_sin_cambio += 1
+                continue
+            cambios.append({
+                "range": rowcol_to_a1(i, col_evidencia_index),
+                "values": [[f'=HIPERVINCULO("{url}"; "Abrir PDF")']],
+            })
         else:
             enlaces_no_encontrados += 1
             print(f"⚠️ No se encontró el PDF: {nombre_pdf}")
 
+    # Escritura agrupada: una solicitud por lote en vez de una por celda
+    for lote in lotes_actualizacion(cambios):
+        sheet.batch_update(lote, value_input_option=ValueInputOption.user_entered)
+        print(f"✅ {len(lote)} enlaces escritos en la hoja.")
+
     print("\n🎯 Actualización completada.")
-    print(f"✅ Enlaces correctos: {enlaces_actualizados}")
+    print(f"✅ Enlaces actualizados: {len(cambios)}")
+    print(f"⏭️ Enlaces sin cambios: {enlaces_sin_cambio}")
     print(f"⚠️ No encontrados: {enlaces_no_encontrados}")
+    return True
 
 # ------------------------------------------------------------
 # PROGRAMA PRINCIPAL
 # ------------------------------------------------------------
-if __name__ == "__main__":
+def leer_desde_marca(manifiesto):
+    """Respuestas posteriores a la marca de agua; None si hay que revisar la hoja completa."""
+    marca = manifiesto.marca(MARCA_FORMULARIO)
+    if marca is None:
+        return None
+    try:
+        df = leer_respuestas(conectar_gspread(), marca["fila"])
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer las respuestas nuevas ({e}); se revisa la hoja completa.")
+        return None
+
+    # La fila de la marca debe seguir en su lugar: si se borraron u ordenaron filas, revisión completa
+    if df.empty or marca_temporal(df.iloc[0]) != marca["marca_temporal"]:
+        print("⚠️ La hoja cambió antes de la marca de agua; se revisa la hoja completa.")
+        return None
+    print(f"🔖 Marca de agua: fila {marca['fila']} ({marca['marca_temporal']}).")
+    return df.iloc[1:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Descarga los PDF del formulario y enlaza sus rutas en la hoja")
+    parser.add_argument("--completo", action="store_true",
+                        help="revisa todas las respuestas del formulario, no solo las nuevas")
+    parser.add_argument("--trabajadores", type=int, default=TRABAJADORES_DESCARGA,
+                        help="descargas simultáneas")
+    parser.add_argument("--tasa", type=float, default=TASA_DRIVE,
+                        help="llamadas por segundo a Drive (techo de la cubeta de tokens)")
+    args = parser.parse_args(argv)
+
     service = crear_servicio()
-    df = leer_google_sheet(service)
-    if df is not None:
-        descargar_pdfs(service, df)
-        actualizar_rutas_locales(df)
+    manifiesto = ManifiestoDescargas(RUTA_MANIFIESTO)
+
+    df = None if args.completo else leer_desde_marca(manifiesto)
+    if df is None:
+        df = leer_google_sheet(service)
+        if df is None:
+            return
+    print(f"📝 Respuestas por procesar: {len(df)}")
+    if df.empty:
+        return
+
+    desde_fila, hasta_fila = int(df.index[0]), int(df.index[-1])
+    marcas_temporales = {fila: marca_temporal(f) for fila, f in df.iterrows()}
+
+    indice = indexar_evidencias(CARPETA_FECHA)
+    filas_con_error = descargar_pdfs(df, crear=crear_servicio, trabajadores=args.trabajadores, tasa=args.tasa,
+                                     indice=indice, manifiesto=manifiesto)
+    if filas_con_error is None or not actualizar_rutas_locales(df, indice, desde_fila):
+        return
+
+    # La marca avanza hasta antes de la primera fila con error reintentable: esa se reintenta
+    # en la próxima ejecución (las de error permanente no la detienen)
+    fila_marca = filas_con_error[0] - 1 if filas_con_error else hasta_fila
+    if fila_marca >= desde_fila:
+        manifiesto.guardar_marca(MARCA_FORMULARIO, fila_marca, marcas_temporales[fila_marca])
+        print(f"🔖 Marca de agua guardada en la fila {fila_marca}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
 # DESCARGAR EVIDENCIAS DE GOOGLE DRIVE Y MOVER A PAPELERA_API
 # ------------------------------------------------------------
+import argparse
 import os
-import io
-import time
 from datetime import datetime
+from pathlib import Path
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 import sys
 
+from planificador_descargas import TASA_MAXIMA, PlanificadorDescargas, Progreso, ejecutar_lotes, md5_archivo
+
 # Forzar salida UTF-8 para registros
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -21,6 +22,11 @@ FOLDER_ID_FORMULARIO = "1cgtia-u95riQzBiqIV4IOw6STXix39Ibry2wGIAWAiyiawdkyTL3Eol
 FOLDER_ID_PAPELERA = "1t8yIQGQJ_Qi0c4ejDUMcr6H8Qz09-O9b"
 CRED_PATH = "control-ans-evidencias-1ef0b1b8d1a8.json"
 
+TRABAJADORES = 8          # descargas simultáneas (cada hilo con su propio servicio de Drive)
+TASA_DRIVE = TASA_MAXIMA  # llamadas por segundo a Drive (75 % de la cuota por usuario)
+TAMANO_PAGINA = 1000      # máximo que admite files.list
+CAMPOS_LISTADO = "nextPageToken, files(id, name, parents, md5Checksum, size)"
+
 # ============================================================
 # AUTENTICACIÓN
 # ============================================================
@@ -32,84 +38,137 @@ def crear_servicio():
     return build("drive", "v3", credentials=creds)
 
 # ============================================================
-# DESCARGAR Y MOVER ARCHIVOS (versión optimizada)
+# LISTADO PAGINADO DE LA CARPETA DEL FORMULARIO
+# ============================================================
+def listar_carpeta(planificador, carpeta):
+    """Generador con todos los archivos de `carpeta`, página por página (nextPageToken)."""
+    query = f"'{carpeta}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed = false"
+    token = None
+    while True:
+        pagina = planificador.llamar(lambda service: service.files().list(
+            q=query, pageSize=TAMANO_PAGINA, pageToken=token, fields=CAMPOS_LISTADO
+        ))
+        yield from pagina.get("files", [])
+        token = pagina.get("nextPageToken")
+        if not token:
+            return
+
+
+def ya_descargado(ruta, archivo):
+    """True si `ruta` ya tiene el archivo de Drive (mismo tamaño y md5)."""
+    return (ruta.is_file() and str(ruta.stat().st_size) == archivo.get("size")
+            and md5_archivo(ruta) == archivo.get("md5Checksum"))
+
+
+def destino_local(carpeta_dia, archivo, usados):
+    """Ruta local del archivo; si el nombre ya está tomado por otro contenido se le agrega el id.
+
+    Drive admite nombres repetidos en una carpeta y dos hilos no pueden escribir el mismo archivo."""
+    ruta = carpeta_dia / archivo["name"]
+    if ruta.name in usados or (ruta.exists() and not ya_descargado(ruta, archivo)):
+        ruta = ruta.with_name(f"{ruta.stem} ({archivo['id']}){ruta.suffix}")
+    usados.add(ruta.name)
+    return ruta
+
+# ============================================================
+# DESCARGAR Y MOVER ARCHIVOS (listado paginado + hilos de descarga)
 # ============================================================
-def descargar_archivos(service):
+def descargar_archivos(crear=crear_servicio, trabajadores=TRABAJADORES, tasa=TASA_DRIVE):
     fecha_hoy = datetime.now().strftime("%Y-%m-%d")
-    carpeta_dia = os.path.join(CARPETA_LOCAL, fecha_hoy)
+    carpeta_dia = Path(CARPETA_LOCAL) / fecha_hoy
     os.makedirs(carpeta_dia, exist_ok=True)
 
-    print(f"\n[INFO] Descargando evidencias del {fecha_hoy}...\n")
+    print(f"\n[INFO] Descargando evidencias del {fecha_hoy} con {trabajadores} hilos...\n")
+
+    planificador = PlanificadorDescargas(crear, trabajadores=trabajadores, tasa=tasa)
+    progreso = Progreso(None, "Evidencias")
+    usados = set()
 
-    query = f"'{FOLDER_ID_FORMULARIO}' in parents and mimeType != 'application/vnd.google-apps.folder'"
-    results = service.files().list(q=query, fields="files(id, name, parents)").execute()
-    files = results.get("files", [])
+    # Productor: el listado se consume a medida que hay hilos libres, así las
+    # descargas empiezan con la primera página
+    def tareas():
+        for archivo in listar_carpeta(planificador, FOLDER_ID_FORMULARIO):
+            yield archivo, destino_local(carpeta_dia, archivo, usados)
 
-    if not files:
+    def descargar_tarea(tarea):
+        archivo, ruta = tarea
+        if ya_descargado(ruta, archivo):
+            progreso.sumar("omitido")  # de una ejecución anterior que no alcanzó a moverlo
+            return 0
+        try:
+            n_bytes = planificador.descargar(archivo["id"], ruta, md5=archivo.get("md5Checksum"),
+                                             tamano=archivo.get("size"))
+        except Exception:
+            progreso.sumar("error")
+            raise
+        progreso.sumar("ok", n_bytes)
+        return n_bytes
+
+    resultados = planificador.ejecutar(tareas(), descargar_tarea)
+    if not resultados:
         print("[WARN] No se encontraron archivos en la carpeta del formulario.")
         return
+    print(progreso.linea())
+
+    verificados = []
+    for (archivo, ruta), _, error in resultados:
+        if error is None:
+            verificados.append(archivo)
+        else:
+            print(f"[ERROR] No se pudo descargar {archivo['name']}: {error}")
+
+    # ✅ Mover a PAPELERA_API solo lo descargado y verificado, y después de terminar
+    # el listado: mover archivos mientras se pagina la carpeta haría saltar páginas.
+    # Los movimientos van en solicitudes batch (hasta 100 por llamada) con los
+    # padres del listado; los que fallan por cuota se reintentan en otra ronda.
+    # Son escrituras: usan la cubeta de escritura, no la de las descargas.
+    movimientos = ejecutar_lotes(planificador, {
+        archivo["id"]: (lambda service, archivo=archivo: service.files().update(
+            fileId=archivo["id"],
+            addParents=FOLDER_ID_PAPELERA,
+            removeParents=",".join(archivo.get("parents", [])),
+            fields="id",
+        ))
+        for archivo in verificados
+    }, cubeta=planificador.cubeta_escritura)
 
-    descargados = 0
     movidos = 0
-
-    for file in files:
-        file_id = file["id"]
-        file_name = file["name"]
-        file_path = os.path.join(carpeta_dia, file_name)
-
-        try:
-            print(f"[📥] Descargando {file_name}...")
-            request = service.files().get_media(fileId=file_id)
-            fh = io.FileIO(file_path, "wb")
-
-            # ✅ Descarga más rápida con chunks grandes
-            downloader = MediaIoBaseDownload(fh, request, chunksize=1024 * 1024)  # 1 MB por bloque
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                if status:
-                    progreso = int(status.progress() * 100)
-                    print(f"   Progreso: {progreso}%")
-            fh.close()
-
-            descargados += 1
-            print(f"[OK] Archivo descargado: {file_name}")
-
-            # ✅ Mover archivo al Drive/PAPELERA_API
-            file_metadata = service.files().get(fileId=file_id, fields="parents").execute()
-            padres = ",".join(file_metadata.get("parents", []))
-
-            service.files().update(
-                fileId=file_id,
-                addParents=FOLDER_ID_PAPELERA,
-                removeParents=padres
-            ).execute()
-
+    for archivo in verificados:
+        _, error = movimientos[archivo["id"]]
+        if error is None:
             movidos += 1
-            print(f"[MOVIDO] Archivo movido a PAPELERA_API: {file_name}")
-
-            # ✅ Pequeña pausa para evitar límites de la API
-            time.sleep(0.3)
+        else:
+            print(f"[ERROR] No se pudo mover {archivo['name']} a PAPELERA_API: {error}")
 
-        except Exception as e:
-            print(f"[ERROR] No se pudo procesar {file_name}: {e}")
-
-    print(f"\n✅ Total de archivos descargados: {descargados}")
+    errores = len(resultados) - movidos
+    print(f"\n✅ Total de archivos descargados: {len(verificados)}")
     print(f"🗑️ Total de archivos movidos a PAPELERA_API: {movidos}")
+    if errores:
+        print(f"⚠️ Archivos con error (quedan en la carpeta del formulario para la próxima ejecución): {errores}")
 
     # MENSAJE AUTOMÁTICO FINAL
     print("\n------------------------------------------------------------")
-    print("[OK] PROCESO COMPLETADO CON ÉXITO")
-    print("[INFO] La carpeta del formulario quedó vacía.")
+    print("[OK] PROCESO COMPLETADO CON ÉXITO" if not errores else "[WARN] PROCESO COMPLETADO CON ERRORES")
+    if not errores:
+        print("[INFO] La carpeta del formulario quedó vacía.")
     print("[INFO] Los archivos se encuentran respaldados en:")
     print(f"       → {carpeta_dia}")
-    print("[INFO] Los archivos del Drive fueron movidos a la carpeta: PAPELERA_API")
+    if not errores:
+        print("[INFO] Los archivos del Drive fueron movidos a la carpeta: PAPELERA_API")
     print("[TIP]  Cuando desees liberar espacio, entra a Google Drive → PAPELERA_API y elimina definitivamente los archivos.")
     print("------------------------------------------------------------\n")
 
 # ============================================================
 # EJECUCIÓN
 # ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Descarga las evidencias del formulario y las mueve a PAPELERA_API")
+    parser.add_argument("--trabajadores", type=int, default=TRABAJADORES, help="descargas simultáneas")
+    parser.add_argument("--tasa", type=float, default=TASA_DRIVE,
+                        help="llamadas por segundo a Drive (techo de la cubeta de tokens)")
+    args = parser.parse_args(argv)
+    descargar_archivos(trabajadores=args.trabajadores, tasa=args.tasa)
+
+
 if __name__ == "__main__":
-    service = crear_servicio()
-    descargar_archivos(service)
+    main()
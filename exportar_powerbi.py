@@ -0,0 +1,336 @@
+"""
+------------------------------------------------------------
+EXPORTACIÓN POWER BI (ESQUEMA ESTRELLA EN PARQUET) – Control_ANS
+------------------------------------------------------------
+Autor: Héctor + IA (2025)
+------------------------------------------------------------
+Descripción:
+- Lee FENIX_ANS.xlsx (+ REPOSITORIO_PEDIDOS_CERRADOS.xlsx) y
+  CONTROL_ALMACEN.xlsx ya generados por el pipeline.
+- Escribe en data_clean/powerbi/ un esquema estrella en Parquet:
+    fact_pedido_ans/MES=AAAA-MM/   → estado ANS por pedido
+    fact_material/MES=AAAA-MM/     → líneas de conciliación FÉNIX vs ELITE
+    dim_actividad, dim_municipio, dim_tecnico, dim_material, dim_fecha
+- Los hechos se particionan por mes de FECHA_INICIO_ANS y solo se
+  reescriben las particiones cuyo contenido cambió (refresco
+  incremental en Power BI).
+------------------------------------------------------------
+"""
+
+import hashlib
+import json
+import shutil
+import unicodedata
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (motor Parquet de pandas)
+except ImportError:
+    raise SystemExit("❌ Falta la librería 'pyarrow'. Instálela con: pip install pyarrow")
+
+# ------------------------------------------------------------
+# CONFIGURACIÓN DE RUTAS
+# ------------------------------------------------------------
+base = Path(__file__).resolve().parent
+ruta_ans = base / "data_clean" / "FENIX_ANS.xlsx"
+ruta_repo = base / "data_clean" / "REPOSITORIO_PEDIDOS_CERRADOS.xlsx"
+ruta_almacen = base / "data_clean" / "CONTROL_ALMACEN.xlsx"
+ruta_modelo = base / "data_clean" / "powerbi"
+ruta_manifiesto = ruta_modelo / "_particiones.json"
+ruta_claves = ruta_modelo / "_claves.json"
+
+SIN_DATO = "SIN DATOS"
+SIN_FECHA = "SIN_FECHA"
+
+MESES = [
+    "ENERO", "FEBRERO", "MARZO", "ABRIL", "MAYO", "JUNIO", "JULIO",
+    "AGOSTO", "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE"
+]
+DIAS = ["LUNES", "MARTES", "MIÉRCOLES", "JUEVES", "VIERNES", "SÁBADO", "DOMINGO"]
+
+# Fechas fuera de esta ventana se tratan como errores de digitación (sin fecha):
+# una sola fecha 1900 o 2099 inflaría dim_fecha a decenas de miles de días
+FECHA_MINIMA = pd.Timestamp("2000-01-01")
+ANIOS_FUTUROS = 5
+
+# ------------------------------------------------------------
+# FUNCIONES AUXILIARES
+# ------------------------------------------------------------
+def normalizar_texto(serie):
+    """Mayúsculas, sin tildes ni espacios sobrantes; vacíos → SIN DATOS."""
+    def limpiar(valor):
+        if pd.isna(valor):
+            return SIN_DATO
+        texto = " ".join(str(valor).split()).upper()
+        texto = "".join(
+            c for c in unicodedata.normalize("NFD", texto)
+            if unicodedata.category(c) != "Mn"
+        )
+        return texto if texto and texto not in ("NAN", "NONE", "SIN DATO") else SIN_DATO
+    return serie.map(limpiar)
+
+
+def crear_dimension(valores, nombre, claves):
+    """Dimensión con clave sustituta entera (0 = SIN DATOS).
+
+    `claves` es el mapa valor → clave guardado entre ejecuciones: los valores
+    conocidos conservan su clave y los nuevos reciben claves al final, así un
+    valor nuevo no desplaza las claves de los demás (ni la huella de las
+    particiones de hechos que no cambiaron). Se actualiza en el sitio.
+    """
+    claves.setdefault(SIN_DATO, 0)
+    siguiente = max(claves.values()) + 1
+    for valor in sorted(set(valores) - set(claves)):
+        claves[valor] = siguiente
+        siguiente += 1
+
+    presentes = sorted(set(valores) | {SIN_DATO}, key=claves.get)
+    dim = pd.DataFrame({
+        f"{nombre}_key": [claves[v] for v in presentes],
+        nombre: presentes,
+    })
+    dim[f"{nombre}_key"] = dim[f"{nombre}_key"].astype("int32")
+    return dim
+
+
+def asignar_clave(serie, dim, nombre):
+    mapa = dict(zip(dim[nombre], dim[f"{nombre}_key"]))
+    return serie.map(mapa).fillna(0).astype("int32")
+
+
+def clave_fecha(fechas):
+    """Clave AAAAMMDD (0 cuando no hay fecha)."""
+    return fechas.dt.strftime("%Y%m%d").fillna("0").astype("int32")
+
+
+def validar_fechas(fechas, nombre):
+    """Deja sin fecha (NaT) los valores fuera de [FECHA_MINIMA, hoy + ANIOS_FUTUROS]."""
+    maxima = pd.Timestamp.today().normalize() + pd.DateOffset(years=ANIOS_FUTUROS)
+    fuera = fechas.notna() & ((fechas < FECHA_MINIMA) | (fechas > maxima))
+    if fuera.any():
+        print(f"⚠️ {nombre}: {int(fuera.sum())} fecha(s) fuera de rango "
+              f"({FECHA_MINIMA:%Y-%m-%d} a {maxima:%Y-%m-%d}) se tratan como sin fecha.")
+    return fechas.mask(fuera)
+
+
+def crear_dim_fecha(*series_fechas):
+    fechas = pd.concat([s.dropna().dt.normalize() for s in series_fechas])
+    if fechas.empty:
+        rango = pd.DatetimeIndex([])
+    else:
+        rango = pd.date_range(fechas.min(), fechas.max(), freq="D")
+
+    dim = pd.DataFrame({"fecha": rango})
+    dim["fecha_key"] = clave_fecha(dim["fecha"])
+    dim["anio"] = dim["fecha"].dt.year.astype("int16")
+    dim["mes"] = dim["fecha"].dt.month.astype("int8")
+    dim["nombre_mes"] = dim["mes"].map(lambda m: MESES[m - 1])
+    dim["anio_mes"] = dim["fecha"].dt.strftime("%Y-%m")
+    dim["dia"] = dim["fecha"].dt.day.astype("int8")
+    dim["dia_semana"] = dim["fecha"].dt.weekday.map(lambda d: DIAS[d])
+    dim["fin_de_semana"] = dim["fecha"].dt.weekday >= 5
+
+    # Fila "sin fecha" para hechos sin FECHA_INICIO_ANS
+    sin_fecha = pd.DataFrame([{
+        "fecha": pd.NaT, "fecha_key": 0, "anio": 0, "mes": 0, "nombre_mes": SIN_DATO,
+        "anio_mes": SIN_FECHA, "dia": 0, "dia_semana": SIN_DATO, "fin_de_semana": False,
+    }])
+    dim = pd.concat([sin_fecha, dim], ignore_index=True)
+    return dim[["fecha_key", "fecha", "anio", "mes", "nombre_mes", "anio_mes",
+                "dia", "dia_semana", "fin_de_semana"]].astype({"fecha_key": "int32"})
+
+
+def huella(df):
+    hash_filas = pd.util.hash_pandas_object(df, index=False)
+    return hashlib.blake2b(hash_filas.values.tobytes(), digest_size=16).hexdigest()
+
+# ------------------------------------------------------------
+# ESCRITURA PARQUET
+# ------------------------------------------------------------
+def escribir_tabla(df, nombre):
+    ruta = ruta_modelo / f"{nombre}.parquet"
+    df.to_parquet(ruta, index=False, compression="snappy")
+    print(f"🧱 {nombre}: {len(df)} filas")
+
+
+def escribir_particionado(df, nombre, manifiesto):
+    """Escribe nombre/MES=AAAA-MM/part-0.parquet; omite particiones sin cambios."""
+    carpeta = ruta_modelo / nombre
+    anteriores = manifiesto.get(nombre, {})
+    actuales = {}
+    escritas = 0
+
+    for mes, grupo in df.groupby("MES", sort=True):
+        # La columna MES vive en el nombre de la carpeta (particionado Hive)
+        grupo = grupo.drop(columns="MES").reset_index(drop=True)
+        h = huella(grupo)
+        actuales[mes] = h
+        ruta = carpeta / f"MES={mes}" / "part-0.parquet"
+        if anteriores.get(mes) == h and ruta.exists():
+            continue
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        grupo.to_parquet(ruta, index=False, compression="snappy")
+        escritas += 1
+
+    # Meses que ya no tienen datos
+    for mes in set(anteriores) - set(actuales):
+        shutil.rmtree(carpeta / f"MES={mes}", ignore_errors=True)
+
+    manifiesto[nombre] = actuales
+    print(f"🧱 {nombre}: {len(df)} filas | {len(actuales)} particiones "
+          f"({escritas} reescritas, {len(actuales) - escritas} sin cambios)")
+
+# ------------------------------------------------------------
+# CONSTRUCCIÓN DEL MODELO
+# ------------------------------------------------------------
+def cargar_pedidos():
+    """Pedidos activos (FENIX_ANS) + cerrados del repositorio histórico."""
+    df = pd.read_excel(ruta_ans, sheet_name="FENIX_ANS", dtype=str)
+    df["ORIGEN_REGISTRO"] = "ACTIVO"
+
+    if ruta_repo.exists():
+        repo = pd.read_excel(ruta_repo, dtype=str)
+        repo["ORIGEN_REGISTRO"] = "CERRADO"
+        df = pd.concat([df, repo], ignore_index=True)
+
+    df["PEDIDO"] = df["PEDIDO"].astype(str).str.strip()
+    df = df.drop_duplicates(subset=["PEDIDO"], keep="first")
+
+    for col in ["ACTIVIDAD", "MUNICIPIO", "TECNICO_EJECUTA", "TIPO_DIRECCION",
+                "DIAS_PACTADOS", "ESTADO", "ESTADO_FENIX", "REPORTE_TECNICO",
+                "FECHA_INICIO_ANS", "FECHA_LIMITE_ANS"]:
+        if col not in df.columns:
+            df[col] = None
+
+    for col in ["FECHA_INICIO_ANS", "FECHA_LIMITE_ANS"]:
+        df[col] = validar_fechas(pd.to_datetime(df[col], errors="coerce"), col)
+    return df
+
+
+def cargar_materiales():
+    """Líneas CONTROL_ALMACEN (cruce) + NO_COINCIDEN (solo en un origen)."""
+    hojas = pd.read_excel(ruta_almacen, sheet_name=["CONTROL_ALMACEN", "NO_COINCIDEN"], dtype=str)
+    cruce = hojas["CONTROL_ALMACEN"]
+    nocruce = hojas["NO_COINCIDEN"].rename(columns={"origen": "status"})
+    cruce["tipo_linea"] = "CRUCE"
+    nocruce["tipo_linea"] = "NO_COINCIDE"
+
+    df = pd.concat([cruce, nocruce], ignore_index=True)
+    for col in ["municipio", "actividad", "tecnico", "vlr_cliente", "valor_costo", "diferencia"]:
+        if col not in df.columns:
+            df[col] = None
+
+    df["pedido"] = df["pedido"].astype(str).str.strip()
+    for col in ["cantidad", "cantidad_elite", "diferencia", "vlr_cliente", "valor_costo"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    return df
+
+
+def construir_modelo(df_pedidos, df_mat, claves=None):
+    """Arma dimensiones y hechos; `claves` (valor → clave por dimensión) se actualiza en el sitio."""
+    claves = {} if claves is None else claves
+
+    # Actividad y municipio de NO_COINCIDEN se completan desde el pedido
+    por_pedido = df_pedidos.set_index("PEDIDO")
+    df_mat["actividad"] = df_mat["actividad"].fillna(df_mat["pedido"].map(por_pedido["ACTIVIDAD"]))
+    df_mat["municipio"] = df_mat["municipio"].fillna(df_mat["pedido"].map(por_pedido["MUNICIPIO"]))
+    df_mat["FECHA_INICIO_ANS"] = df_mat["pedido"].map(por_pedido["FECHA_INICIO_ANS"])
+
+    # --- Atributos normalizados compartidos ---
+    actividad_ped = normalizar_texto(df_pedidos["ACTIVIDAD"])
+    actividad_mat = normalizar_texto(df_mat["actividad"])
+    municipio_ped = normalizar_texto(df_pedidos["MUNICIPIO"])
+    municipio_mat = normalizar_texto(df_mat["municipio"])
+    tecnico_ped = normalizar_texto(df_pedidos["TECNICO_EJECUTA"])
+    tecnico_mat = normalizar_texto(df_mat["tecnico"])
+    material = normalizar_texto(df_mat["codigo"])
+
+    # --- Dimensiones ---
+    dims = {
+        "actividad": crear_dimension(pd.concat([actividad_ped, actividad_mat]), "actividad",
+                                     claves.setdefault("actividad", {})),
+        "municipio": crear_dimension(pd.concat([municipio_ped, municipio_mat]), "municipio",
+                                     claves.setdefault("municipio", {})),
+        "tecnico": crear_dimension(pd.concat([tecnico_ped, tecnico_mat]), "tecnico",
+                                   claves.setdefault("tecnico", {})),
+        "material": crear_dimension(material, "material", claves.setdefault("material", {})),
+        "fecha": crear_dim_fecha(df_pedidos["FECHA_INICIO_ANS"], df_pedidos["FECHA_LIMITE_ANS"]),
+    }
+
+    # --- Hecho: estado ANS por pedido ---
+    fact_pedido = pd.DataFrame({
+        "pedido": df_pedidos["PEDIDO"],
+        "actividad_key": asignar_clave(actividad_ped, dims["actividad"], "actividad"),
+        "municipio_key": asignar_clave(municipio_ped, dims["municipio"], "municipio"),
+        "tecnico_key": asignar_clave(tecnico_ped, dims["tecnico"], "tecnico"),
+        "fecha_inicio_key": clave_fecha(df_pedidos["FECHA_INICIO_ANS"]),
+        "fecha_limite_key": clave_fecha(df_pedidos["FECHA_LIMITE_ANS"]),
+        "fecha_inicio_ans": df_pedidos["FECHA_INICIO_ANS"],
+        "fecha_limite_ans": df_pedidos["FECHA_LIMITE_ANS"],
+        "tipo_direccion": normalizar_texto(df_pedidos["TIPO_DIRECCION"]),
+        "dias_pactados": pd.to_numeric(df_pedidos["DIAS_PACTADOS"], errors="coerce").fillna(0).astype("int16"),
+        "estado_ans": df_pedidos["ESTADO"].fillna(SIN_DATO),
+        "estado_fenix": df_pedidos["ESTADO_FENIX"].fillna(SIN_DATO),
+        "reporte_tecnico": df_pedidos["REPORTE_TECNICO"].fillna(SIN_DATO),
+        "origen_registro": df_pedidos["ORIGEN_REGISTRO"],
+        "MES": df_pedidos["FECHA_INICIO_ANS"].dt.strftime("%Y-%m").fillna(SIN_FECHA),
+    })
+
+    # --- Hecho: líneas de conciliación de materiales ---
+    fact_material = pd.DataFrame({
+        "pedido": df_mat["pedido"],
+        "material_key": asignar_clave(material, dims["material"], "material"),
+        "actividad_key": asignar_clave(actividad_mat, dims["actividad"], "actividad"),
+        "municipio_key": asignar_clave(municipio_mat, dims["municipio"], "municipio"),
+        "tecnico_key": asignar_clave(tecnico_mat, dims["tecnico"], "tecnico"),
+        "fecha_inicio_key": clave_fecha(df_mat["FECHA_INICIO_ANS"]),
+        "tipo_linea": df_mat["tipo_linea"],
+        "status": df_mat["status"].fillna(SIN_DATO),
+        "cantidad_fenix": df_mat["cantidad"],
+        "cantidad_elite": df_mat["cantidad_elite"],
+        "diferencia": df_mat["diferencia"],
+        "vlr_cliente": df_mat["vlr_cliente"],
+        "valor_costo": df_mat["valor_costo"],
+        "MES": df_mat["FECHA_INICIO_ANS"].dt.strftime("%Y-%m").fillna(SIN_FECHA),
+    })
+
+    return dims, fact_pedido, fact_material
+
+
+def main():
+    print("------------------------------------------------------------")
+    print("📊 EXPORTANDO MODELO POWER BI (Parquet)...")
+    print("------------------------------------------------------------")
+
+    if not ruta_ans.exists():
+        raise SystemExit(f"❌ No existe {ruta_ans.name}. Ejecute primero calculos_ans.py.")
+    if not ruta_almacen.exists():
+        raise SystemExit(f"❌ No existe {ruta_almacen.name}. Ejecute primero validar_export_almacen.py.")
+
+    df_pedidos = cargar_pedidos()
+    df_mat = cargar_materiales()
+    print(f"📂 Pedidos: {len(df_pedidos)} | Líneas de materiales: {len(df_mat)}")
+
+    # Claves sustitutas estables entre ejecuciones (valor → clave por dimensión)
+    claves = json.loads(ruta_claves.read_text(encoding="utf-8")) if ruta_claves.exists() else {}
+    dims, fact_pedido, fact_material = construir_modelo(df_pedidos, df_mat, claves)
+
+    ruta_modelo.mkdir(parents=True, exist_ok=True)
+    manifiesto = json.loads(ruta_manifiesto.read_text(encoding="utf-8")) if ruta_manifiesto.exists() else {}
+
+    for nombre, dim in dims.items():
+        escribir_tabla(dim, f"dim_{nombre}")
+    escribir_particionado(fact_pedido, "fact_pedido_ans", manifiesto)
+    escribir_particionado(fact_material, "fact_material", manifiesto)
+
+    ruta_manifiesto.write_text(json.dumps(manifiesto, indent=2), encoding="utf-8")
+    ruta_claves.write_text(json.dumps(claves, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    print("✅ Modelo Power BI exportado correctamente.")
+    print(f"📁 Carpeta: {ruta_modelo}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
-from datetime import datetime
+from flask import Flask, Request, render_template, request, jsonify, redirect, url_for, flash, send_file, Response
+import json
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
-import pandas as pd
 import os
+import threading
+
+from indice_pedidos import IndicePedidos, MAX_SUGERENCIAS
+from repositorio_cerrados import RepositorioCerrados
+from registros_db import RegistrosDB
+from evidencias import ProcesadorEvidencias
 
 # ------------------------------------------------------------
 # CONFIGURACIÓN BASE DE FLASK
@@ -14,28 +22,71 @@ app = Flask(__name__, static_url_path='/static', static_folder='static', templat
 # Clave secreta para mensajes flash
 app.secret_key = "clave_super_secreta_ans"
 
-# Carpeta de cargas
-app.config['UPLOAD_FOLDER'] = base_dir / "static" / "uploads"
+# Carpeta de cargas (ANS_UPLOADS / ANS_FENIX_ANS / ANS_REGISTROS_DB permiten
+# apuntar a datos de prueba, p. ej. prueba_carga.py)
+app.config['UPLOAD_FOLDER'] = Path(os.environ.get("ANS_UPLOADS", base_dir / "static" / "uploads"))
 app.config['UPLOAD_FOLDER'].mkdir(parents=True, exist_ok=True)
 
+
+class RequestSubida(Request):
+    """Escribe cada archivo subido directo a un temporal dentro de UPLOAD_FOLDER
+    mientras se recibe; la vista solo lo renombra (sin copiarlo ni tenerlo en memoria)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        temporal = tempfile.NamedTemporaryFile(
+            "w+b", dir=app.config['UPLOAD_FOLDER'], prefix=".subida_", delete=False)
+        self.__dict__.setdefault("_temporales", []).append(temporal.name)
+        return temporal
+
+    def close(self):
+        super().close()
+        # Temporales que la vista no usó (duplicados, extensiones no válidas, errores)
+        for ruta in self.__dict__.get("_temporales", []):
+            Path(ruta).unlink(missing_ok=True)
+
+
+app.request_class = RequestSubida
+
+
+def guardar_subida(archivo, destino):
+    """Mueve el temporal de la subida a su nombre final (rename atómico)."""
+    temporal = getattr(archivo.stream, "name", None)
+    if isinstance(temporal, str) and os.path.exists(temporal):
+        archivo.stream.close()
+        os.replace(temporal, destino)
+    else:
+        archivo.save(destino)
+
+# ------------------------------------------------------------
+# ÍNDICE FENIX (se recarga solo cuando cambia FENIX_ANS.xlsx)
+# ------------------------------------------------------------
+ruta_fenix = Path(os.environ.get("ANS_FENIX_ANS", base_dir.parent / "data_clean" / "FENIX_ANS.xlsx"))
+# Con servidor.py (varios workers) se usa el snapshot compartido publicado en disco
+indice_fenix = IndicePedidos(ruta_fenix, carpeta_compartida=os.environ.get("ANS_SNAPSHOT_PEDIDOS")).iniciar()
+
+# Pedidos cerrados que calculos_ans.py sacó de FENIX_ANS: nivel frío, se indexa
+# en SQLite en segundo plano desde el arranque
+ruta_cerrados = Path(os.environ.get(
+    "ANS_REPOSITORIO_CERRADOS", base_dir.parent / "data_clean" / "REPOSITORIO_PEDIDOS_CERRADOS.xlsx"
+))
+repositorio_cerrados = RepositorioCerrados(ruta_cerrados).iniciar()
+
+MENSAJE_INDEXANDO = "el repositorio de pedidos cerrados se está indexando, intente de nuevo en unos minutos"
+
 # ------------------------------------------------------------
-# CARGA ARCHIVO FENIX
+# REGISTROS DEL FORMULARIO (SQLite; el xlsx se exporta bajo demanda)
 # ------------------------------------------------------------
-ruta_fenix = base_dir.parent / "data_clean" / "FENIX_ANS.xlsx"
-if ruta_fenix.exists():
-    df_fenix = pd.read_excel(ruta_fenix)
-    df_fenix.columns = df_fenix.columns.str.strip().str.upper()
-else:
-    df_fenix = pd.DataFrame()
+ruta_registros = os.environ.get("ANS_REGISTROS_DB")
+registros_db = RegistrosDB(ruta_registros, ruta_importar=None) if ruta_registros else RegistrosDB()
+
+# Validación / compresión de evidencias fuera de la petición
+procesador_evidencias = ProcesadorEvidencias(registros_db, app.config['UPLOAD_FOLDER']).reanudar_pendientes()
 
 # ------------------------------------------------------------
 # FORMULARIO PRINCIPAL
 # ------------------------------------------------------------
 @app.route("/", methods=["GET", "POST"])
 def formulario():
-    ruta_excel = base_dir / "registros_formulario.xlsx"
-    df_registros = pd.read_excel(ruta_excel) if ruta_excel.exists() else pd.DataFrame()
-
     # Si es envío del formulario (POST)
     if request.method == "POST":
         pedido = str(request.form["pedido"]).strip()
@@ -43,15 +94,22 @@ def formulario():
         estado = request.form["estado"]
 
         # 🔸 Validar duplicado
-        if not df_registros.empty and pedido in df_registros["pedido"].astype(str).values:
+        if registros_db.existe(pedido):
             flash(f"⚠ El pedido {pedido} ya fue registrado anteriormente.", "warning")
             return redirect(url_for("formulario"))
 
         # 🔸 Validar existencia en FENIX
-        df_fenix["PEDIDO"] = df_fenix["PEDIDO"].astype(str).str.strip()
-        resultado = df_fenix[df_fenix["PEDIDO"] == pedido]
+        fila = indice_fenix.buscar(pedido)
+
+        if fila is None and repositorio_cerrados.buscar(pedido) is not None:
+            flash(f"📦 El pedido {pedido} ya está cerrado (repositorio de pedidos cerrados).", "warning")
+            return redirect(url_for("formulario"))
+
+        if fila is None and repositorio_cerrados.pendiente:
+            flash(f"⏳ Pedido {pedido} no está en FENIX_ANS y {MENSAJE_INDEXANDO}.", "warning")
+            return redirect(url_for("formulario"))
 
-        if resultado.empty:
+        if fila is None:
             flash(f"❌ Pedido {pedido} no existe en FENIX_ANS. Verifique nuevamente.", "danger")
             return redirect(url_for("formulario"))
 
@@ -63,7 +121,7 @@ def formulario():
             if archivo and archivo.filename:
                 ext = archivo.filename.split(".")[-1].lower()
                 nombre_archivo = f"{pedido}_{i}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
-                archivo.save(app.config['UPLOAD_FOLDER'] / nombre_archivo)
+                guardar_subida(archivo, app.config['UPLOAD_FOLDER'] / nombre_archivo)
 
                 if ext == "pdf":
                     nombres_pdf.append(nombre_archivo)
@@ -76,7 +134,6 @@ def formulario():
 
 
               # 🔸 Registrar fila
-        fila = resultado.iloc[0]
         registro = {
             "fecha_envio": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "pedido": pedido,
@@ -84,30 +141,23 @@ def formulario():
             "estado": estado,  # ✅ valor seleccionado por el técnico
             "pdf": pdf_guardado,
             "imagenes": imagenes_guardadas,
-            "cliente": fila.get("NOMBRE_CLIENTE", ""),
-            "direccion": fila.get("DIRECCION", ""),
-            "estado_fenix": fila.get("ESTADO", ""),
-            "clienteid": fila.get("CLIENTEID", ""),
+            "cliente": fila["nombre_cliente"],
+            "direccion": fila["direccion"],
+            "estado_fenix": fila["estado_fenix"],
+            "clienteid": fila["clienteid"],
             "metodo_envio": request.form.get("metodo_envio", "")
         }
 
-        # 🔸 Crear DataFrame ordenado con columnas estándar
-        columnas = [
-            "fecha_envio", "pedido", "observacion", "estado",
-            "pdf", "imagenes", "cliente", "direccion",
-            "estado_fenix", "clienteid", "metodo_envio"
-        ]
-
-        # Si el archivo ya existe, asegúrate de mantener el orden
-        if not df_registros.empty:
-            df_registros = df_registros.reindex(columns=columnas, fill_value="")
-
-        df_final = pd.concat([df_registros, pd.DataFrame([registro])], ignore_index=True)
-        df_final.to_excel(ruta_excel, index=False)
+        # 🔸 Guardar registro (el índice único evita duplicados simultáneos)
+        if not registros_db.insertar(registro):
+            for nombre in nombres_pdf + nombres_imagenes:
+                (app.config['UPLOAD_FOLDER'] / nombre).unlink(missing_ok=True)
+            flash(f"⚠ El pedido {pedido} ya fue registrado anteriormente.", "warning")
+            return redirect(url_for("formulario"))
 
-        # 🔸 Guardar registro
-        df_final = pd.concat([df_registros, pd.DataFrame([registro])], ignore_index=True)
-        df_final.to_excel(ruta_excel, index=False)
+        # 🔸 Validar y comprimir evidencias en segundo plano
+        for nombre in nombres_pdf + nombres_imagenes:
+            procesador_evidencias.encolar(registros_db.agregar_evidencia(pedido, nombre), nombre)
 
         # 🔸 Confirmar al usuario
         flash(f"✅ Registro guardado correctamente — Pedido {pedido}", "success")
@@ -119,59 +169,206 @@ def formulario():
 # ------------------------------------------------------------
 # CONSULTA PEDIDO FENIX / REGISTROS (versión con depuración)
 # ------------------------------------------------------------
-@app.route("/buscar_pedido/<pedido_id>")
-def buscar_pedido(pedido_id):
-    pedido_id = str(pedido_id).strip()
-    print(f"🔍 Buscando pedido: {pedido_id}")  # <-- para depuración en consola
+# La respuesta solo cambia con una nueva versión de FENIX_ANS o con el registro
+# del pedido: se etiqueta (ETag / Last-Modified) y se guarda ya serializada.
+MAX_CACHE_RESPUESTAS = 4096
+
+
+class CacheLRU:
+    """Caché LRU en proceso (segura entre hilos) de respuestas JSON serializadas."""
 
-    if df_fenix.empty:
+    def __init__(self, maximo=MAX_CACHE_RESPUESTAS):
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._bloqueo = threading.Lock()
+
+    def obtener(self, clave):
+        with self._bloqueo:
+            valor = self._datos.get(clave)
+            if valor is not None:
+                self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._bloqueo:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            if len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+
+cache_respuestas = CacheLRU()
+
+
+def consultar_pedido(pedido_id, snapshot, registro):
+    """Contenido de /buscar_pedido para un snapshot FENIX y un registro (o None)."""
+    if not snapshot:
         print("❌ Archivo FENIX_ANS está vacío o no existe.")
-        return jsonify({"error": "Archivo FENIX_ANS no encontrado o vacío"})
-
-    # 1️⃣ Buscar primero en registros_formulario.xlsx
-    ruta_excel = base_dir / "registros_formulario.xlsx"
-    if ruta_excel.exists():
-        df_reg = pd.read_excel(ruta_excel)
-        df_reg["pedido"] = df_reg["pedido"].astype(str)
-
-        registro = df_reg[df_reg["pedido"] == pedido_id]
-        if not registro.empty:
-            fila = registro.iloc[0]
-            estado_real = fila.get("estado", "Sin estado")
-            print(f"📋 Encontrado en registros_formulario.xlsx con estado: {estado_real}")
-            return jsonify({
-                "origen": "registro",
-                "mensaje": f"📋 El pedido {pedido_id} ya fue registrado con estado: <strong>{estado_real}</strong>",
-                "estado_real": estado_real,
-                "observacion": fila.get("observacion", ""),
-                "metodo_envio": fila.get("metodo_envio", "")
-            })
-
-    # 2️⃣ Si no está en registros, buscar en FENIX
-    df_fenix.columns = df_fenix.columns.str.strip().str.upper()  # asegurar mayúsculas
-    df_fenix["PEDIDO"] = df_fenix["PEDIDO"].astype(str).str.strip()
-
-    resultado = df_fenix[df_fenix["PEDIDO"] == pedido_id]
-    print(f"Resultado búsqueda en FENIX → {len(resultado)} filas")
-
-    if not resultado.empty:
-        fila = resultado.iloc[0]
-        datos = {
-            "origen": "fenix",
-            "clienteid": str(fila.get("CLIENTEID", "")),
-            "nombre_cliente": str(fila.get("NOMBRE_CLIENTE", "")),
-            "telefono": str(fila.get("TELEFONO_CONTACTO", "")),
-            "celular": str(fila.get("CELULAR_CONTACTO", "")),
-            "direccion": str(fila.get("DIRECCION", "")),
-            "fecha_limite_ans": str(fila.get("FECHA_LIMITE_ANS", "")),
-            "estado_fenix": str(fila.get("ESTADO", ""))
+        return {"error": "Archivo FENIX_ANS no encontrado o vacío"}
+
+    # 1️⃣ Buscar primero en los registros del formulario
+    if registro is not None:
+        estado_real = registro.get("estado") or "Sin estado"
+        print(f"📋 Encontrado en registros del formulario con estado: {estado_real}")
+        return {
+            "origen": "registro",
+            "mensaje": f"📋 El pedido {pedido_id} ya fue registrado con estado: <strong>{estado_real}</strong>",
+            "estado_real": estado_real,
+            "observacion": registro.get("observacion", ""),
+            "metodo_envio": registro.get("metodo_envio", "")
         }
+
+    # 2️⃣ Si no está en registros, buscar en FENIX (pedidos activos)
+    fila = snapshot.buscar(pedido_id)
+
+    if fila is not None:
+        datos = {"origen": "fenix", "nivel": "activo", **fila}
         print(f"✅ Datos enviados al frontend: {datos}")
-        return jsonify(datos)
-    
+        return datos
+
+    # 3️⃣ Si no está activo, buscar en el repositorio de pedidos cerrados
+    fila = repositorio_cerrados.buscar(pedido_id)
+
+    if fila is not None:
+        print(f"📦 Pedido {pedido_id} encontrado en el repositorio de cerrados.")
+        return {
+            "origen": "fenix",
+            "nivel": "archivo",
+            "mensaje": f"📦 El pedido {pedido_id} ya está cerrado (repositorio de pedidos cerrados).",
+            **fila
+        }
+
+    if repositorio_cerrados.pendiente:
+        print("⏳ Repositorio de cerrados aún sin indexar.")
+        return {"error": f"Pedido {pedido_id} no está activo y {MENSAJE_INDEXANDO}.", "indexando": True}
 
     print("⚠ No se encontró el pedido en ningún archivo.")
-    return jsonify({"error": f"Pedido {pedido_id} no existe...."})
+    return {"error": f"Pedido {pedido_id} no existe...."}
+
+
+def ultima_modificacion(version_ns, registro):
+    fecha = datetime.fromtimestamp(version_ns / 1e9, tz=timezone.utc)
+    if registro is not None:
+        try:
+            fecha = max(fecha, datetime.strptime(registro["fecha_envio"], "%Y-%m-%d %H:%M:%S").astimezone())
+        except (TypeError, ValueError):
+            pass
+    return fecha
+
+
+@app.route("/buscar_pedido/<pedido_id>")
+def buscar_pedido(pedido_id):
+    pedido_id = str(pedido_id).strip()
+    print(f"🔍 Buscando pedido: {pedido_id}")  # <-- para depuración en consola
+
+    snapshot = indice_fenix.snapshot
+    registro = registros_db.buscar(pedido_id)
+    version_cerrados = repositorio_cerrados.vigente()
+    version = f"{snapshot.version}-{version_cerrados}-{registro['id'] if registro else 0}"
+
+    clave = (pedido_id, version)
+    cuerpo = cache_respuestas.obtener(clave)
+    if cuerpo is None:
+        cuerpo = app.json.dumps(consultar_pedido(pedido_id, snapshot, registro))
+        cache_respuestas.guardar(clave, cuerpo)
+
+    # El navegador revalida siempre; si nada cambió recibe 304 sin cuerpo
+    respuesta = Response(cuerpo, mimetype="application/json")
+    respuesta.set_etag(version)
+    respuesta.last_modified = ultima_modificacion(max(snapshot.version, version_cerrados), registro)
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+# ------------------------------------------------------------
+# CONSULTA DE VARIOS PEDIDOS (supervisores)
+# ------------------------------------------------------------
+# Pedidos resueltos por consulta al índice / base antes de enviar ese tramo
+LOTE_CONSULTA = 1000
+
+
+def pedidos_solicitados():
+    """Pedidos de ?pedidos=1,2,3 (o ?pedido= repetido) o del cuerpo POST
+    (JSON lista / {"pedidos": [...]}, formulario o texto separado por comas / saltos)."""
+    valores = request.args.getlist("pedido") + request.args.getlist("pedidos")
+    if request.method == "POST":
+        cuerpo = request.get_json(silent=True)
+        if isinstance(cuerpo, dict):
+            cuerpo = cuerpo.get("pedidos", [])
+        if isinstance(cuerpo, list):
+            valores += [str(p) for p in cuerpo]
+        elif request.form:
+            valores += request.form.getlist("pedido") + request.form.getlist("pedidos")
+        else:
+            valores.append(request.get_data(as_text=True))
+
+    pedidos = (p.strip() for v in valores for p in v.replace("\n", ",").split(","))
+    return list(dict.fromkeys(p for p in pedidos if p))  # sin vacíos ni repetidos, en orden
+
+
+def resolver_pedidos(pedidos):
+    """Genera el resultado de cada pedido: registros, luego FENIX activo y por último cerrados."""
+    for i in range(0, len(pedidos), LOTE_CONSULTA):
+        lote = pedidos[i:i + LOTE_CONSULTA]
+        registrados = registros_db.buscar_varios(lote)
+        en_fenix = indice_fenix.buscar_varios([p for p in lote if p not in registrados])
+        faltantes = [p for p in lote if p not in registrados and p not in en_fenix]
+        cerrados = repositorio_cerrados.buscar_varios(faltantes) if faltantes else {}
+        sin_archivo = "indexando" if faltantes and repositorio_cerrados.pendiente else "no existe"
+        for pedido in lote:
+            if pedido in registrados:
+                fila = registrados[pedido]
+                yield {
+                    "pedido": pedido,
+                    "origen": "registro",
+                    "estado_real": fila.get("estado") or "Sin estado",
+                    "observacion": fila.get("observacion", ""),
+                    "metodo_envio": fila.get("metodo_envio", ""),
+                }
+            elif pedido in en_fenix:
+                yield {"pedido": pedido, "origen": "fenix", "nivel": "activo", **en_fenix[pedido]}
+            elif pedido in cerrados:
+                yield {"pedido": pedido, "origen": "fenix", "nivel": "archivo", **cerrados[pedido]}
+            else:
+                yield {"pedido": pedido, "origen": sin_archivo}
+
+
+@app.route("/buscar_pedidos", methods=["GET", "POST"])
+def buscar_pedidos():
+    pedidos = pedidos_solicitados()
+    print(f"🔍 Buscando {len(pedidos)} pedidos")
+
+    # Respuesta en streaming: un arreglo JSON que se envía por tramos
+    def generar():
+        yield "["
+        for n, resultado in enumerate(resolver_pedidos(pedidos)):
+            yield ("," if n else "") + json.dumps(resultado, ensure_ascii=False)
+        yield "]"
+
+    return Response(generar(), mimetype="application/json")
+
+# ------------------------------------------------------------
+# AUTOCOMPLETADO DE PEDIDOS POR PREFIJO
+# ------------------------------------------------------------
+@app.route("/sugerir_pedido")
+def sugerir_pedido():
+    limite = min(request.args.get("k", MAX_SUGERENCIAS, type=int), 50)
+    return jsonify(indice_fenix.sugerir(request.args.get("q", ""), max(limite, 1)))
+
+# ------------------------------------------------------------
+# ESTADO DEL PROCESAMIENTO DE EVIDENCIAS
+# ------------------------------------------------------------
+@app.route("/evidencias/<pedido_id>")
+def evidencias_pedido(pedido_id):
+    return jsonify(registros_db.evidencias(pedido_id))
+
+# ------------------------------------------------------------
+# EXPORTAR REGISTROS A EXCEL (bajo demanda)
+# ------------------------------------------------------------
+@app.route("/exportar_registros")
+def exportar_registros():
+    ruta = registros_db.exportar_xlsx()
+    return send_file(ruta, as_attachment=True, download_name=ruta.name)
+
 # ------------------------------------------------------------
 # EJECUCIÓN
 # ------------------------------------------------------------
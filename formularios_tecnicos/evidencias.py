@@ -0,0 +1,142 @@
+"""
+------------------------------------------------------------
+PROCESAMIENTO DE EVIDENCIAS EN SEGUNDO PLANO
+------------------------------------------------------------
+Descripción:
+- La petición del formulario solo guarda los archivos en disco y
+  responde; el trabajo pesado pasa a un pool de hilos.
+- Cada evidencia se valida por contenido (PDF real / imagen real),
+  se calcula su SHA-256 y las imágenes se reducen a MAX_LADO px y se
+  recomprimen con Pillow (solo si el resultado es más liviano).
+- El resultado queda en la tabla `evidencias` de registros_db; las
+  pendientes de una ejecución anterior se reencolan al iniciar, y las
+  que quedaron 'procesando' porque su proceso murió se retoman cuando
+  vence el reclamo (revisión periódica en segundo plano).
+------------------------------------------------------------
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from registros_db import VENCE_RECLAMO
+
+# Lado mayor máximo de las fotos guardadas y calidad JPEG de recompresión
+MAX_LADO = 1920
+CALIDAD_JPEG = 85
+TRABAJADORES = 2
+
+EXT_IMAGEN = {"jpg", "jpeg", "png"}
+
+
+def sha256_archivo(ruta, bloque=1024 * 1024):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def es_pdf(ruta):
+    with open(ruta, "rb") as f:
+        return f.read(1024).lstrip().startswith(b"%PDF-")
+
+
+def optimizar_imagen(ruta):
+    """Reduce y recomprime la imagen en su mismo formato; devuelve (ancho, alto)."""
+    with Image.open(ruta) as img:
+        img.verify()  # levanta excepción si el archivo está dañado
+
+    with Image.open(ruta) as img:
+        formato = img.format
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MAX_LADO, MAX_LADO))
+
+        temporal = ruta.with_name(ruta.name + ".tmp")
+        if formato == "JPEG":
+            img.convert("RGB").save(temporal, "JPEG", quality=CALIDAD_JPEG, optimize=True)
+        else:
+            img.save(temporal, formato, optimize=True)
+        ancho, alto = img.size
+
+    # Solo se reemplaza si el archivo nuevo pesa menos
+    if temporal.stat().st_size < ruta.stat().st_size:
+        os.replace(temporal, ruta)
+    else:
+        temporal.unlink()
+    return ancho, alto
+
+
+def procesar_evidencia(ruta):
+    """Valida, optimiza y describe un archivo de evidencia (campos para la BD)."""
+    ruta = Path(ruta)
+    ext = ruta.suffix.lower().lstrip(".")
+    resultado = {"bytes_original": ruta.stat().st_size}
+
+    if ext == "pdf":
+        resultado["tipo"] = "pdf"
+        if not es_pdf(ruta):
+            return {**resultado, "estado": "invalido", "detalle": "El archivo no es un PDF válido",
+                    "sha256": sha256_archivo(ruta), "bytes_final": ruta.stat().st_size}
+    elif ext in EXT_IMAGEN:
+        resultado["tipo"] = "imagen"
+        try:
+            resultado["ancho"], resultado["alto"] = optimizar_imagen(ruta)
+        except (UnidentifiedImageError, OSError, SyntaxError) as e:
+            return {**resultado, "estado": "invalido", "detalle": f"Imagen no válida: {e}",
+                    "sha256": sha256_archivo(ruta), "bytes_final": ruta.stat().st_size}
+    else:
+        resultado["tipo"] = ext or "desconocido"
+
+    return {**resultado, "estado": "procesado", "sha256": sha256_archivo(ruta),
+            "bytes_final": ruta.stat().st_size}
+
+
+class ProcesadorEvidencias:
+    """Pool de hilos que procesa evidencias y anota el resultado en registros_db."""
+
+    def __init__(self, registros_db, carpeta, trabajadores=TRABAJADORES):
+        self.db = registros_db
+        self.carpeta = Path(carpeta)
+        self.pool = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="evidencias")
+
+    def encolar(self, id_evidencia, archivo):
+        return self.pool.submit(self._procesar, id_evidencia, archivo)
+
+    def reanudar_pendientes(self, cada=VENCE_RECLAMO):
+        """Reencola las pendientes y las de reclamo vencido; repite cada `cada` segundos."""
+        self._reencolar()
+        threading.Thread(target=self._vigilar, args=(cada,), daemon=True,
+                         name="evidencias-reanudar").start()
+        return self
+
+    def _reencolar(self):
+        # Una evidencia encolada dos veces es inofensiva: solo un worker la reclama
+        pendientes = self.db.evidencias_pendientes()
+        for ev in pendientes:
+            self.encolar(ev["id"], ev["archivo"])
+        if pendientes:
+            print(f"🔁 {len(pendientes)} evidencias pendientes reencoladas.")
+
+    def _vigilar(self, cada):
+        while True:
+            time.sleep(cada)
+            self._reencolar()
+
+    def _procesar(self, id_evidencia, archivo):
+        # Con varios procesos servidor, cada evidencia la procesa solo quien la reclama
+        if not self.db.reclamar_evidencia(id_evidencia):
+            return None
+        ruta = self.carpeta / archivo
+        try:
+            campos = procesar_evidencia(ruta)
+        except Exception as e:
+            campos = {"estado": "error", "detalle": str(e)}
+            print(f"⚠️ Error procesando evidencia {archivo}: {e}")
+        self.db.actualizar_evidencia(id_evidencia, **campos)
+        return campos
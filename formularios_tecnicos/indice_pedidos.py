@@ -0,0 +1,256 @@
+"""
+------------------------------------------------------------
+ÍNDICE DE PEDIDOS FENIX PARA EL FORMULARIO TÉCNICO
+------------------------------------------------------------
+Descripción:
+- Construye desde FENIX_ANS.xlsx un índice PEDIDO → registro compacto
+  (solo los campos que usa el formulario): búsquedas O(1).
+- Un hilo en segundo plano revisa la fecha de modificación del archivo;
+  si cambió, reconstruye el índice fuera de las peticiones y lo
+  reemplaza con una sola asignación (las búsquedas nunca ven un
+  índice a medio construir).
+- Modo compartido (servidor.py, varios procesos): el índice se publica
+  una vez en disco (claves .npy + registros Arrow) y cada worker lo abre
+  con memory-map de solo lectura; cambiar el puntero ACTUAL actualiza a
+  todos los workers a la vez sin copiar los datos por proceso.
+- Autocompletado por prefijo: búsqueda binaria sobre las claves
+  ordenadas (se reconstruyen junto con cada snapshot).
+------------------------------------------------------------
+"""
+
+import os
+import shutil
+from bisect import bisect_left
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Columna FENIX → clave del registro compacto
+CAMPOS = {
+    "CLIENTEID": "clienteid",
+    "NOMBRE_CLIENTE": "nombre_cliente",
+    "TELEFONO_CONTACTO": "telefono",
+    "CELULAR_CONTACTO": "celular",
+    "DIRECCION": "direccion",
+    "FECHA_LIMITE_ANS": "fecha_limite_ans",
+    "ESTADO": "estado_fenix",
+}
+
+# Campos devueltos por el autocompletado y máximo de sugerencias por consulta
+CAMPOS_SUGERENCIA = ["nombre_cliente", "direccion"]
+MAX_SUGERENCIAS = 10
+
+# Segundos entre revisiones de la fecha de modificación de FENIX_ANS.xlsx
+INTERVALO_REVISION = 5
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    registros: dict    # pedido → registro compacto
+    claves: tuple      # pedidos ordenados
+    version: int       # mtime (ns) del archivo leído; 0 = sin archivo
+
+    def buscar(self, pedido):
+        return self.registros.get(pedido)
+
+    def buscar_varios(self, pedidos):
+        """pedido → registro para los pedidos encontrados."""
+        return {p: self.registros[p] for p in pedidos if p in self.registros}
+
+    def sugerir(self, prefijo, limite=MAX_SUGERENCIAS):
+        """Primeros `limite` pedidos (en orden) que empiezan por `prefijo`."""
+        inicio = bisect_left(self.claves, prefijo)
+        fin = min(bisect_left(self.claves, prefijo + "\uffff", lo=inicio), inicio + limite)
+        return [
+            {"pedido": p, **{c: self.registros[p][c] for c in CAMPOS_SUGERENCIA}}
+            for p in self.claves[inicio:fin]
+        ]
+
+    def __len__(self):
+        return len(self.registros)
+
+
+SNAPSHOT_VACIO = Snapshot(registros={}, claves=(), version=0)
+
+
+def leer_campos(ruta):
+    """Lee de un xlsx con formato FENIX solo PEDIDO + CAMPOS; devuelve (pedidos, registros compactos)."""
+    columnas = {"PEDIDO", *CAMPOS}
+    df = pd.read_excel(ruta, dtype=str, usecols=lambda c: str(c).strip().upper() in columnas)
+    df.columns = df.columns.str.strip().str.upper()
+
+    df["PEDIDO"] = df["PEDIDO"].astype(str).str.strip()
+    df = df.drop_duplicates(subset=["PEDIDO"], keep="first")
+    for col in CAMPOS:
+        if col not in df.columns:
+            df[col] = ""
+
+    return df["PEDIDO"], df[list(CAMPOS)].rename(columns=CAMPOS).fillna("")
+
+
+def leer_snapshot(ruta):
+    """Lee FENIX_ANS.xlsx (solo columnas necesarias) y arma el índice."""
+    version = ruta.stat().st_mtime_ns
+    pedidos, compacto = leer_campos(ruta)
+    registros = dict(zip(pedidos, compacto.to_dict("records")))
+    return Snapshot(registros=registros, claves=tuple(sorted(registros)), version=version)
+
+
+# ------------------------------------------------------------
+# SNAPSHOT COMPARTIDO EN DISCO (memory-map, solo lectura)
+# ------------------------------------------------------------
+def publicar_snapshot(snapshot, carpeta):
+    """Escribe el snapshot en carpeta/v<version>/ y mueve el puntero ACTUAL."""
+    import pyarrow as pa
+
+    carpeta = Path(carpeta)
+    nombre = f"v{snapshot.version}"
+    destino = carpeta / nombre
+    if not destino.exists():
+        temporal = carpeta / f".{nombre}.{os.getpid()}"
+        temporal.mkdir(parents=True, exist_ok=True)
+
+        np.save(temporal / "claves.npy", np.array(snapshot.claves, dtype=str))
+        columnas = {"pedido": list(snapshot.claves)}
+        for campo in CAMPOS.values():
+            columnas[campo] = [snapshot.registros[p][campo] for p in snapshot.claves]
+        tabla = pa.table({c: pa.array(v, type=pa.string()) for c, v in columnas.items()})
+        with pa.OSFile(str(temporal / "registros.arrow"), "wb") as f, pa.ipc.new_file(f, tabla.schema) as w:
+            w.write_table(tabla)
+
+        os.replace(temporal, destino)
+
+    # Puntero atómico: los workers leen ACTUAL y abren esa versión
+    puntero = carpeta / f".ACTUAL.{os.getpid()}"
+    puntero.write_text(nombre, encoding="utf-8")
+    os.replace(puntero, carpeta / "ACTUAL")
+
+    # Se conservan la versión actual y la anterior (workers que aún no cambian)
+    versiones = sorted((d for d in carpeta.glob("v*") if d.is_dir()), key=lambda d: int(d.name[1:]))
+    for viejo in versiones[:-2]:
+        if viejo != destino:
+            shutil.rmtree(viejo, ignore_errors=True)
+    return destino
+
+
+def version_publicada(carpeta):
+    try:
+        return int((Path(carpeta) / "ACTUAL").read_text(encoding="utf-8").strip()[1:])
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+class SnapshotCompartido:
+    """Snapshot publicado por publicar_snapshot, abierto con memory-map.
+
+    Las claves se buscan con búsqueda binaria sobre el .npy y el registro se
+    lee de la tabla Arrow: ningún worker copia el índice a su memoria."""
+
+    def __init__(self, carpeta, version):
+        import pyarrow as pa
+
+        ruta = Path(carpeta) / f"v{version}"
+        self.version = version
+        self.claves = np.load(ruta / "claves.npy", mmap_mode="r")
+        self.tabla = pa.ipc.open_file(pa.memory_map(str(ruta / "registros.arrow"), "r")).read_all()
+
+    def buscar(self, pedido):
+        i = int(np.searchsorted(self.claves, pedido))
+        if i < len(self.claves) and self.claves[i] == pedido:
+            registro = self.tabla.slice(i, 1).to_pylist()[0]
+            registro.pop("pedido")
+            return registro
+        return None
+
+    def buscar_varios(self, pedidos):
+        """Una búsqueda binaria vectorizada y una sola lectura de la tabla para todo el lote."""
+        pedidos = np.asarray(list(pedidos), dtype=str)
+        if not len(pedidos) or not len(self.claves):
+            return {}
+        posiciones = np.minimum(np.searchsorted(self.claves, pedidos), len(self.claves) - 1)
+        encontrados = self.claves[posiciones] == pedidos
+        filas = self.tabla.take(posiciones[encontrados]).to_pylist()
+        for registro in filas:
+            registro.pop("pedido")
+        return dict(zip(pedidos[encontrados].tolist(), filas))
+
+    def sugerir(self, prefijo, limite=MAX_SUGERENCIAS):
+        inicio, fin = np.searchsorted(self.claves, [prefijo, prefijo + "\uffff"])
+        fin = min(int(fin), int(inicio) + limite)
+        return self.tabla.select(["pedido", *CAMPOS_SUGERENCIA]).slice(inicio, fin - inicio).to_pylist()
+
+    def __len__(self):
+        return len(self.claves)
+
+
+class IndicePedidos:
+    """Índice de FENIX_ANS con recarga automática cuando cambia el archivo."""
+
+    def __init__(self, ruta, intervalo=INTERVALO_REVISION, carpeta_compartida=None):
+        self.ruta = Path(ruta)
+        self.intervalo = intervalo
+        # Con carpeta compartida se sigue el snapshot publicado en vez del xlsx
+        self.carpeta_compartida = Path(carpeta_compartida) if carpeta_compartida else None
+        self.snapshot = SNAPSHOT_VACIO
+        self._bloqueo = threading.Lock()
+        self._hilo = None
+
+    def version_archivo(self):
+        if self.carpeta_compartida is not None:
+            return version_publicada(self.carpeta_compartida)
+        try:
+            return self.ruta.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def recargar_si_cambio(self):
+        """Reconstruye el índice si el archivo cambió; devuelve True si hubo cambio."""
+        version = self.version_archivo()
+        if version == self.snapshot.version:
+            return False
+
+        with self._bloqueo:
+            if version == self.snapshot.version:
+                return False
+            try:
+                if not version:
+                    nuevo = SNAPSHOT_VACIO
+                elif self.carpeta_compartida is not None:
+                    nuevo = SnapshotCompartido(self.carpeta_compartida, version)
+                else:
+                    nuevo = leer_snapshot(self.ruta)
+            except Exception as e:
+                # Excel puede estar escribiendo el archivo: se reintenta en la próxima revisión
+                print(f"⚠️ No se pudo recargar FENIX_ANS, se mantiene la versión anterior: {e}")
+                return False
+
+            self.snapshot = nuevo
+            print(f"🔄 Índice FENIX_ANS actualizado: {len(nuevo)} pedidos.")
+            return True
+
+    def iniciar(self):
+        """Carga inicial y arranque del hilo de revisión (idempotente)."""
+        self.recargar_si_cambio()
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._vigilar, name="recarga_fenix", daemon=True)
+            self._hilo.start()
+        return self
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.recargar_si_cambio()
+
+    def buscar(self, pedido):
+        return self.snapshot.buscar(str(pedido).strip())
+
+    def buscar_varios(self, pedidos):
+        return self.snapshot.buscar_varios([str(p).strip() for p in pedidos])
+
+    def sugerir(self, prefijo, limite=MAX_SUGERENCIAS):
+        prefijo = str(prefijo).strip()
+        return self.snapshot.sugerir(prefijo, limite) if prefijo else []
@@ -0,0 +1,284 @@
+"""
+------------------------------------------------------------
+PRUEBA DE CARGA – FORMULARIO TÉCNICO ANS
+------------------------------------------------------------
+Descripción:
+- Genera en una carpeta temporal un FENIX_ANS sintético (tamaño
+  configurable) y evidencias de tamaño realista (fotos de celular
+  ~2-3 MB y PDF), sin tocar data_clean ni los registros reales.
+- Simula N técnicos concurrentes: cada envío hace /buscar_pedido y
+  luego POST / con sus evidencias. Una fracción de pedidos se envía
+  dos veces a la vez (cierre de turno) para probar los duplicados.
+- Modo cliente (por defecto): test client de Flask dentro del proceso.
+  Modo --servidor: levanta gunicorn / waitress con N workers
+  (servidor.py) y lo recorre por HTTP.
+- Reporta latencias p50/p95/p99, peticiones/segundo, tasa de error y
+  chequeos de escrituras perdidas contra la base de registros.
+
+Uso:
+  python prueba_carga.py --pedidos 20000 --tecnicos 30 --envios 10
+  python prueba_carga.py --servidor --workers 4 --tecnicos 30
+------------------------------------------------------------
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+# Pedidos sintéticos fuera del rango de los pedidos reales
+PRIMER_PEDIDO = 90_000_000
+ESTADOS_CAMPO = ["Ejecutado en Campo", "Descartado", "Pendiente Visita"]
+ESTADOS_FENIX = ["VENCIDO", "A TIEMPO", "POR VENCER"]
+
+# Foto de celular de 8 MP (~2.5 MB en JPEG) y PDF escaneado
+LADOS_FOTO = (3264, 2448)
+KB_PDF = 350
+
+# ------------------------------------------------------------
+# DATOS SINTÉTICOS
+# ------------------------------------------------------------
+def generar_fenix(ruta, n):
+    rng = np.random.default_rng(7)
+    pedidos = np.arange(PRIMER_PEDIDO, PRIMER_PEDIDO + n).astype(str)
+    limite = pd.Timestamp.now().normalize() + pd.to_timedelta(rng.integers(-240, 240, n), unit="h")
+    pd.DataFrame({
+        "PEDIDO": pedidos,
+        "CLIENTEID": rng.integers(10_000_000, 99_999_999, n).astype(str),
+        "NOMBRE_CLIENTE": np.char.add("CLIENTE PRUEBA ", pedidos),
+        "TELEFONO_CONTACTO": rng.integers(2_000_000, 9_999_999, n).astype(str),
+        "CELULAR_CONTACTO": rng.integers(3_000_000_000, 3_299_999_999, n).astype(str),
+        "DIRECCION": [f"CL {a} CR {b} -{c}" for a, b, c in rng.integers(1, 120, (n, 3))],
+        "FECHA_LIMITE_ANS": limite.strftime("%Y-%m-%d %H:%M:%S"),
+        "ESTADO": rng.choice(ESTADOS_FENIX, n),
+    }).to_excel(ruta, index=False)
+    return pedidos.tolist()
+
+
+def generar_foto(semilla):
+    rng = np.random.default_rng(semilla)
+    ancho, alto = LADOS_FOTO
+    base = np.linspace(40, 220, ancho, dtype=np.float32)[None, :, None]
+    pixeles = np.clip(base + rng.normal(0, 12, (alto, ancho, 3)).astype(np.float32), 0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(pixeles.astype(np.uint8)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def generar_pdf():
+    return b"%PDF-1.4\n" + os.urandom(KB_PDF * 1024) + b"\n%%EOF\n"
+
+# ------------------------------------------------------------
+# CLIENTES (test client de Flask / HTTP)
+# ------------------------------------------------------------
+class ClienteFlask:
+    def __init__(self, app):
+        self.app = app
+
+    def buscar(self, pedido):
+        return self.app.test_client().get(f"/buscar_pedido/{pedido}").status_code
+
+    def registrar(self, campos, archivos):
+        datos = {**campos, "archivos_evidencia": [(io.BytesIO(b), nombre) for nombre, b in archivos]}
+        return self.app.test_client().post("/", data=datos, content_type="multipart/form-data").status_code
+
+
+class _SinRedireccion(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHTTP:
+    def __init__(self, url_base):
+        self.url_base = url_base
+        self.abrir = urllib.request.build_opener(_SinRedireccion).open
+
+    def _pedir(self, peticion):
+        try:
+            with self.abrir(peticion, timeout=120) as r:
+                r.read()
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def buscar(self, pedido):
+        return self._pedir(f"{self.url_base}/buscar_pedido/{pedido}")
+
+    def registrar(self, campos, archivos):
+        limite = uuid.uuid4().hex
+        partes = [
+            f'--{limite}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+            for k, v in campos.items()
+        ]
+        for nombre, contenido in archivos:
+            partes.append(
+                f'--{limite}\r\nContent-Disposition: form-data; name="archivos_evidencia"; '
+                f'filename="{nombre}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+                + contenido + b"\r\n"
+            )
+        cuerpo = b"".join(partes) + f"--{limite}--\r\n".encode()
+        return self._pedir(urllib.request.Request(
+            f"{self.url_base}/", data=cuerpo, method="POST",
+            headers={"Content-Type": f"multipart/form-data; boundary={limite}"},
+        ))
+
+# ------------------------------------------------------------
+# CARGA Y REPORTE
+# ------------------------------------------------------------
+def ejecutar_carga(cliente, envios, tecnicos, fotos, pdf):
+    """Ejecuta los envíos con `tecnicos` hilos; devuelve mediciones y segundos."""
+    mediciones = []  # (tipo, segundos, estado HTTP o None si hubo excepción)
+
+    def medir(tipo, funcion, *args):
+        t0 = time.perf_counter()
+        try:
+            estado = funcion(*args)
+        except Exception:
+            estado = None
+        mediciones.append((tipo, time.perf_counter() - t0, estado))
+
+    def enviar(pedido):
+        medir("buscar_pedido", cliente.buscar, pedido)
+        archivos = [(f"foto_{i}.jpg", random.choice(fotos)) for i in range(random.randint(1, 3))]
+        archivos.append(("acta.pdf", pdf))
+        campos = {
+            "pedido": pedido,
+            "observacion": f"Prueba de carga {pedido}",
+            "estado": random.choice(ESTADOS_CAMPO),
+            "metodo_envio": "Formulario",
+        }
+        medir("registrar", cliente.registrar, campos, archivos)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=tecnicos) as pool:
+        list(pool.map(enviar, envios))
+    return mediciones, time.perf_counter() - inicio
+
+
+def esperar_evidencias(ruta_db, limite=300):
+    """Espera a que el pool de evidencias termine; devuelve conteo por estado."""
+    inicio = time.time()
+    while True:
+        with contextlib.closing(sqlite3.connect(ruta_db, timeout=10)) as con:
+            conteo = dict(con.execute("SELECT estado, COUNT(*) FROM evidencias GROUP BY estado").fetchall())
+        if not (conteo.get("pendiente") or conteo.get("procesando")) or time.time() - inicio > limite:
+            return conteo
+        time.sleep(0.5)
+
+
+def verificar_registros(ruta_db, carpeta_uploads, esperados):
+    with contextlib.closing(sqlite3.connect(ruta_db, timeout=10)) as con:
+        en_base = [p for (p,) in con.execute("SELECT pedido FROM registros")]
+        archivos_base = {a for (a,) in con.execute("SELECT archivo FROM evidencias")}
+    archivos_disco = {p.name for p in Path(carpeta_uploads).iterdir() if p.is_file()}
+    return {
+        "registros esperados": len(esperados),
+        "registros en base": len(en_base),
+        "escrituras perdidas": len(set(esperados) - set(en_base)),
+        "pedidos repetidos en base": len(en_base) - len(set(en_base)),
+        "evidencias sin archivo": len(archivos_base - archivos_disco),
+        "archivos sin registro": len(archivos_disco - archivos_base),
+    }
+
+
+def reportar(mediciones, segundos, evidencias, segundos_evidencias, chequeos):
+    df = pd.DataFrame(mediciones, columns=["tipo", "segundos", "estado"])
+    esperado = {"buscar_pedido": [200, 304], "registrar": [302, 303]}
+    df["error"] = [e not in esperado[t] for t, e in zip(df["tipo"], df["estado"])]
+
+    print("------------------------------------------------------------")
+    print(f"📈 Peticiones: {len(df)} en {segundos:.1f} s → {len(df) / segundos:.1f} peticiones/segundo")
+    for tipo, grupo in df.groupby("tipo"):
+        p50, p95, p99 = np.percentile(grupo["segundos"] * 1000, [50, 95, 99])
+        print(f"⏱️ {tipo:<14} n={len(grupo):<6} p50 {p50:7.1f} ms | p95 {p95:7.1f} ms | "
+              f"p99 {p99:7.1f} ms | errores {grupo['error'].mean():.1%}")
+    print(f"🖼️ Evidencias: {evidencias} (cola vaciada {segundos_evidencias:.1f} s después de la carga)")
+    for nombre, valor in chequeos.items():
+        print(f"   {'✅' if valor == 0 or nombre.startswith('registros') else '❌'} {nombre}: {valor}")
+    print("------------------------------------------------------------")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del formulario técnico ANS")
+    parser.add_argument("--pedidos", type=int, default=20_000, help="tamaño del FENIX_ANS sintético")
+    parser.add_argument("--tecnicos", type=int, default=30, help="técnicos concurrentes")
+    parser.add_argument("--envios", type=int, default=10, help="envíos por técnico")
+    parser.add_argument("--duplicados", type=float, default=0.1, help="fracción de pedidos enviados dos veces")
+    parser.add_argument("--servidor", action="store_true", help="probar contra gunicorn / waitress local")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--puerto", type=int, default=8050)
+    parser.add_argument("--conservar", action="store_true", help="no borrar la carpeta temporal")
+    args = parser.parse_args(argv)
+
+    carpeta = Path(tempfile.mkdtemp(prefix="prueba_carga_ans_"))
+    ruta_fenix, ruta_db, uploads = carpeta / "FENIX_ANS.xlsx", carpeta / "registros.db", carpeta / "uploads"
+    uploads.mkdir()
+    os.environ.update(
+        ANS_FENIX_ANS=str(ruta_fenix), ANS_REGISTROS_DB=str(ruta_db), ANS_UPLOADS=str(uploads),
+        ANS_REPOSITORIO_CERRADOS=str(carpeta / "REPOSITORIO_PEDIDOS_CERRADOS.xlsx"),
+    )
+    os.environ.pop("ANS_SNAPSHOT_PEDIDOS", None)
+
+    print(f"🧪 Generando FENIX_ANS sintético con {args.pedidos} pedidos en {carpeta}...")
+    pedidos = generar_fenix(ruta_fenix, args.pedidos)
+    fotos = [generar_foto(i) for i in range(3)]
+    pdf = generar_pdf()
+
+    unicos = random.sample(pedidos, min(len(pedidos), args.tecnicos * args.envios))
+    envios = unicos + unicos[:int(len(unicos) * args.duplicados)]
+    random.shuffle(envios)
+
+    proceso = None
+    try:
+        with open(os.devnull, "w", encoding="utf-8") as nulo, contextlib.redirect_stdout(nulo):
+            if args.servidor:
+                from servidor import comando_servidor, esperar_servidor
+
+                proceso = subprocess.Popen(
+                    comando_servidor(args.workers, args.puerto), cwd=Path(__file__).resolve().parent,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                url_base = f"http://127.0.0.1:{args.puerto}"
+                esperar_servidor(url_base + "/")
+                cliente = ClienteHTTP(url_base)
+            else:
+                import app as formulario
+
+                cliente = ClienteFlask(formulario.app)
+
+        print(f"🚀 {len(envios)} envíos de {args.tecnicos} técnicos concurrentes...")
+        with open(os.devnull, "w", encoding="utf-8") as nulo, contextlib.redirect_stdout(nulo):
+            mediciones, segundos = ejecutar_carga(cliente, envios, args.tecnicos, fotos, pdf)
+            inicio = time.perf_counter()
+            evidencias = esperar_evidencias(ruta_db)
+            segundos_evidencias = time.perf_counter() - inicio
+
+        reportar(mediciones, segundos, evidencias, segundos_evidencias,
+                 verificar_registros(ruta_db, uploads, unicos))
+    finally:
+        if proceso is not None and proceso.poll() is None:
+            proceso.terminate()
+            proceso.wait(timeout=15)
+        if args.conservar:
+            print(f"📂 Datos de la prueba conservados en {carpeta}")
+        else:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+------------------------------------------------------------
+REGISTROS DEL FORMULARIO TÉCNICO (SQLite)
+------------------------------------------------------------
+Descripción:
+- Guarda cada envío del formulario como un INSERT en una base SQLite
+  en modo WAL (lecturas y escrituras concurrentes sin bloquearse).
+- Índice único por pedido: la validación de duplicados es una búsqueda
+  indexada y dos técnicos simultáneos no pueden pisarse.
+- registros_formulario.xlsx pasa a ser una exportación bajo demanda
+  (ruta /exportar_registros o `python registros_db.py`).
+- La primera vez importa el registros_formulario.xlsx existente.
+------------------------------------------------------------
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+base_dir = Path(__file__).resolve().parent
+ruta_db = base_dir / "registros_formulario.db"
+ruta_excel = base_dir / "registros_formulario.xlsx"
+
+COLUMNAS = [
+    "fecha_envio", "pedido", "observacion", "estado",
+    "pdf", "imagenes", "cliente", "direccion",
+    "estado_fenix", "clienteid", "metodo_envio"
+]
+
+ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS registros (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {", ".join(f"{c} TEXT" for c in COLUMNAS)}
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_registros_pedido ON registros (pedido);
+
+CREATE TABLE IF NOT EXISTS evidencias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pedido TEXT NOT NULL,
+    archivo TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    tipo TEXT,
+    sha256 TEXT,
+    bytes_original INTEGER,
+    bytes_final INTEGER,
+    ancho INTEGER,
+    alto INTEGER,
+    detalle TEXT,
+    reclamada_en REAL
+);
+CREATE INDEX IF NOT EXISTS ix_evidencias_pedido ON evidencias (pedido);
+CREATE INDEX IF NOT EXISTS ix_evidencias_estado ON evidencias (estado);
+"""
+
+CAMPOS_EVIDENCIA = ["estado", "tipo", "sha256", "bytes_original", "bytes_final", "ancho", "alto", "detalle"]
+
+# Segundos tras los que una evidencia 'procesando' se da por abandonada (el
+# proceso que la reclamó murió) y otro worker puede volver a tomarla
+VENCE_RECLAMO = 600
+
+
+class RegistrosDB:
+    """Acceso a la base de registros (una conexión por hilo)."""
+
+    def __init__(self, ruta=ruta_db, ruta_importar=ruta_excel):
+        self.ruta = Path(ruta)
+        self._local = threading.local()
+        with self.conexion() as con:
+            con.executescript(ESQUEMA)
+            # Bases creadas antes de que existiera el vencimiento del reclamo
+            columnas = {f["name"] for f in con.execute("PRAGMA table_info(evidencias)")}
+            if "reclamada_en" not in columnas:
+                con.execute("ALTER TABLE evidencias ADD COLUMN reclamada_en REAL")
+        if ruta_importar is not None:
+            self.importar_xlsx(ruta_importar)
+
+    def conexion(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=10)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    # ------------------------------------------------------------
+    # ESCRITURA
+    # ------------------------------------------------------------
+    def insertar(self, registro):
+        """Inserta un envío; devuelve False si el pedido ya estaba registrado."""
+        valores = [str(registro.get(c, "")) for c in COLUMNAS]
+        try:
+            with self.conexion() as con:
+                con.execute(
+                    f"INSERT INTO registros ({', '.join(COLUMNAS)}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNAS))})",
+                    valores,
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def agregar_evidencia(self, pedido, archivo):
+        """Registra un archivo recibido (estado 'pendiente'); devuelve su id."""
+        with self.conexion() as con:
+            cursor = con.execute(
+                "INSERT INTO evidencias (pedido, archivo) VALUES (?, ?)", (str(pedido), archivo)
+            )
+        return cursor.lastrowid
+
+    def reclamar_evidencia(self, id_evidencia, vence=VENCE_RECLAMO):
+        """Marca la evidencia como 'procesando' si seguía pendiente o si su reclamo
+        anterior venció (un solo worker la toma)."""
+        ahora = time.time()
+        with self.conexion() as con:
+            cursor = con.execute(
+                "UPDATE evidencias SET estado = 'procesando', reclamada_en = ? "
+                "WHERE id = ? AND (estado = 'pendiente' "
+                "OR (estado = 'procesando' AND COALESCE(reclamada_en, 0) < ?))",
+                (ahora, id_evidencia, ahora - vence),
+            )
+        return cursor.rowcount == 1
+
+    def actualizar_evidencia(self, id_evidencia, **campos):
+        campos = {c: v for c, v in campos.items() if c in CAMPOS_EVIDENCIA}
+        with self.conexion() as con:
+            con.execute(
+                f"UPDATE evidencias SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?",
+                [*campos.values(), id_evidencia],
+            )
+
+    def importar_xlsx(self, ruta):
+        """Migra un registros_formulario.xlsx previo si la base está vacía."""
+        ruta = Path(ruta)
+        if not ruta.exists() or self.total() > 0:
+            return 0
+        df = pd.read_excel(ruta, dtype=str).reindex(columns=COLUMNAS).fillna("")
+        with self.conexion() as con:
+            con.executemany(
+                f"INSERT OR IGNORE INTO registros ({', '.join(COLUMNAS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNAS))})",
+                df.itertuples(index=False, name=None),
+            )
+        print(f"📥 {len(df)} registros importados desde {ruta.name}.")
+        return len(df)
+
+    # ------------------------------------------------------------
+    # LECTURA
+    # ------------------------------------------------------------
+    def buscar(self, pedido):
+        fila = self.conexion().execute(
+            "SELECT * FROM registros WHERE pedido = ?", (str(pedido).strip(),)
+        ).fetchone()
+        return dict(fila) if fila else None
+
+    def buscar_varios(self, pedidos, lote=500):
+        """pedido → registro para los pedidos ya registrados (consultas IN por lotes)."""
+        pedidos = [str(p).strip() for p in pedidos]
+        encontrados = {}
+        for i in range(0, len(pedidos), lote):
+            parte = pedidos[i:i + lote]
+            filas = self.conexion().execute(
+                f"SELECT * FROM registros WHERE pedido IN ({', '.join('?' * len(parte))})", parte
+            ).fetchall()
+            encontrados.update((f["pedido"], dict(f)) for f in filas)
+        return encontrados
+
+    def existe(self, pedido):
+        return self.conexion().execute(
+            "SELECT 1 FROM registros WHERE pedido = ?", (str(pedido).strip(),)
+        ).fetchone() is not None
+
+    def evidencias(self, pedido):
+        filas = self.conexion().execute(
+            "SELECT * FROM evidencias WHERE pedido = ? ORDER BY id", (str(pedido).strip(),)
+        ).fetchall()
+        return [dict(f) for f in filas]
+
+    def evidencias_pendientes(self, vence=VENCE_RECLAMO):
+        """Pendientes y 'procesando' con el reclamo vencido (su proceso se cayó)."""
+        filas = self.conexion().execute(
+            "SELECT id, pedido, archivo FROM evidencias WHERE estado = 'pendiente' "
+            "OR (estado = 'procesando' AND COALESCE(reclamada_en, 0) < ?) ORDER BY id",
+            (time.time() - vence,),
+        ).fetchall()
+        return [dict(f) for f in filas]
+
+    def total(self):
+        return self.conexion().execute("SELECT COUNT(*) FROM registros").fetchone()[0]
+
+    def exportar_xlsx(self, ruta=ruta_excel):
+        """Genera registros_formulario.xlsx con todos los envíos (orden de llegada)."""
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLUMNAS)} FROM registros ORDER BY id", self.conexion()
+        )
+        df.to_excel(ruta, index=False)
+        return Path(ruta)
+
+
+if __name__ == "__main__":
+    ruta = RegistrosDB().exportar_xlsx()
+    print(f"✅ Registros exportados: {ruta}")
@@ -0,0 +1,226 @@
+"""
+------------------------------------------------------------
+REPOSITORIO DE PEDIDOS CERRADOS (nivel frío de la búsqueda)
+------------------------------------------------------------
+Descripción:
+- calculos_ans.py saca de FENIX_ANS los pedidos cerrados y los archiva en
+  REPOSITORIO_PEDIDOS_CERRADOS.xlsx, así que el índice en memoria (nivel
+  activo) deja de conocerlos.
+- Cuando un pedido no está en el índice activo se consulta aquí: un
+  SQLite indexado por pedido (REPOSITORIO_PEDIDOS_CERRADOS.db) que se
+  construye en segundo plano al iniciar, leyendo del xlsx solo las
+  columnas del formulario. Las búsquedas nunca leen el xlsx: hasta que
+  exista el primer índice responden "indexando" (`pendiente`).
+- Si el xlsx cambia, el SQLite se reconstruye en segundo plano y se
+  reemplaza de forma atómica; mientras tanto responde la versión anterior.
+- Si la construcción falla (p. ej. Excel tiene el archivo abierto) se
+  reintenta con espera creciente, no en cada búsqueda.
+- Con varios procesos (servidor.py) solo uno construye: lo marca creando
+  `.REPOSITORIO_PEDIDOS_CERRADOS.db.lock`; los demás siguen `pendiente`
+  (o con la versión anterior) y toman el SQLite cuando aparece.
+------------------------------------------------------------
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from indice_pedidos import CAMPOS, INTERVALO_REVISION, leer_campos
+
+# Espera máxima (segundos) entre reintentos tras un fallo al indexar
+ESPERA_MAXIMA_REINTENTO = 900
+# Un bloqueo entre procesos más viejo que esto es de un proceso que murió construyendo
+VENCE_BLOQUEO = 1800
+
+
+class RepositorioCerrados:
+    """Búsquedas por pedido sobre el repositorio de cerrados indexado en SQLite."""
+
+    def __init__(self, ruta_xlsx, ruta_db=None, intervalo=INTERVALO_REVISION):
+        self.ruta_xlsx = Path(ruta_xlsx)
+        self.ruta_db = Path(ruta_db) if ruta_db else self.ruta_xlsx.with_suffix(".db")
+        self.ruta_bloqueo = self.ruta_db.with_name(f".{self.ruta_db.name}.lock")
+        self.intervalo = intervalo
+        self.version = 0  # mtime (ns) del xlsx con que se construyó el SQLite en uso
+        self._version_xlsx = 0
+        self._revisado = None
+        self._reconstruyendo = False
+        self._fallos = 0
+        self._version_en_espera = 0
+        self._revisar_en = 0.0  # time.monotonic() desde el que se vuelve a intentar esa versión
+        self._hilo = None
+        self._bloqueo = threading.Lock()
+
+    def iniciar(self):
+        """Lanza la indexación inicial y la revisión periódica del xlsx (idempotente)."""
+        self._asegurar()
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._vigilar, name="revisar_cerrados", daemon=True)
+            self._hilo.start()
+        return self
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.intervalo)
+            self._asegurar()
+
+    @property
+    def pendiente(self):
+        """True mientras existe el xlsx pero todavía no hay índice para consultarlo."""
+        return bool(self.version_xlsx()) and not self.version
+
+    def vigente(self):
+        """Versión del índice en uso, tras revisar si el xlsx cambió (para ETag / caché)."""
+        self._asegurar()
+        return self.version
+
+    # ------------------------------------------------------------
+    # CONSTRUCCIÓN DEL ÍNDICE
+    # ------------------------------------------------------------
+    def version_xlsx(self):
+        """mtime del xlsx, revisado como máximo cada `intervalo` segundos."""
+        ahora = time.monotonic()
+        if self._revisado is None or ahora - self._revisado >= self.intervalo:
+            try:
+                self._version_xlsx = self.ruta_xlsx.stat().st_mtime_ns
+            except FileNotFoundError:
+                self._version_xlsx = 0
+            self._revisado = ahora
+        return self._version_xlsx
+
+    def construir(self, version):
+        """Vuelca el xlsx a un SQLite temporal y lo pone en su lugar de una vez."""
+        pedidos, compacto = leer_campos(self.ruta_xlsx)
+        campos = list(CAMPOS.values())
+
+        temporal = self.ruta_db.with_name(f".{self.ruta_db.name}.{os.getpid()}")
+        temporal.unlink(missing_ok=True)
+        with contextlib.closing(sqlite3.connect(temporal)) as con:
+            con.execute(
+                f"CREATE TABLE cerrados (pedido TEXT PRIMARY KEY, {', '.join(f'{c} TEXT' for c in campos)}) "
+                "WITHOUT ROWID"
+            )
+            con.executemany(
+                f"INSERT OR IGNORE INTO cerrados VALUES ({', '.join('?' * (len(campos) + 1))})",
+                zip(pedidos, *(compacto[c] for c in campos)),
+            )
+            con.execute("CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT)")
+            con.execute("INSERT INTO meta VALUES ('version', ?)", (str(version),))
+            con.commit()
+        os.replace(temporal, self.ruta_db)
+        return len(pedidos)
+
+    def _tomar_bloqueo(self):
+        """Crea el archivo de bloqueo (O_EXCL: solo un proceso lo logra); False si otro lo tiene."""
+        for _ in range(2):
+            try:
+                os.close(os.open(self.ruta_bloqueo, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - self.ruta_bloqueo.stat().st_mtime < VENCE_BLOQUEO:
+                        return False
+                    self.ruta_bloqueo.unlink()  # vencido: se descarta y se intenta de nuevo
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def _reconstruir(self, version):
+        try:
+            total = self.construir(version)
+            self.version = version
+            self._fallos = 0
+            print(f"📦 Repositorio de cerrados indexado: {total} pedidos.")
+        except Exception as e:
+            # Excel puede tener el archivo abierto: se reintenta más tarde, con espera creciente
+            self._fallos += 1
+            espera = min(ESPERA_MAXIMA_REINTENTO, self.intervalo * 2 ** self._fallos)
+            self._esperar(version, espera)
+            print(f"⚠️ No se pudo indexar el repositorio de cerrados (reintento en {espera:.0f} s): {e}")
+        finally:
+            self.ruta_bloqueo.unlink(missing_ok=True)
+            self._reconstruyendo = False
+
+    def _esperar(self, version, segundos):
+        """No vuelve a intentar construir `version` antes de `segundos`."""
+        self._version_en_espera = version
+        self._revisar_en = time.monotonic() + segundos
+
+    def _version_en_disco(self):
+        try:
+            with contextlib.closing(self._conectar()) as con:
+                return int(con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()[0])
+        except (sqlite3.Error, TypeError, ValueError):
+            return 0
+
+    def _asegurar(self):
+        """Deja listo el SQLite de la versión vigente del xlsx (o la anterior mientras se
+        rehace). Nunca indexa en el hilo que llama: la construcción va en segundo plano."""
+        version = self.version_xlsx()
+        if version == self.version:
+            return
+        # Tras un fallo, o mientras otro proceso construye, no se reintenta en cada
+        # búsqueda (salvo que el xlsx vuelva a cambiar)
+        if version == self._version_en_espera and time.monotonic() < self._revisar_en:
+            return
+        with self._bloqueo:
+            if version == self.version or self._reconstruyendo:
+                return
+            if not version:
+                self.version = 0
+                return
+
+            # Otro worker pudo haberlo construido ya
+            en_disco = self._version_en_disco()
+            if en_disco == version:
+                self.version = version
+                return
+            if en_disco:
+                self.version = en_disco  # mientras se rehace responde la versión anterior
+
+            # Un solo proceso construye; los demás vuelven a mirar el disco en `intervalo` s
+            if not self._tomar_bloqueo():
+                self._esperar(version, self.intervalo)
+                return
+            if self._version_en_disco() == version:  # terminó justo antes de tomar el bloqueo
+                self.ruta_bloqueo.unlink(missing_ok=True)
+                self.version = version
+                return
+
+            self._reconstruyendo = True
+            threading.Thread(target=self._reconstruir, args=(version,), name="indexar_cerrados",
+                             daemon=True).start()
+
+    # ------------------------------------------------------------
+    # BÚSQUEDAS
+    # ------------------------------------------------------------
+    def _conectar(self):
+        con = sqlite3.connect(f"{self.ruta_db.as_uri()}?mode=ro", uri=True)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def buscar(self, pedido):
+        return self.buscar_varios([pedido]).get(str(pedido).strip())
+
+    def buscar_varios(self, pedidos, lote=500):
+        """pedido → registro compacto para los pedidos archivados."""
+        self._asegurar()
+        if not self.version:
+            return {}
+
+        pedidos = [str(p).strip() for p in pedidos]
+        encontrados = {}
+        try:
+            with contextlib.closing(self._conectar()) as con:
+                for i in range(0, len(pedidos), lote):
+                    parte = pedidos[i:i + lote]
+                    filas = con.execute(
+                        f"SELECT * FROM cerrados WHERE pedido IN ({', '.join('?' * len(parte))})", parte
+                    ).fetchall()
+                    encontrados.update((f["pedido"], {c: f[c] for c in CAMPOS.values()}) for f in filas)
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo consultar el repositorio de cerrados: {e}")
+        return encontrados
@@ -0,0 +1,163 @@
+"""
+------------------------------------------------------------
+SERVIDOR DE PRODUCCIÓN – FORMULARIO TÉCNICO ANS
+------------------------------------------------------------
+Descripción:
+- Publica el índice de FENIX_ANS como snapshot compartido en
+  data_clean/snapshot_pedidos y lo republica cuando cambia el xlsx.
+- Lanza app.py con N workers: gunicorn (Linux, N procesos) o waitress
+  (Windows, N hilos). Todos los workers abren el mismo snapshot con
+  memory-map, así la memoria no crece por worker y una sola
+  publicación actualiza a todos.
+- --benchmark levanta el servidor, mide peticiones/segundo de
+  /buscar_pedido con clientes concurrentes y lo detiene.
+
+Uso:
+  python servidor.py --workers 4 --puerto 8000
+  python servidor.py --benchmark --workers 4 --clientes 32 --segundos 10
+------------------------------------------------------------
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from indice_pedidos import INTERVALO_REVISION, leer_snapshot, publicar_snapshot
+
+base_dir = Path(__file__).resolve().parent
+ruta_fenix = base_dir.parent / "data_clean" / "FENIX_ANS.xlsx"
+carpeta_snapshot = base_dir.parent / "data_clean" / "snapshot_pedidos"
+
+# ------------------------------------------------------------
+# PUBLICACIÓN DEL SNAPSHOT COMPARTIDO
+# ------------------------------------------------------------
+def publicar_si_cambio(ultima_version):
+    """Publica FENIX_ANS si cambió desde `ultima_version`; devuelve la versión vigente."""
+    version = ruta_fenix.stat().st_mtime_ns if ruta_fenix.exists() else 0
+    if not version or version == ultima_version:
+        return ultima_version
+    try:
+        snapshot = leer_snapshot(ruta_fenix)
+        publicar_snapshot(snapshot, carpeta_snapshot)
+        print(f"📤 Snapshot de pedidos publicado: {len(snapshot)} pedidos.")
+        return snapshot.version
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar el snapshot, se reintenta: {e}")
+        return ultima_version
+
+
+def vigilar_fenix(ultima_version):
+    while True:
+        time.sleep(INTERVALO_REVISION)
+        ultima_version = publicar_si_cambio(ultima_version)
+
+# ------------------------------------------------------------
+# LANZADOR WSGI
+# ------------------------------------------------------------
+def comando_servidor(workers, puerto):
+    if os.name != "nt" and importlib.util.find_spec("gunicorn"):
+        return [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+                "--bind", f"0.0.0.0:{puerto}", "app:app"]
+    if importlib.util.find_spec("waitress"):
+        return [sys.executable, "-m", "waitress", f"--threads={workers}",
+                f"--listen=0.0.0.0:{puerto}", "app:app"]
+    raise SystemExit("❌ Falta servidor WSGI. Instale gunicorn (Linux) o waitress (Windows).")
+
+
+def esperar_servidor(url, limite=60):
+    inicio = time.time()
+    while time.time() - inicio < limite:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.3)
+    raise SystemExit(f"❌ El servidor no respondió en {limite} s.")
+
+# ------------------------------------------------------------
+# BENCHMARK DE CONSULTAS CONCURRENTES
+# ------------------------------------------------------------
+def medir_consultas(url_base, pedidos, clientes, segundos):
+    fin = time.perf_counter() + segundos
+
+    def cliente(_):
+        latencias, errores = [], 0
+        while time.perf_counter() < fin:
+            pedido = random.choice(pedidos)
+            t0 = time.perf_counter()
+            try:
+                urllib.request.urlopen(f"{url_base}/buscar_pedido/{pedido}", timeout=10).read()
+            except OSError:
+                errores += 1
+                continue
+            latencias.append(time.perf_counter() - t0)
+        return latencias, errores
+
+    with ThreadPoolExecutor(max_workers=clientes) as pool:
+        resultados = list(pool.map(cliente, range(clientes)))
+
+    latencias = np.array([l for lat, _ in resultados for l in lat]) * 1000
+    errores = sum(e for _, e in resultados)
+    print("------------------------------------------------------------")
+    print(f"📈 Consultas OK: {len(latencias)} | Errores: {errores} | Clientes: {clientes}")
+    print(f"⚡ Peticiones/segundo: {len(latencias) / segundos:.0f}")
+    if len(latencias):
+        p50, p95, p99 = np.percentile(latencias, [50, 95, 99])
+        print(f"⏱️ Latencia ms → p50 {p50:.1f} | p95 {p95:.1f} | p99 {p99:.1f}")
+    print("------------------------------------------------------------")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de producción del formulario técnico ANS")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--benchmark", action="store_true", help="mide peticiones/segundo y termina")
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--segundos", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    carpeta_snapshot.mkdir(parents=True, exist_ok=True)
+    version = publicar_si_cambio(0)
+    ruta_claves = carpeta_snapshot / f"v{version}" / "claves.npy"
+    if args.benchmark and (not version or not ruta_claves.exists()):
+        raise SystemExit(f"❌ No hay snapshot de pedidos publicado: revise que exista {ruta_fenix.name} "
+                         "(ejecute primero calculos_ans.py).")
+    threading.Thread(target=vigilar_fenix, args=(version,), name="publicar_fenix", daemon=True).start()
+
+    entorno = {**os.environ, "ANS_SNAPSHOT_PEDIDOS": str(carpeta_snapshot)}
+    salida = subprocess.DEVNULL if args.benchmark else None
+    print(f"🚀 Iniciando servidor con {args.workers} workers en el puerto {args.puerto}...")
+    proceso = subprocess.Popen(
+        comando_servidor(args.workers, args.puerto),
+        cwd=base_dir, env=entorno, stdout=salida, stderr=salida,
+    )
+
+    try:
+        if args.benchmark:
+            url_base = f"http://127.0.0.1:{args.puerto}"
+            esperar_servidor(url_base + "/")
+            claves = np.load(ruta_claves, mmap_mode="r")
+            pedidos = [str(p) for p in claves] or ["0"]
+            medir_consultas(url_base, pedidos, args.clientes, args.segundos)
+        else:
+            proceso.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if proceso.poll() is None:
+            proceso.terminate()
+            proceso.wait(timeout=15)
+
+
+if __name__ == "__main__":
+    main()
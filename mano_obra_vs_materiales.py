@@ -6,18 +6,33 @@ Autor: Héctor + IA (2025)
 ------------------------------------------------------------
 Descripción:
 - Cruza FENIX_ANS (programación) vs ALMACEN_EXPORT (digitación)
-- Verifica materiales obligatorios por mano de obra.
+- Verifica materiales obligatorios por mano de obra, con cruces
+  por conjuntos (merge / anti-join) en lugar de recorrer filas:
+  el tiempo crece de forma lineal con el tamaño de los archivos.
+- Valida TODAS las manos de obra del pedido (una fila por cada una).
+- Motor bitset (por defecto): materiales como bits en máscaras NumPy;
+  --motor joins usa el cruce por merge / anti-join. Ambos dan el mismo
+  reporte; --verificar-motores lo comprueba con datos aleatorios.
+- RELACION_MO_MAT se compila a un índice en caché (data_clean/
+  INDICE_REGLAS_MO_MAT.pkl) que solo se reconstruye si cambia el
+  archivo; se reportan conflictos entre data_raw y data_master.
 - Genera VALIDACION_EXPORT.xlsx con:
   ✅ Tabla estructurada
   🟢 Amarillo 🔴 Iconos de estado visuales.
 ------------------------------------------------------------
 """
 
+import hashlib
+import random
+import sys
+from dataclasses import dataclass, field
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from openpyxl import load_workbook
+from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.formatting.rule import FormulaRule
 
 # ------------------------------------------------------------
 # RUTAS
@@ -26,141 +41,456 @@ base = Path(__file__).resolve().parent
 ruta_fenix = base / "data_clean" / "FENIX_ANS.xlsx"
 ruta_almacen = base / "data_raw" / "ALMACEN_EXPORT.xlsx"
 ruta_relacion = base / "data_raw" / "RELACION_MO_MAT.xlsx"
+ruta_relacion_master = base / "data_master" / "RELACION_MO_MAT.xlsx"
+ruta_indice = base / "data_clean" / "INDICE_REGLAS_MO_MAT.pkl"
 ruta_salida = base / "data_clean" / "VALIDACION_EXPORT.xlsx"
 
+ESTADO_SIN_ALMACEN = "🚨 Pedido no existe en almacén (validar digitación)"
+ESTADO_SIN_DEFINICION = "⚠️ Mano de obra sin definición"
+ESTADO_COMPLETO = "✅ Pedido completo con materiales"
+ESTADO_FALTANTES = "⚠️ Faltan materiales obligatorios"
+
 # ------------------------------------------------------------
 # CARGA DE ARCHIVOS
 # ------------------------------------------------------------
-df_fenix = pd.read_excel(ruta_fenix)
-df_alm = pd.read_excel(ruta_almacen)
-df_rel = pd.read_excel(ruta_relacion)
+def cargar_datos():
+    df_fenix = pd.read_excel(ruta_fenix)
+    df_alm = pd.read_excel(ruta_almacen)
+
+    # Normalización
+    for df in [df_fenix, df_alm]:
+        df.columns = df.columns.str.lower().str.strip()
+
+    df_fenix['pedido'] = df_fenix['pedido'].astype(str).str.strip()
+    df_alm['pedido'] = df_alm['pedido'].astype(str).str.strip()
+    # Mano de obra vacía se mantiene vacía (astype(str) la convertiría en 'nan')
+    df_alm['mano_obra'] = df_alm['mano_obra'].where(
+        df_alm['mano_obra'].isna(), df_alm['mano_obra'].astype(str).str.strip())
+    df_alm['codigo_material'] = df_alm['codigo_material'].astype(str).str.strip()
+
+    return df_fenix, df_alm
 
-# Normalización
-for df in [df_fenix, df_alm, df_rel]:
-    df.columns = df.columns.str.lower().str.strip()
 
-df_fenix['pedido'] = df_fenix['pedido'].astype(str).str.strip()
-df_alm['pedido'] = df_alm['pedido'].astype(str).str.strip()
-df_rel['mano_obra'] = df_rel['mano_obra'].astype(str).str.strip()
-df_rel['material_obligatorio'] = df_rel['material_obligatorio'].astype(str).str.strip()
+def leer_relacion(ruta):
+    """RELACION_MO_MAT normalizada a (mano_obra, material_obligatorio[, tipo])."""
+    df_rel = pd.read_excel(ruta, dtype=str)
+    df_rel.columns = df_rel.columns.str.lower().str.strip()
+    # data_master usa MATERIAL + TIPO (obligatorio / opcional)
+    df_rel = df_rel.rename(columns={'material': 'material_obligatorio'})
+    df_rel['mano_obra'] = df_rel['mano_obra'].astype(str).str.strip()
+    df_rel['material_obligatorio'] = df_rel['material_obligatorio'].astype(str).str.strip()
+    if 'tipo' in df_rel.columns:
+        df_rel['tipo'] = df_rel['tipo'].astype(str).str.strip().str.lower()
+    return df_rel
 
 # ------------------------------------------------------------
-# VALIDACIÓN PRINCIPAL
+# ÍNDICE COMPILADO DE REGLAS (caché por mtime + hash)
 # ------------------------------------------------------------
-resultados = []
-
-for _, fila in df_fenix.iterrows():
-    pedido = str(fila['pedido']).strip()
-    registros = df_alm[df_alm['pedido'] == pedido]
-
-    if registros.empty:
-        resultados.append({
-            'pedido': pedido,
-            'mano_obra': '-',
-            'materiales_obligatorios': '-',
-            'materiales_entregados': '-',
-            'faltantes': '-',
-            'estado': '🚨 Pedido no existe en almacén (validar digitación)'
-        })
-        continue
-
-    mano_obra = registros['mano_obra'].iloc[0]
-    entregados = registros['codigo_material'].tolist()
-
-    obligatorios = df_rel[df_rel['mano_obra'] == mano_obra]['material_obligatorio'].tolist()
-    faltantes = [m for m in obligatorios if m not in entregados]
-
-    if not obligatorios:
-        estado = "⚠️ Mano de obra sin definición"
-    elif not faltantes:
-        estado = "✅ Pedido completo con materiales"
-    else:
-        estado = "⚠️ Faltan materiales obligatorios"
-
-    resultados.append({
-        'pedido': pedido,
-        'mano_obra': mano_obra,
-        'materiales_obligatorios': ', '.join(obligatorios) if obligatorios else '-',
-        'materiales_entregados': ', '.join(entregados),
-        'faltantes': ', '.join(faltantes) if faltantes else '-',
-        'estado': estado
-    })
+# Subir la versión si cambia la forma de compilar las reglas
+VERSION_INDICE = 1
+
+
+def firma_archivo(ruta):
+    """(mtime, tamaño, hash) del archivo; None si no existe."""
+    if not ruta.exists():
+        return None
+    info = ruta.stat()
+    return info.st_mtime_ns, info.st_size, hashlib.blake2b(ruta.read_bytes(), digest_size=16).hexdigest()
+
+
+def misma_firma(guardada, ruta):
+    """(coincide, firma vigente). Compara primero mtime/tamaño (sin leer el
+    archivo) y luego el hash; si solo cambió el mtime devuelve la firma nueva
+    para guardarla y no volver a leer el archivo en la próxima ejecución."""
+    if guardada is None or not ruta.exists():
+        return guardada is None and not ruta.exists(), guardada
+    info = ruta.stat()
+    if (info.st_mtime_ns, info.st_size) == guardada[:2]:
+        return True, guardada
+    actual = firma_archivo(ruta)
+    return actual[2] == guardada[2], actual
+
+
+@dataclass
+class IndiceReglas:
+    obligatorios: dict                    # mano_obra → tupla ordenada de materiales
+    requeridos: dict                      # mano_obra → frozenset de materiales
+    por_material: dict                    # material → frozenset de manos de obra
+    conflictos: pd.DataFrame = field(default_factory=pd.DataFrame)
+    firma_raw: tuple = None
+    firma_master: tuple = None
+    version: int = VERSION_INDICE
+
+    def tabla(self):
+        """Reglas como DataFrame (mano_obra, material_obligatorio) para los cruces."""
+        filas = [(mo, mat) for mo, mats in self.obligatorios.items() for mat in mats]
+        return pd.DataFrame(filas, columns=['mano_obra', 'material_obligatorio'])
+
+
+def compilar_indice(df_rel):
+    obligatorios = {}
+    for mo, mat in zip(df_rel['mano_obra'], df_rel['material_obligatorio']):
+        obligatorios.setdefault(mo, []).append(mat)
+    obligatorios = {mo: tuple(mats) for mo, mats in obligatorios.items()}
+
+    por_material = {}
+    for mo, mats in obligatorios.items():
+        for mat in mats:
+            por_material.setdefault(mat, set()).add(mo)
+
+    return IndiceReglas(
+        obligatorios=obligatorios,
+        requeridos={mo: frozenset(mats) for mo, mats in obligatorios.items()},
+        por_material={mat: frozenset(mos) for mat, mos in por_material.items()},
+    )
+
+
+def comparar_reglas(df_raw, df_master):
+    """Conflictos entre las reglas de data_raw y las obligatorias de data_master."""
+    columnas = ['mano_obra', 'material', 'conflicto']
+    if df_master is None:
+        return pd.DataFrame(columns=columnas)
+
+    raw = df_raw[['mano_obra', 'material_obligatorio']].drop_duplicates()
+    master = df_master[['mano_obra', 'material_obligatorio', 'tipo']].drop_duplicates(
+        subset=['mano_obra', 'material_obligatorio'])
+    cruce = raw.merge(master, on=['mano_obra', 'material_obligatorio'], how='outer', indicator=True)
+
+    mo_raw = set(raw['mano_obra'])
+    mo_master = set(master['mano_obra'])
+
+    conflicto = pd.Series(None, index=cruce.index, dtype=object)
+    solo_raw = cruce['_merge'] == 'left_only'
+    solo_master = (cruce['_merge'] == 'right_only') & (cruce['tipo'] == 'obligatorio')
+    opcional = (cruce['_merge'] == 'both') & (cruce['tipo'] == 'opcional')
+
+    conflicto[solo_raw & ~cruce['mano_obra'].isin(mo_master)] = 'Mano de obra solo en data_raw'
+    conflicto[solo_raw & cruce['mano_obra'].isin(mo_master)] = 'Obligatorio en data_raw, ausente en data_master'
+    conflicto[solo_master & ~cruce['mano_obra'].isin(mo_raw)] = 'Mano de obra solo en data_master'
+    conflicto[solo_master & cruce['mano_obra'].isin(mo_raw)] = 'Obligatorio en data_master, ausente en data_raw'
+    conflicto[opcional] = 'Obligatorio en data_raw, opcional en data_master'
+
+    cruce['conflicto'] = conflicto
+    cruce = cruce[cruce['conflicto'].notna()].rename(columns={'material_obligatorio': 'material'})
+    return cruce[columnas].sort_values(columnas[:2], ignore_index=True)
+
+
+def cargar_indice(ruta_raw=ruta_relacion, ruta_master=ruta_relacion_master, ruta_cache=ruta_indice):
+    """Índice de reglas desde caché; se recompila si cambió alguno de los archivos."""
+    if ruta_cache.exists():
+        try:
+            # Se guarda como dict: el pickle no depende de si el módulo corre como script
+            indice = IndiceReglas(**pd.read_pickle(ruta_cache))
+            if indice.version == VERSION_INDICE:
+                igual_raw, firma_raw = misma_firma(indice.firma_raw, ruta_raw)
+                igual_master, firma_master = misma_firma(indice.firma_master, ruta_master)
+                if igual_raw and igual_master:
+                    print("⚡ Reglas MO/MAT cargadas desde caché.")
+                    # Mismo contenido con otro mtime (copiado, guardado sin cambios...):
+                    # se actualiza la firma para no recalcular el hash cada vez
+                    if (firma_raw, firma_master) != (indice.firma_raw, indice.firma_master):
+                        indice.firma_raw, indice.firma_master = firma_raw, firma_master
+                        guardar_indice(indice, ruta_cache)
+                    return indice
+        except Exception as e:
+            print(f"⚠️ Caché de reglas ilegible, se recompila: {e}")
+
+    print("🔧 Compilando reglas MO/MAT...")
+    df_raw = leer_relacion(ruta_raw)
+    df_master = leer_relacion(ruta_master) if ruta_master.exists() else None
+
+    indice = compilar_indice(df_raw)
+    indice.conflictos = comparar_reglas(df_raw, df_master)
+    indice.firma_raw = firma_archivo(ruta_raw)
+    indice.firma_master = firma_archivo(ruta_master)
+    guardar_indice(indice, ruta_cache)
+    return indice
+
+
+def guardar_indice(indice, ruta_cache):
+    try:
+        ruta_cache.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(vars(indice), ruta_cache)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar la caché de reglas: {e}")
+
+# ------------------------------------------------------------
+# VALIDACIÓN PRINCIPAL (cruces por conjuntos)
+# ------------------------------------------------------------
+def unir_texto(serie):
+    return ', '.join(serie)
+
+
+def armar_reporte(df_fenix, df_alm, pares):
+    """Reporte final: una fila por pedido FENIX y mano de obra digitada en almacén.
+
+    `pares` trae (pedido, mano_obra, materiales_obligatorios, faltantes) por
+    cada mano de obra con reglas; lo produce cualquiera de los dos motores.
+    """
+    # Materiales entregados por pedido (texto en orden de digitación)
+    entregados = (
+        df_alm.groupby('pedido', sort=False)['codigo_material']
+        .agg(unir_texto).rename('materiales_entregados')
+    )
+
+    # Base: pedidos FENIX (en su orden) con cada mano de obra digitada
+    mo_pedido = df_alm[['pedido', 'mano_obra']].drop_duplicates()
+    df_out = df_fenix[['pedido']].merge(mo_pedido, on='pedido', how='left')
+    df_out = df_out.merge(pares, on=['pedido', 'mano_obra'], how='left').join(entregados, on='pedido')
+
+    sin_almacen = ~df_out['pedido'].isin(df_alm['pedido'])
+    sin_definicion = df_out['materiales_obligatorios'].isna()
+    completo = df_out['faltantes'].isna()
+
+    df_out['estado'] = np.select(
+        [sin_almacen, sin_definicion, completo],
+        [ESTADO_SIN_ALMACEN, ESTADO_SIN_DEFINICION, ESTADO_COMPLETO],
+        default=ESTADO_FALTANTES
+    )
+    # Mano de obra no digitada en almacén: la celda queda vacía (no '-')
+    df_out.loc[sin_almacen, 'mano_obra'] = '-'
+    columnas_guion = df_out.columns.drop('mano_obra')
+    df_out[columnas_guion] = df_out[columnas_guion].fillna('-')
+
+    return df_out[['pedido', 'mano_obra', 'materiales_obligatorios',
+                   'materiales_entregados', 'faltantes', 'estado']]
+
+
+def validar_pedidos(df_fenix, df_alm, df_rel):
+    """Motor por joins: los faltantes salen de un anti-join entre
+    (pedido, obligatorio) y (pedido, entregado)."""
+    mo_pedido = df_alm[['pedido', 'mano_obra']].drop_duplicates()
+
+    # Obligatorios por (pedido, mano de obra) en el orden de RELACION_MO_MAT
+    # (el merge no conserva ese orden: se guarda la posición de cada regla)
+    reglas = df_rel[['mano_obra', 'material_obligatorio']].assign(_orden=np.arange(len(df_rel)))
+    requeridos = mo_pedido.merge(reglas, on='mano_obra')
+
+    # Anti-join: obligatorios que no aparecen entre lo entregado del pedido
+    entregado_set = (
+        df_alm[['pedido', 'codigo_material']].drop_duplicates()
+        .rename(columns={'codigo_material': 'material_obligatorio'})
+    )
+    requeridos = requeridos.merge(
+        entregado_set, on=['pedido', 'material_obligatorio'], how='left', indicator=True
+    )
+
+    claves = ['pedido', 'mano_obra']
+    requeridos = requeridos.sort_values([*claves, '_orden'], kind='stable')
+    faltan = requeridos[requeridos['_merge'] == 'left_only']
+    obligatorios = (
+        requeridos.groupby(claves, sort=False)['material_obligatorio']
+        .agg(unir_texto).rename('materiales_obligatorios')
+    )
+    faltantes = (
+        faltan.groupby(claves, sort=False)['material_obligatorio']
+        .agg(unir_texto).rename('faltantes')
+    )
+    pares = obligatorios.to_frame().join(faltantes).reset_index()
+    return armar_reporte(df_fenix, df_alm, pares)
+
+# ------------------------------------------------------------
+# MOTOR BITSET (NumPy) – meses completos de entregas
+# ------------------------------------------------------------
+def matriz_bits(filas, bits, n_filas, n_palabras):
+    """Matriz uint64 [n_filas, n_palabras] con el bit `bits[i]` encendido en `filas[i]`."""
+    matriz = np.zeros((n_filas, n_palabras), dtype=np.uint64)
+    valores = np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64))
+    np.bitwise_or.at(matriz, (filas, bits // 64), valores)
+    return matriz
+
+
+def validar_pedidos_bitset(df_fenix, df_alm, indice):
+    """Motor bitset: cada material de las reglas es un bit; lo entregado por
+    pedido y lo requerido por mano de obra son máscaras uint64 y los
+    faltantes de todos los pares salen de un único `requerido & ~entregado`.
+    Solo las máscaras no nulas se decodifican a códigos."""
+    materiales = list(indice.por_material)
+    id_material = pd.Series(np.arange(len(materiales)), index=materiales)
+    n_palabras = max(1, -(-len(materiales) // 64))
+
+    # Entregado por pedido (solo materiales que aparecen en alguna regla)
+    pedidos, id_pedido = np.unique(df_alm['pedido'].to_numpy(dtype=str), return_inverse=True)
+    bit_entregado = df_alm['codigo_material'].map(id_material).to_numpy()
+    con_regla = ~np.isnan(bit_entregado)
+    entregado = matriz_bits(
+        id_pedido[con_regla], bit_entregado[con_regla].astype(np.int64), len(pedidos), n_palabras
+    )
+
+    # Requerido por mano de obra
+    manos_obra = list(indice.obligatorios)
+    tabla = indice.tabla()
+    requerido = matriz_bits(
+        tabla['mano_obra'].map(pd.Series(np.arange(len(manos_obra)), index=manos_obra)).to_numpy(),
+        tabla['material_obligatorio'].map(id_material).to_numpy(),
+        len(manos_obra), n_palabras
+    )
+
+    # Pares (pedido, mano de obra) con reglas definidas
+    pares = df_alm[['pedido', 'mano_obra']].drop_duplicates()
+    pares = pares[pares['mano_obra'].isin(indice.obligatorios)].reset_index(drop=True)
+    fila_mo = pares['mano_obra'].map(pd.Series(np.arange(len(manos_obra)), index=manos_obra)).to_numpy(dtype=np.int64)
+    fila_pedido = np.searchsorted(pedidos, pares['pedido'].to_numpy(dtype=str))
+
+    faltan = requerido[fila_mo] & ~entregado[fila_pedido]
+    con_faltantes = np.flatnonzero(faltan.any(axis=1))
+
+    # Decodificar solo las máscaras no nulas y distintas (en el orden de la regla)
+    clave = np.column_stack([fila_mo[con_faltantes].astype(np.uint64), faltan[con_faltantes]])
+    unicas, inversa = np.unique(clave, axis=0, return_inverse=True)
+    bits = np.unpackbits(unicas[:, 1:].astype('<u8').view(np.uint8), axis=1, bitorder='little')
+    textos = []
+    for mo_id, mascara in zip(unicas[:, 0], bits):
+        ids = set(np.flatnonzero(mascara).tolist())
+        mo = manos_obra[int(mo_id)]
+        textos.append(unir_texto(m for m in indice.obligatorios[mo] if id_material[m] in ids))
+
+    faltantes = np.full(len(pares), None, dtype=object)
+    faltantes[con_faltantes] = np.array(textos, dtype=object)[inversa.ravel()] if textos else []
+
+    pares['materiales_obligatorios'] = pares['mano_obra'].map(
+        {mo: unir_texto(mats) for mo, mats in indice.obligatorios.items()})
+    pares['faltantes'] = faltantes
+    return armar_reporte(df_fenix, df_alm, pares)
 
 # ------------------------------------------------------------
-# EXPORTAR RESULTADO
+# VERIFICACIÓN: LOS DOS MOTORES DAN EL MISMO REPORTE
 # ------------------------------------------------------------
-df_out = pd.DataFrame(resultados)
-ruta_salida.parent.mkdir(parents=True, exist_ok=True)
-df_out.to_excel(ruta_salida, index=False)
+def datos_aleatorios(rnd):
+    """FENIX, almacén y reglas sintéticos (pedidos sin almacén, manos de obra
+    vacías o sin reglas, materiales repetidos y más de 64 materiales)."""
+    materiales = [f"M{i}" for i in range(rnd.randint(1, 150))]
+    manos_obra = [f"MO{i}" for i in range(rnd.randint(1, 6))]
+    df_rel = pd.DataFrame(
+        [(mo, mat) for mo in manos_obra
+         for mat in rnd.sample(materiales, rnd.randint(1, min(5, len(materiales))))],
+        columns=['mano_obra', 'material_obligatorio'])
+
+    filas = rnd.randint(1, 40)
+    df_alm = pd.DataFrame({
+        'pedido': [str(rnd.randint(1, 12)) for _ in range(filas)],
+        'mano_obra': [rnd.choice(manos_obra + ["MO_SIN_REGLA", None]) for _ in range(filas)],
+        'codigo_material': [rnd.choice(materiales) for _ in range(filas)],
+    })
+    df_fenix = pd.DataFrame({'pedido': [str(p) for p in rnd.sample(range(1, 15), 10)]})
+    return df_fenix, df_alm, df_rel
+
+
+def verificar_motores(pruebas=500, semilla=0):
+    """Compara validar_pedidos y validar_pedidos_bitset sobre datos aleatorios;
+    devuelve la cantidad de casos con reportes distintos."""
+    rnd = random.Random(semilla)
+    distintos = 0
+    for prueba in range(pruebas):
+        df_fenix, df_alm, df_rel = datos_aleatorios(rnd)
+        indice = compilar_indice(df_rel)
+        joins = validar_pedidos(df_fenix, df_alm, indice.tabla())
+        bitset = validar_pedidos_bitset(df_fenix, df_alm, indice)
+        try:
+            pd.testing.assert_frame_equal(joins, bitset)
+        except AssertionError as e:
+            distintos += 1
+            print(f"❌ Prueba {prueba}: los motores difieren\n{e}")
+    if distintos:
+        print(f"❌ {distintos} de {pruebas} pruebas con reportes distintos.")
+    else:
+        print(f"✅ Motores joins y bitset idénticos en {pruebas} pruebas aleatorias.")
+    return distintos
 
 # ------------------------------------------------------------
 # FORMATO VISUAL – TABLA + COLORES ESTILO DASHBOARD (sin cuadricula)
 # ------------------------------------------------------------
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl import load_workbook
+def exportar(df_out, conflictos=None):
+    ruta_salida.parent.mkdir(parents=True, exist_ok=True)
+    with pd.ExcelWriter(ruta_salida, engine="openpyxl") as writer:
+        df_out.to_excel(writer, sheet_name="VALIDACION", index=False)
+        # Diferencias de reglas entre data_raw y data_master (solo si las hay)
+        if conflictos is not None and not conflictos.empty:
+            conflictos.to_excel(writer, sheet_name="CONFLICTOS_REGLAS", index=False)
+
+    wb = load_workbook(ruta_salida)
+    ws = wb["VALIDACION"]
+
+    # Crear tabla estructurada limpia
+    num_filas = ws.max_row
+    num_cols = ws.max_column
+    letra_final = get_column_letter(num_cols)
+
+    tabla = Table(displayName="VALIDACION_EXPORT", ref=f"A1:{letra_final}{num_filas}")
+    estilo = TableStyleInfo(
+        name="TableStyleMedium2",  # limpio, sin rayas
+        showFirstColumn=False,
+        showLastColumn=False,
+        showRowStripes=False,
+        showColumnStripes=False
+    )
+    tabla.tableStyleInfo = estilo
+    ws.add_table(tabla)
+
+    # Quitar bordes visibles
+    no_border = Border(left=Side(border_style=None),
+                       right=Side(border_style=None),
+                       top=Side(border_style=None),
+                       bottom=Side(border_style=None))
+
+    # Aplicar formato a todas las celdas
+    col_estado = 6  # Columna F
+    for i in range(2, num_filas + 1):
+        celda_estado = ws.cell(row=i, column=col_estado)
+        texto = str(celda_estado.value)
+
+        # Alinear a la izquierda (tipo ANS)
+        celda_estado.alignment = Alignment(horizontal="left", vertical="center")
+
+        if "✅" in texto:
+            celda_estado.fill = PatternFill(start_color="00B050", end_color="00B050", fill_type="solid")  # Verde fuerte
+            celda_estado.font = Font(color="FFFFFF", bold=True)
+        elif "⚠️" in texto:
+            celda_estado.fill = PatternFill(start_color="FFD966", end_color="FFD966", fill_type="solid")  # Amarillo semáforo
+            celda_estado.font = Font(color="000000", bold=True)
+        elif "🚨" in texto:
+            celda_estado.fill = PatternFill(start_color="C00000", end_color="C00000", fill_type="solid")  # Rojo fuerte
+            celda_estado.font = Font(color="FFFFFF", bold=True)
+
+    # Quitar bordes de TODA la hoja y justificar texto a la izquierda
+    for fila in ws.iter_rows(min_row=2, max_row=num_filas, min_col=1, max_col=num_cols):
+        for celda in fila:
+            celda.border = no_border
+            celda.alignment = Alignment(horizontal="left", vertical="center")
+
+    # Ajustar ancho de columnas automáticamente
+    for col in range(1, num_cols + 1):
+        ws.column_dimensions[get_column_letter(col)].auto_size = True
+
+    # Desactivar líneas de cuadrícula (vista limpia tipo dashboard)
+    ws.sheet_view.showGridLines = False
+
+    wb.save(ruta_salida)
+    wb.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--verificar-motores" in argv:
+        sys.exit(1 if verificar_motores() else 0)
+    # --motor joins usa el cruce por merge; por defecto el motor bitset
+    motor = argv[argv.index("--motor") + 1] if "--motor" in argv[:-1] else "bitset"
+
+    df_fenix, df_alm = cargar_datos()
+    indice = cargar_indice()
+    if not indice.conflictos.empty:
+        print(f"⚠️ Reglas MO/MAT con {len(indice.conflictos)} diferencias entre data_raw y data_master "
+              "(ver hoja CONFLICTOS_REGLAS).")
+
+    if motor == "joins":
+        df_out = validar_pedidos(df_fenix, df_alm, indice.tabla())
+    else:
+        df_out = validar_pedidos_bitset(df_fenix, df_alm, indice)
+    exportar(df_out, indice.conflictos)
+
+    print("✅ Validación con formato limpio (sin cuadrícula y justificado a la izquierda).")
+    print("Archivo generado:", ruta_salida)
+
 
-wb = load_workbook(ruta_salida)
-ws = wb.active
-ws.title = "VALIDACION"
-
-# Crear tabla estructurada limpia
-num_filas = ws.max_row
-num_cols = ws.max_column
-letra_final = get_column_letter(num_cols)
-
-tabla = Table(displayName="VALIDACION_EXPORT", ref=f"A1:{letra_final}{num_filas}")
-estilo = TableStyleInfo(
-    name="TableStyleMedium2",  # limpio, sin rayas
-    showFirstColumn=False,
-    showLastColumn=False,
-    showRowStripes=False,
-    showColumnStripes=False
-)
-tabla.tableStyleInfo = estilo
-ws.add_table(tabla)
-
-# Quitar bordes visibles
-no_border = Border(left=Side(border_style=None),
-                   right=Side(border_style=None),
-                   top=Side(border_style=None),
-                   bottom=Side(border_style=None))
-
-# Aplicar formato a todas las celdas
-col_estado = 6  # Columna F
-for i in range(2, num_filas + 1):
-    celda_estado = ws.cell(row=i, column=col_estado)
-    texto = str(celda_estado.value)
-
-    # Alinear a la izquierda (tipo ANS)
-    celda_estado.alignment = Alignment(horizontal="left", vertical="center")
-
-    if "✅" in texto:
-        celda_estado.fill = PatternFill(start_color="00B050", end_color="00B050", fill_type="solid")  # Verde fuerte
-        celda_estado.font = Font(color="FFFFFF", bold=True)
-    elif "⚠️" in texto:
-        celda_estado.fill = PatternFill(start_color="FFD966", end_color="FFD966", fill_type="solid")  # Amarillo semáforo
-        celda_estado.font = Font(color="000000", bold=True)
-    elif "🚨" in texto:
-        celda_estado.fill = PatternFill(start_color="C00000", end_color="C00000", fill_type="solid")  # Rojo fuerte
-        celda_estado.font = Font(color="FFFFFF", bold=True)
-
-# Quitar bordes de TODA la hoja y justificar texto a la izquierda
-for fila in ws.iter_rows(min_row=2, max_row=num_filas, min_col=1, max_col=num_cols):
-    for celda in fila:
-        celda.border = no_border
-        celda.alignment = Alignment(horizontal="left", vertical="center")
-
-# Ajustar ancho de columnas automáticamente
-for col in range(1, num_cols + 1):
-    ws.column_dimensions[get_column_letter(col)].auto_size = True
-
-# Desactivar líneas de cuadrícula (vista limpia tipo dashboard)
-ws.sheet_view.showGridLines = False
-
-wb.save(ruta_salida)
-wb.close()
-
-print("✅ Validación con formato limpio (sin cuadrícula y justificado a la izquierda).")
-print("Archivo generado:", ruta_salida)
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,7 @@ if sys.stderr.encoding is None or sys.stderr.encoding.lower() != "utf-8":
 RUTA_LOGO = r"data_raw/elite.png"
 RUTA_SCRIPT_ANS = r"calculos_ans.py"
 RUTA_SCRIPT_LIMPIEZA = r"limpieza_fenix.py"
+RUTA_SCRIPT_POWERBI = r"exportar_powerbi.py"
 
 # ------------------------------------------------------------
 # FUNCIONES DE INTERFAZ
@@ -125,7 +126,7 @@ def ejecutar_comando(nombre, comando, boton=None):
 # COMANDO DE BOTÓN INFORME – SECUENCIA COMPLETA SEGURA Y FUNCIONAL
 # ------------------------------------------------------------
 def ejecutar_informe():
-    """Ejecuta limpieza_fenix.py y luego calculos_ans.py en secuencia, usando el mismo Python activo."""
+    """Ejecuta limpieza_fenix.py, calculos_ans.py y exportar_powerbi.py en secuencia, usando el mismo Python activo."""
     def tarea():
         try:
             log_text.insert(tk.END, "\n🚀 Iniciando proceso completo Informe ANS...\n", "info")
@@ -187,6 +188,26 @@ def ejecutar_informe():
             if proceso2.returncode == 0:
                 log_text.insert(tk.END, "\n✅ Informe ANS generado correctamente.\n", "success")
                 pie_estado.config(text="✅ Informe ANS actualizado correctamente.", fg="#27AE60")
+
+                # 3️⃣ Exportar modelo Power BI (no bloquea el informe si falla)
+                log_text.insert(tk.END, "\n📊 Exportando modelo Power BI...\n", "info")
+                proceso3 = subprocess.Popen(
+                    [python_exe, "-X", "utf8", os.path.join(base_dir, RUTA_SCRIPT_POWERBI)],
+                    cwd=base_dir,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    encoding="utf-8",
+                    errors="ignore"
+                )
+                for linea in iter(proceso3.stdout.readline, ''):
+                    log_text.insert(tk.END, linea)
+                    log_text.see(tk.END)
+                    ventana.update_idletasks()
+                proceso3.wait()
+
+                if proceso3.returncode != 0:
+                    log_text.insert(tk.END, "⚠️ No se pudo exportar el modelo Power BI (el informe ANS sí quedó listo).\n", "error")
                 
                 # 🟢 Nuevo popup de confirmación visual
                 mbox.showinfo("Control ANS – ELITE Ingenieros S.A.S.",
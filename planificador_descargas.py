@@ -0,0 +1,387 @@
+"""
+------------------------------------------------------------
+PLANIFICADOR DE DESCARGAS GOOGLE DRIVE – Proyecto Control_ANS
+------------------------------------------------------------
+Descripción:
+- Pool acotado de hilos para las descargas de evidencias. Cada hilo usa
+  su propio servicio de Drive (los clientes de googleapiclient no se
+  pueden compartir entre hilos).
+- Cubeta de tokens que limita las llamadas por segundo a la cuota de
+  Drive. Ante 403 por límite de tasa, 429 o 5xx la tasa baja a la mitad
+  y se recupera de a poco con cada respuesta correcta. Las escrituras
+  (mover archivos con files.update) tienen su propia cubeta, más baja,
+  para no frenar las lecturas.
+- Reintentos con espera exponencial y jitter.
+- Progreso agregado: una línea cada pocos segundos, no una por bloque.
+- Descargas a un archivo temporal, verificadas por tamaño y md5 y
+  renombradas de forma atómica; manifiesto SQLite (id de Drive, md5,
+  tamaño, ruta, estado) para reanudar sin volver a descargar, con la
+  marca de agua (última fila procesada) del formulario.
+- Solicitudes batch de Drive (hasta 100 por llamada) con reintento por
+  elemento.
+- Lo usan descargar_drive_v48.py y descargar_evidencias_drive.py.
+------------------------------------------------------------
+"""
+
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload
+
+# Cuota estándar de Drive: 12.000 consultas / 60 s por usuario (200/s). Se usa el 75 %
+# (factor de seguridad 0,75) para dejar margen a otros clientes de la misma cuenta; si
+# aun así aparece un 403/429 la cubeta baja sola a la mitad.
+CUOTA_USUARIO = 200       # llamadas por segundo
+TASA_MAXIMA = int(CUOTA_USUARIO * 0.75)
+RAFAGA = CUOTA_USUARIO - TASA_MAXIMA  # ráfaga: el resto de la cuota de un segundo
+# Escrituras sostenidas (files.update): techo propio y más bajo, separado de las lecturas
+TASA_ESCRITURA = 50
+TRABAJADORES = 8
+
+INTENTOS = 6
+ESPERA_BASE = 1.0         # segundos; se duplica en cada reintento (con jitter)
+ESPERA_MAXIMA = 32.0
+BLOQUE_DESCARGA = 4 * 1024 * 1024
+LOTE_MAXIMO = 100         # límite de Drive por solicitud batch
+
+RAZONES_CUOTA = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# ------------------------------------------------------------
+# ERRORES REINTENTABLES
+# ------------------------------------------------------------
+def es_reintentable(error):
+    """403 por límite de tasa, 429, 5xx o fallas de red."""
+    if isinstance(error, HttpError):
+        estado = error.resp.status
+        if estado == 403:
+            contenido = error.content.decode("utf-8", "ignore") if isinstance(error.content, bytes) else str(error.content)
+            return any(razon in contenido for razon in RAZONES_CUOTA)
+        return estado == 429 or estado >= 500
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+# ------------------------------------------------------------
+# LIMITADOR DE TASA
+# ------------------------------------------------------------
+class CubetaTokens:
+    """Token bucket adaptativo (baja a la mitad ante cuota, sube de a poco), seguro entre hilos."""
+
+    def __init__(self, tasa=TASA_MAXIMA, rafaga=RAFAGA, tasa_minima=1.0):
+        self.tasa_maxima = self.tasa = float(tasa)
+        self.tasa_minima = min(float(tasa_minima), self.tasa)
+        self.rafaga = float(rafaga)
+        self._tokens = self.rafaga
+        self._ultimo = time.monotonic()
+        self._bloqueo = threading.Lock()
+
+    def tomar(self, n=1):
+        """Espera hasta que haya tokens y consume `n` (un batch de 100 cuenta como 100 llamadas)."""
+        necesarios = min(n, self.rafaga)
+        while True:
+            with self._bloqueo:
+                ahora = time.monotonic()
+                self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= necesarios:
+                    self._tokens -= n
+                    return
+                espera = (necesarios - self._tokens) / self.tasa
+            time.sleep(espera)
+
+    def frenar(self):
+        with self._bloqueo:
+            self.tasa = max(self.tasa_minima, self.tasa / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def acelerar(self):
+        with self._bloqueo:
+            self.tasa = min(self.tasa_maxima, self.tasa + self.tasa_maxima / 50)
+
+
+def esperar_reintento(intento):
+    time.sleep(random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intento)))
+
+
+def con_reintentos(funcion, cubeta, intentos=INTENTOS, costo=1):
+    """Ejecuta `funcion()` respetando la cubeta; reintenta errores transitorios."""
+    for intento in range(intentos):
+        cubeta.tomar(costo)
+        try:
+            resultado = funcion()
+        except Exception as e:
+            if intento == intentos - 1 or not es_reintentable(e):
+                raise
+            cubeta.frenar()
+            esperar_reintento(intento)
+        else:
+            cubeta.acelerar()
+            return resultado
+
+# ------------------------------------------------------------
+# PROGRESO AGREGADO
+# ------------------------------------------------------------
+class Progreso:
+    """Contadores compartidos por los hilos; imprime como máximo una línea cada `intervalo` s."""
+
+    def __init__(self, total, etiqueta="Descargas", intervalo=2.0):
+        self.total = total
+        self.etiqueta = etiqueta
+        self.intervalo = intervalo
+        self.conteo = {"ok": 0, "omitido": 0, "error": 0}
+        self.bytes = 0
+        self._inicio = self._ultimo = time.monotonic()
+        self._bloqueo = threading.Lock()
+
+    def sumar(self, estado, n_bytes=0):
+        with self._bloqueo:
+            self.conteo[estado] += 1
+            self.bytes += n_bytes
+            ahora = time.monotonic()
+            if ahora - self._ultimo >= self.intervalo:
+                self._ultimo = ahora
+                print(self.linea())
+
+    def linea(self):
+        hechos = sum(self.conteo.values())
+        segundos = max(time.monotonic() - self._inicio, 1e-9)
+        mb = self.bytes / 1024 ** 2
+        avance = f"{hechos}/{self.total}" if self.total is not None else f"{hechos}"  # None: total aún desconocido
+        return (f"⬇️ {self.etiqueta}: {avance} | ✅ {self.conteo['ok']} | "
+                f"⏭️ {self.conteo['omitido']} | ❌ {self.conteo['error']} | "
+                f"{mb:.1f} MB ({mb / segundos:.1f} MB/s)")
+
+# ------------------------------------------------------------
+# PLANIFICADOR
+# ------------------------------------------------------------
+class _ArchivoConHash:
+    """Archivo de escritura que calcula el md5 de lo escrito (sin releer el disco)."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.md5 = hashlib.md5()
+
+    def write(self, datos):
+        self.md5.update(datos)
+        return self.fh.write(datos)
+
+
+def md5_archivo(ruta, bloque=1024 * 1024):
+    h = hashlib.md5()
+    with open(ruta, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def descargar(service, file_id, destino, cubeta, md5=None, tamano=None, bloque=BLOQUE_DESCARGA):
+    """Descarga un archivo de Drive a `destino` (cada bloque pasa por la cubeta); devuelve bytes.
+
+    Se escribe en `<destino>.parcial` y solo se renombra si el tamaño y el md5
+    coinciden con los de Drive: un corte nunca deja un archivo "completo" falso."""
+    destino = Path(destino)
+    temporal = destino.with_name(destino.name + ".parcial")
+    try:
+        with open(temporal, "wb") as fh:
+            archivo = _ArchivoConHash(fh)
+            downloader = MediaIoBaseDownload(archivo, service.files().get_media(fileId=file_id), chunksize=bloque)
+            done = False
+            while not done:
+                _, done = con_reintentos(downloader.next_chunk, cubeta)
+            n_bytes = fh.tell()
+
+        if tamano is not None and n_bytes != int(tamano):
+            raise ValueError(f"tamaño {n_bytes} distinto del de Drive ({tamano})")
+        if md5 and archivo.md5.hexdigest() != md5:
+            raise ValueError("md5 distinto del de Drive")
+        os.replace(temporal, destino)
+        return n_bytes
+    except BaseException:
+        temporal.unlink(missing_ok=True)
+        raise
+
+
+def ejecutar_lotes(planificador, solicitudes, tamano=LOTE_MAXIMO, intentos=INTENTOS, cubeta=None):
+    """Ejecuta {clave: construir(service) -> HttpRequest} en solicitudes batch de Drive.
+
+    Devuelve {clave: (respuesta, error)}. Los elementos que fallan por cuota o
+    error transitorio se reintentan (con espera) en la siguiente ronda. `cubeta`
+    es la de lecturas del planificador salvo que se indique otra (escrituras)."""
+    cubeta = planificador.cubeta if cubeta is None else cubeta
+    resultados = {}
+    pendientes = dict(solicitudes)
+    for intento in range(intentos):
+        fallidos = {}
+        claves = list(pendientes)
+        for i in range(0, len(claves), tamano):
+            parte = claves[i:i + tamano]
+            service = planificador.servicio()
+
+            def anotar(request_id, respuesta, error, parte=parte):
+                clave = parte[int(request_id)]
+                if error is not None and es_reintentable(error) and intento < intentos - 1:
+                    fallidos[clave] = pendientes[clave]
+                else:
+                    resultados[clave] = (respuesta, error)
+
+            lote = service.new_batch_http_request(callback=anotar)
+            for n, clave in enumerate(parte):
+                lote.add(pendientes[clave](service), request_id=str(n))
+            try:
+                con_reintentos(lote.execute, cubeta, costo=len(parte))
+            except Exception as e:
+                # Falló la solicitud batch completa: el error queda en cada elemento sin respuesta
+                for clave in parte:
+                    if clave not in resultados and clave not in fallidos:
+                        resultados[clave] = (None, e)
+
+        if not fallidos:
+            break
+        cubeta.frenar()
+        esperar_reintento(intento)
+        pendientes = fallidos
+    return resultados
+
+
+class PlanificadorDescargas:
+    """Pool de hilos con un servicio de Drive por hilo y cubetas de tokens compartidas
+    (lecturas y escrituras)."""
+
+    def __init__(self, crear_servicio, trabajadores=TRABAJADORES, tasa=TASA_MAXIMA, rafaga=RAFAGA,
+                 tasa_escritura=TASA_ESCRITURA):
+        self.crear_servicio = crear_servicio
+        self.trabajadores = trabajadores
+        self.cubeta = CubetaTokens(tasa, rafaga)
+        self.cubeta_escritura = CubetaTokens(min(tasa, tasa_escritura), rafaga)
+        self._local = threading.local()
+
+    def servicio(self):
+        servicio = getattr(self._local, "servicio", None)
+        if servicio is None:
+            servicio = self._local.servicio = self.crear_servicio()
+        return servicio
+
+    def llamar(self, construir):
+        """Ejecuta `construir(service)` (un HttpRequest) con cuota y reintentos."""
+        return con_reintentos(lambda: construir(self.servicio()).execute(), self.cubeta)
+
+    def descargar(self, file_id, destino, md5=None, tamano=None):
+        return descargar(self.servicio(), file_id, destino, self.cubeta, md5=md5, tamano=tamano)
+
+    def ejecutar(self, tareas, funcion):
+        """Aplica `funcion(tarea)` en el pool; devuelve [(tarea, resultado, error)] en orden.
+
+        `tareas` puede ser un generador (p. ej. un listado paginado): se consume a
+        medida que hay hilos libres, así las descargas empiezan antes de terminar
+        de listar y la memoria queda acotada."""
+        cupos = threading.BoundedSemaphore(self.trabajadores * 2)
+
+        def correr(tarea):
+            try:
+                return tarea, funcion(tarea), None
+            except Exception as e:
+                return tarea, None, e
+            finally:
+                cupos.release()
+
+        futuros = []
+        with ThreadPoolExecutor(max_workers=self.trabajadores, thread_name_prefix="drive") as pool:
+            for tarea in tareas:
+                cupos.acquire()
+                futuros.append(pool.submit(correr, tarea))
+        return [f.result() for f in futuros]
+
+
+# ------------------------------------------------------------
+# MANIFIESTO DE DESCARGAS (SQLite)
+# ------------------------------------------------------------
+ESQUEMA_MANIFIESTO = """
+CREATE TABLE IF NOT EXISTS descargas (
+    file_id TEXT PRIMARY KEY,
+    nombre TEXT,
+    md5 TEXT,
+    tamano INTEGER,
+    ruta TEXT,
+    estado TEXT NOT NULL,
+    actualizado TEXT
+);
+CREATE TABLE IF NOT EXISTS marcas (
+    clave TEXT PRIMARY KEY,
+    fila INTEGER NOT NULL,
+    marca_temporal TEXT,
+    actualizado TEXT
+);
+"""
+
+
+class ManifiestoDescargas:
+    """Registro persistente de descargas de Drive: id, md5, tamaño, ruta local y estado."""
+
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(self.ruta, check_same_thread=False, timeout=30)
+        self._bloqueo = threading.Lock()
+        with self._bloqueo, self._con:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.executescript(ESQUEMA_MANIFIESTO)
+
+    def verificado(self, file_id, md5=None, tamano=None):
+        """Ruta local si el archivo ya se descargó y verificó con el mismo md5/tamaño y sigue en disco."""
+        with self._bloqueo:
+            fila = self._con.execute(
+                "SELECT md5, tamano, ruta FROM descargas WHERE file_id = ? AND estado = 'ok'", (file_id,)
+            ).fetchone()
+        if fila is None:
+            return None
+        md5_guardado, tamano_guardado, ruta = fila
+        if (md5 and md5 != md5_guardado) or (tamano is not None and int(tamano) != tamano_guardado):
+            return None
+        ruta = Path(ruta)
+        try:
+            return ruta if ruta.stat().st_size == tamano_guardado else None
+        except OSError:
+            return None
+
+    def registro(self, file_id):
+        with self._bloqueo:
+            fila = self._con.execute(
+                "SELECT file_id, nombre, md5, tamano, ruta, estado, actualizado FROM descargas WHERE file_id = ?",
+                (file_id,),
+            ).fetchone()
+        return dict(zip(["file_id", "nombre", "md5", "tamano", "ruta", "estado", "actualizado"], fila)) if fila else None
+
+    def registrar(self, file_id, nombre, md5, tamano, ruta, estado="ok"):
+        with self._bloqueo, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO descargas (file_id, nombre, md5, tamano, ruta, estado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_id, nombre, md5, None if tamano is None else int(tamano), str(ruta), estado,
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+
+    def rutas(self):
+        """nombre de archivo → ruta de todas las descargas verificadas."""
+        with self._bloqueo:
+            filas = self._con.execute("SELECT ruta FROM descargas WHERE estado = 'ok'").fetchall()
+        return {Path(r).name: Path(r) for (r,) in filas}
+
+    def marca(self, clave):
+        """Marca de agua guardada ({"fila", "marca_temporal"}) o None si nunca se procesó."""
+        with self._bloqueo:
+            fila = self._con.execute("SELECT fila, marca_temporal FROM marcas WHERE clave = ?", (clave,)).fetchone()
+        return {"fila": fila[0], "marca_temporal": fila[1]} if fila else None
+
+    def guardar_marca(self, clave, fila, marca_temporal):
+        with self._bloqueo, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO marcas (clave, fila, marca_temporal, actualizado) VALUES (?, ?, ?, ?)",
+                (clave, int(fila), marca_temporal, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
@@ -0,0 +1,520 @@
+"""
+------------------------------------------------------------
+SIMULADOR LOCAL DE GOOGLE DRIVE Y SHEETS – Proyecto Control_ANS
+------------------------------------------------------------
+Descripción:
+- DriveSimulado: objeto compatible con httplib2.Http que se le pasa a
+  googleapiclient (build("drive", "v3", http=...)) y responde como Drive
+  v3 con archivos en memoria: files.list paginado, files.get (metadatos
+  y alt=media con Range), files.update (addParents / removeParents),
+  files.export de una hoja simulada a CSV y solicitudes batch.
+- Latencia por llamada, ancho de banda y errores de cuota configurables:
+  403 userRateLimitExceeded al pasar de `tasa_maxima` llamadas/s y 429
+  al azar con probabilidad `prob_cuota`. Cuenta las llamadas por tipo.
+- HojaSimulada: reemplazo del Worksheet de gspread con los métodos que
+  usan los scripts (get_all_records, get_values, row_values, col_values,
+  update, update_acell, batch_update), con LibroSimulado y
+  ClienteSheetsSimulado en lugar de open_by_key / worksheets (cruce de
+  calculos_ans.py).
+- Como script: benchmark sin red ni credenciales del código real de
+  descargar_drive_v48.py y descargar_evidencias_drive.py, de 10 a
+  10.000 archivos.
+
+Uso:
+  python simulador_google.py --archivos 10 100 1000 --latencia 0.05
+  python simulador_google.py --archivos 10000 --scripts v48 --prob-cuota 0.02
+------------------------------------------------------------
+"""
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from email.parser import Parser
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import httplib2
+from googleapiclient.discovery import build
+from gspread.utils import a1_to_rowcol
+
+FORMULARIO = "carpeta_formulario"
+PAPELERA = "carpeta_papelera"
+LOTE_MAXIMO = 100
+PAGINA_MAXIMA = 1000
+TIPO_CARPETA = "application/vnd.google-apps.folder"
+
+# ------------------------------------------------------------
+# GOOGLE DRIVE SIMULADO
+# ------------------------------------------------------------
+def contenido_sintetico(file_id, tamano):
+    """Bytes deterministas de un PDF falso (no se guardan: se regeneran en cada lectura)."""
+    cabecera = b"%PDF-1.4\n"
+    patron = f"% evidencia {file_id}\n".encode()
+    cuerpo = patron * ((max(tamano - len(cabecera), 0)) // len(patron) + 1)
+    return (cabecera + cuerpo)[:tamano]
+
+
+def _respuesta(estado, cuerpo=b"", **encabezados):
+    resp = httplib2.Response({"status": str(estado), "content-type": "application/json; charset=UTF-8",
+                              **{k.replace("_", "-"): v for k, v in encabezados.items()}})
+    resp.reason = {200: "OK", 204: "No Content", 206: "Partial Content"}.get(estado, "Error")
+    return resp, cuerpo
+
+
+def _error(estado, razon, mensaje):
+    cuerpo = {"error": {"code": estado, "message": mensaje,
+                        "errors": [{"domain": "usageLimits", "reason": razon, "message": mensaje}]}}
+    return _respuesta(estado, json.dumps(cuerpo).encode())
+
+
+class DriveSimulado:
+    """Drive v3 en memoria con la interfaz request() de httplib2.Http (segura entre hilos)."""
+
+    def __init__(self, latencia=0.0, ancho_banda=None, prob_cuota=0.0, tasa_maxima=None, semilla=None):
+        self.latencia = latencia          # segundos por solicitud HTTP
+        self.ancho_banda = ancho_banda    # bytes/s de las descargas (None = sin límite)
+        self.prob_cuota = prob_cuota
+        self.tasa_maxima = tasa_maxima    # llamadas/s antes de responder 403 por cuota
+        self.archivos = {}
+        self.hojas = {}
+        self.contadores = Counter()
+        self._azar = random.Random(semilla)
+        self._ventana = []
+        self._bloqueo = threading.Lock()
+
+    # -------------------- datos --------------------
+    def agregar_archivo(self, nombre, carpeta=FORMULARIO, contenido=None, tamano=100_000,
+                        mime="application/pdf", file_id=None):
+        file_id = file_id or uuid4().hex
+        datos = contenido if contenido is not None else contenido_sintetico(file_id, tamano)
+        self.archivos[file_id] = {
+            "id": file_id, "name": nombre, "mimeType": mime, "parents": [carpeta],
+            "size": str(len(datos)), "md5Checksum": hashlib.md5(datos).hexdigest(),
+            "contenido": contenido,
+        }
+        return file_id
+
+    def agregar_hoja(self, file_id, hoja):
+        self.hojas[file_id] = hoja
+
+    def contenido(self, file_id):
+        archivo = self.archivos[file_id]
+        if archivo["contenido"] is not None:
+            return archivo["contenido"]
+        return contenido_sintetico(file_id, int(archivo["size"]))
+
+    def en_carpeta(self, carpeta):
+        return [a for a in self.archivos.values() if carpeta in a["parents"]]
+
+    # -------------------- transporte --------------------
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        with self._bloqueo:
+            self.contadores["http"] += 1
+        url = urlparse(uri)
+        if url.path.startswith("/batch/"):
+            resp, cuerpo = self._lote(body, headers or {})
+        else:
+            resp, cuerpo = self._atender(method, url.path, parse_qs(url.query), headers or {}, body)
+        espera = self.latencia
+        if self.ancho_banda and resp.status == 206:
+            espera += len(cuerpo) / self.ancho_banda
+        if espera:
+            time.sleep(espera)
+        return resp, cuerpo
+
+    def _cuota(self):
+        """Error de cuota si corresponde (cada elemento de un batch cuenta como una llamada)."""
+        with self._bloqueo:
+            ahora = time.monotonic()
+            if self.tasa_maxima:
+                self._ventana = [t for t in self._ventana if ahora - t < 1.0]
+                if len(self._ventana) >= self.tasa_maxima:
+                    self.contadores["cuota_403"] += 1
+                    return _error(403, "userRateLimitExceeded", "User Rate Limit Exceeded")
+                self._ventana.append(ahora)
+            if self.prob_cuota and self._azar.random() < self.prob_cuota:
+                self.contadores["cuota_429"] += 1
+                return _error(429, "rateLimitExceeded", "Rate Limit Exceeded")
+        return None
+
+    def _atender(self, metodo, ruta, query, encabezados, cuerpo):
+        error = self._cuota()
+        if error:
+            return error
+
+        partes = ruta.strip("/").split("/")           # drive, v3, files[, id[, export]]
+        parametro = {k: v[0] for k, v in query.items()}
+        if partes[:3] != ["drive", "v3", "files"]:
+            return _error(404, "notFound", f"Ruta no simulada: {ruta}")
+
+        if len(partes) == 3 and metodo == "GET":
+            return self._listar(parametro)
+
+        file_id = partes[3] if len(partes) > 3 else None
+        if len(partes) == 5 and partes[4] == "export":
+            if file_id not in self.hojas:
+                return _error(404, "notFound", f"File not found: {file_id}.")
+            self._contar("export")
+            return self._rango(self.hojas[file_id].a_csv(), encabezados)
+
+        archivo = self.archivos.get(file_id)
+        if archivo is None:
+            return _error(404, "notFound", f"File not found: {file_id}.")
+
+        if metodo == "PATCH":
+            self._contar("mover")
+            with self._bloqueo:
+                quitar = set(filter(None, parametro.get("removeParents", "").split(",")))
+                agregar = [p for p in parametro.get("addParents", "").split(",") if p]
+                archivo["parents"] = [p for p in archivo["parents"] if p not in quitar] + agregar
+            return _respuesta(200, json.dumps(self._metadatos(archivo)).encode())
+
+        if parametro.get("alt") == "media":
+            self._contar("media")
+            return self._rango(self.contenido(file_id), encabezados)
+
+        self._contar("metadatos")
+        return _respuesta(200, json.dumps(self._metadatos(archivo)).encode())
+
+    def _contar(self, tipo, n=1):
+        with self._bloqueo:
+            self.contadores[tipo] += n
+
+    def _metadatos(self, archivo):
+        return {k: v for k, v in archivo.items() if k != "contenido"}
+
+    def _listar(self, parametro):
+        self._contar("listar")
+        carpeta = re.search(r"'([^']+)'\s+in\s+parents", parametro.get("q", ""))
+        archivos = [a for a in self.archivos.values()
+                    if carpeta is None or carpeta.group(1) in a["parents"]]
+        if "!= 'application/vnd.google-apps.folder'" in parametro.get("q", ""):
+            archivos = [a for a in archivos if a["mimeType"] != TIPO_CARPETA]
+
+        tamano = min(int(parametro.get("pageSize", 100)), PAGINA_MAXIMA)
+        inicio = int(parametro.get("pageToken", 0))
+        pagina = {"files": [self._metadatos(a) for a in archivos[inicio:inicio + tamano]]}
+        if inicio + tamano < len(archivos):
+            pagina["nextPageToken"] = str(inicio + tamano)
+        return _respuesta(200, json.dumps(pagina).encode())
+
+    def _rango(self, datos, encabezados):
+        rango = re.match(r"bytes=(\d+)-(\d*)", encabezados.get("range", ""))
+        if rango is None:
+            self._contar("bytes", len(datos))
+            return _respuesta(200, datos, content_length=str(len(datos)))
+        a = int(rango.group(1))
+        b = int(rango.group(2)) if rango.group(2) else len(datos) - 1
+        parte = datos[a:b + 1]
+        self._contar("bytes", len(parte))
+        return _respuesta(206, parte, content_length=str(len(parte)),
+                          content_range=f"bytes {a}-{a + len(parte) - 1}/{len(datos)}")
+
+    def _lote(self, cuerpo, encabezados):
+        """Atiende un multipart/mixed de googleapiclient y responde en el mismo formato."""
+        self._contar("lote")
+        mensaje = Parser().parsestr(f"content-type: {encabezados['content-type']}\r\n\r\n{cuerpo}")
+        partes = mensaje.get_payload()
+        if len(partes) > LOTE_MAXIMO:
+            return _error(400, "batchSizeTooLarge", f"Más de {LOTE_MAXIMO} solicitudes en un batch")
+
+        frontera = f"batch_{uuid4().hex}"
+        salida = []
+        for parte in partes:
+            solicitud = parte.get_payload()
+            linea, _, resto = solicitud.partition("\n")
+            metodo, ruta, _ = linea.split(" ", 2)
+            url = urlparse(ruta)
+            resp, contenido = self._atender(metodo, url.path, parse_qs(url.query), {}, resto)
+            id_respuesta = parte["Content-ID"].replace("<", "<response-", 1)
+            salida.append(
+                f"--{frontera}\r\nContent-Type: application/http\r\nContent-ID: {id_respuesta}\r\n\r\n"
+                f"HTTP/1.1 {resp.status} {resp.reason}\r\nContent-Type: application/json; charset=UTF-8\r\n"
+                f"\r\n{contenido.decode('utf-8')}\r\n"
+            )
+        salida.append(f"--{frontera}--\r\n")
+        resp, _ = _respuesta(200)
+        resp["content-type"] = f"multipart/mixed; boundary={frontera}"
+        return resp, "".join(salida).encode("utf-8")
+
+# ------------------------------------------------------------
+# GOOGLE SHEETS SIMULADO
+# ------------------------------------------------------------
+PATRON_FORMULA_ENLACE = re.compile(r'^=(?:HIPERVINCULO|HYPERLINK)\(".*";\s*"([^"]*)"\)$', re.IGNORECASE)
+
+
+class HojaSimulada:
+    """Worksheet de gspread en memoria; cada método cuenta como una solicitud a la API."""
+
+    def __init__(self, encabezados, filas=(), titulo="Respuestas de formulario 1", latencia=0.0):
+        self.title = titulo
+        self.latencia = latencia
+        self.celdas = [list(encabezados)] + [list(f) for f in filas]
+        self.contadores = Counter()
+        self._bloqueo = threading.Lock()
+
+    def _llamada(self, tipo):
+        with self._bloqueo:
+            self.contadores[tipo] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    @staticmethod
+    def _mostrado(valor):
+        """Valor formateado (lo que se ve en la hoja): las fórmulas de enlace muestran su texto."""
+        coincidencia = PATRON_FORMULA_ENLACE.match(str(valor))
+        return coincidencia.group(1) if coincidencia else valor
+
+    def _escribir(self, fila, columna, valor):
+        while len(self.celdas) < fila:
+            self.celdas.append([])
+        renglon = self.celdas[fila - 1]
+        while len(renglon) < columna:
+            renglon.append("")
+        renglon[columna - 1] = valor
+
+    def get_all_values(self):
+        self._llamada("leer")
+        return [[self._mostrado(v) for v in fila] for fila in self.celdas]
+
+    def get_values(self, rango=None, value_render_option=None, **kwargs):
+        """Rango A1 como "A5:E" o "E5:E" (sin fila final = hasta el final de la hoja)."""
+        self._llamada("leer")
+        inicio, _, fin = (rango or "A1").partition(":")
+        fila, columna = a1_to_rowcol(inicio)
+        letras = re.match(r"([A-Za-z]*)(\d*)", fin or inicio)
+        ultima_columna = a1_to_rowcol(f"{letras.group(1)}1")[1] if letras.group(1) else columna
+        ultima_fila = int(letras.group(2)) if letras.group(2) else len(self.celdas)
+        formula = str(value_render_option).upper() == "FORMULA"
+
+        valores = []
+        for renglon in self.celdas[fila - 1:ultima_fila]:
+            parte = [renglon[c - 1] if c <= len(renglon) else "" for c in range(columna, ultima_columna + 1)]
+            valores.append(parte if formula else [self._mostrado(v) for v in parte])
+        return valores
+
+    def get_all_records(self):
+        self._llamada("leer")
+        encabezados = self.celdas[0]
+        return [
+            {e: self._mostrado(fila[i]) if i < len(fila) else "" for i, e in enumerate(encabezados)}
+            for fila in self.celdas[1:]
+        ]
+
+    def row_values(self, fila):
+        self._llamada("leer")
+        return [self._mostrado(v) for v in self.celdas[fila - 1]] if fila <= len(self.celdas) else []
+
+    def col_values(self, columna, value_render_option=None):
+        self._llamada("leer")
+        valores = [fila[columna - 1] if columna <= len(fila) else "" for fila in self.celdas]
+        if str(value_render_option).upper() != "FORMULA":
+            valores = [self._mostrado(v) for v in valores]
+        while valores and valores[-1] == "":
+            valores.pop()
+        return valores
+
+    def update_acell(self, celda, valor):
+        self._llamada("escribir")
+        self._escribir(*a1_to_rowcol(celda), valor)
+
+    def update(self, rango=None, valores=None, **kwargs):
+        self._llamada("escribir")
+        if isinstance(rango, list):      # gspread 6 acepta update(values, range_name)
+            rango, valores = valores, rango
+        rango = kwargs.get("range_name", rango) or "A1"
+        valores = kwargs.get("values", valores)
+        fila, columna = a1_to_rowcol(rango.split(":")[0])
+        for i, renglon in enumerate(valores):
+            for j, valor in enumerate(renglon):
+                self._escribir(fila + i, columna + j, valor)
+
+    def batch_update(self, datos, value_input_option=None):
+        self._llamada("escribir")
+        for cambio in datos:
+            fila, columna = a1_to_rowcol(cambio["range"].split(":")[0])
+            for i, renglon in enumerate(cambio["values"]):
+                for j, valor in enumerate(renglon):
+                    self._escribir(fila + i, columna + j, valor)
+
+    def a_csv(self):
+        salida = io.StringIO()
+        csv.writer(salida).writerows([[self._mostrado(v) for v in fila] for fila in self.celdas])
+        return salida.getvalue().encode("utf-8")
+
+
+class LibroSimulado:
+    """Spreadsheet de gspread: lo que usan conectar_gspread() y el cruce de calculos_ans.py."""
+
+    def __init__(self, hojas):
+        self.hojas = list(hojas)
+
+    def worksheets(self):
+        return list(self.hojas)
+
+    def worksheet(self, titulo):
+        for hoja in self.hojas:
+            if hoja.title == titulo:
+                return hoja
+        raise KeyError(titulo)
+
+    @property
+    def sheet1(self):
+        return self.hojas[0]
+
+
+class ClienteSheetsSimulado:
+    """Reemplazo de gspread.authorize(creds): open_by_key devuelve el libro registrado."""
+
+    def __init__(self, libros):
+        self.libros = dict(libros)
+
+    def open_by_key(self, clave):
+        return self.libros[clave]
+
+# ------------------------------------------------------------
+# BENCHMARK SIN RED
+# ------------------------------------------------------------
+ENCABEZADOS_FORMULARIO = [
+    "Marca temporal", "Número del pedido", "Nombre del técnico", "Actividad",
+    "Sube aquí la evidencia",
+]
+ACTIVIDADES = ["ALEGA-(LEGALIZACION RESIDENCIAL)", "ARTER-(REPLANTEO PREPAGO)", "AMRTR-(MOVIMIENTOS DE REDES)"]
+
+
+def respuestas_formulario(drive, desde, n, tamano):
+    """Filas de respuestas del formulario, cada una con su PDF en la carpeta del formulario."""
+    filas = []
+    for i in range(desde, desde + n):
+        pedido = str(20_000_000 + i)
+        tecnico = f"Tecnico {i % 37}"
+        file_id = drive.agregar_archivo(f"{pedido} - {tecnico}.pdf", tamano=tamano)
+        filas.append([
+            f"{1 + i % 28}/10/2025 {8 + i % 10}:{i % 60:02d}:{i % 47:02d}", pedido, tecnico,
+            ACTIVIDADES[i % len(ACTIVIDADES)], f"https://drive.google.com/open?id={file_id}",
+        ])
+    return filas
+
+
+def crear_formulario(drive, n, tamano, latencia_hoja=0.0):
+    return HojaSimulada(ENCABEZADOS_FORMULARIO, respuestas_formulario(drive, 0, n, tamano), latencia=latencia_hoja)
+
+
+@contextlib.contextmanager
+def silencio():
+    # TextIOWrapper y no StringIO: descargar_evidencias_drive.py hace sys.stdout.reconfigure()
+    with contextlib.redirect_stdout(io.TextIOWrapper(io.BytesIO(), encoding="utf-8")):
+        yield
+
+
+def medir(etiqueta, funcion, drive, resultados, hoja=None):
+    antes = Counter(drive.contadores)
+    antes_hoja = sum(hoja.contadores.values()) if hoja else 0
+    t0 = time.perf_counter()
+    with silencio():
+        funcion()
+    segundos = time.perf_counter() - t0
+    llamadas = Counter(drive.contadores)
+    llamadas.subtract(antes)
+    if hoja:
+        llamadas["sheets"] = sum(hoja.contadores.values()) - antes_hoja
+    resultados.append((etiqueta, segundos, +llamadas))
+
+
+def benchmark_v48(n, args, carpeta):
+    with silencio():
+        import descargar_drive_v48 as v48
+
+    drive = DriveSimulado(args.latencia, args.ancho_banda, args.prob_cuota, args.tasa_maxima, semilla=n)
+    hoja = crear_formulario(drive, n, args.tamano, args.latencia_hoja)
+    drive.agregar_hoja(v48.SHEET_ID, hoja)
+
+    v48.RUTA_DESTINO = v48.CARPETA_FECHA = carpeta / "Evidencias_PDF"
+    v48.RUTA_MANIFIESTO = carpeta / "MANIFIESTO_DESCARGAS.db"
+    v48.conectar_gspread = lambda: hoja
+    crear = lambda: build("drive", "v3", http=drive, static_discovery=True)
+
+    v48.crear_servicio = crear
+
+    # 1ª corrida completa; luego llega un 1 % de respuestas nuevas (corrida incremental
+    # desde la marca de agua) y al final una revisión completa con --completo
+    nuevas = max(1, n // 100)
+    resultados = []
+    medir(f"v48 1ª corrida ({n} respuestas)", lambda: v48.main([]), drive, resultados, hoja)
+    hoja.celdas += respuestas_formulario(drive, n, nuevas, args.tamano)
+    medir(f"v48 incremental (+{nuevas} nuevas)", lambda: v48.main([]), drive, resultados, hoja)
+    medir("v48 --completo", lambda: v48.main(["--completo"]), drive, resultados, hoja)
+    n += nuevas
+
+    descargados = sum(1 for p in v48.RUTA_DESTINO.rglob("*.pdf"))
+    return resultados, f"{descargados}/{n} PDF en disco"
+
+
+def benchmark_evidencias(n, args, carpeta):
+    with silencio():
+        import descargar_evidencias_drive as evidencias
+
+    drive = DriveSimulado(args.latencia, args.ancho_banda, args.prob_cuota, args.tasa_maxima, semilla=n)
+    for i in range(n):
+        drive.agregar_archivo(f"evidencia_{i:05d}.jpg", tamano=args.tamano)
+
+    evidencias.CARPETA_LOCAL = str(carpeta / "Evidencias_ANS")
+    evidencias.FOLDER_ID_FORMULARIO = FORMULARIO
+    evidencias.FOLDER_ID_PAPELERA = PAPELERA
+    crear = lambda: build("drive", "v3", http=drive, static_discovery=True)
+
+    resultados = []
+    medir("evidencias: descargar y mover", lambda: evidencias.descargar_archivos(crear=crear), drive, resultados)
+    movidos = len(drive.en_carpeta(PAPELERA))
+    en_disco = sum(1 for p in Path(evidencias.CARPETA_LOCAL).rglob("*") if p.is_file())
+    return resultados, f"{en_disco}/{n} en disco, {movidos}/{n} movidos a PAPELERA_API"
+
+
+BENCHMARKS = {"v48": benchmark_v48, "evidencias": benchmark_evidencias}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sin red de los scripts de descarga de Drive")
+    parser.add_argument("--archivos", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--scripts", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--tamano", type=int, default=100_000, help="bytes por archivo")
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos por solicitud a Drive")
+    parser.add_argument("--latencia-hoja", type=float, default=0.2, help="segundos por solicitud a Sheets")
+    parser.add_argument("--ancho-banda", type=float, default=20e6, help="bytes/s de descarga")
+    parser.add_argument("--prob-cuota", type=float, default=0.01, help="probabilidad de 429 por llamada")
+    parser.add_argument("--tasa-maxima", type=float, default=None, help="llamadas/s antes de 403 por cuota")
+    parser.add_argument("--conservar", action="store_true", help="no borra la carpeta temporal")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    for n in args.archivos:
+        for script in args.scripts:
+            carpeta = Path(tempfile.mkdtemp(prefix=f"simulador_{script}_{n}_"))
+            try:
+                resultados, resumen = BENCHMARKS[script](n, args, carpeta)
+            finally:
+                if not args.conservar:
+                    shutil.rmtree(carpeta, ignore_errors=True)
+
+            print("------------------------------------------------------------")
+            print(f"📊 {script} con {n} archivos → {resumen}")
+            for etiqueta, segundos, llamadas in resultados:
+                detalle = ", ".join(f"{k} {v}" for k, v in sorted(llamadas.items()) if k != "bytes")
+                print(f"⏱️ {etiqueta}: {segundos:.2f} s | {detalle or 'sin llamadas'}")
+    print("------------------------------------------------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,128 @@
+"""
+------------------------------------------------------------
+CONTROL FÉNIX vs ALMACÉN (ELITE) – Proyecto Control_ANS
+------------------------------------------------------------
+Autor: Héctor + IA (2025)
+------------------------------------------------------------
+Descripción:
+- Motor importable: ejecutar_cruce(df_fenix, df_elite, df_planilla)
+  recibe DataFrames y devuelve un ResultadoCruce con merge,
+  no coincidentes y resumen (sin tocar disco).
+- leer_fenix / leer_planilla / preparar_elite cargan los archivos
+  de data_raw; exportar_excel genera CONTROL_ALMACEN.xlsx.
+- Ejecutado como script (main) hace el flujo completo con estado
+  incremental por pedido (--completo recalcula todo).
+- Modo particionado (--particiones N / --memoria-mb M / --procesos P):
+  lee FÉNIX y la planilla por bloques, los reparte por hash de pedido
+  en disco y cruza partición por partición; los resultados van a un
+  spool en disco y el Excel se escribe en modo solo escritura, con
+  memoria acotada y el mismo resultado.
+------------------------------------------------------------
+"""
+
 # ============================================================
 # 1. LIBRERÍAS
 # ============================================================
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from datetime import date, datetime
 from pathlib import Path
 import pandas as pd
+import hashlib
+import heapq
+import io
+import os
+import pickle
+import shutil
+import sys
+import tempfile
 import time
-from openpyxl import load_workbook, Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+import tracemalloc
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Alignment
+from openpyxl.formatting.rule import FormulaRule
 from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.table import Table, TableStyleInfo
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
 
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+try:
+    import resource  # pico de memoria (RSS) en Linux/macOS
+except ImportError:  # Windows
+    resource = None
+
 # ============================================================
-# 2. CONFIGURACIÓN DE RUTAS
+# 2. CONFIGURACIÓN DE RUTAS (valores por defecto del CLI)
 # ============================================================
 base = Path(__file__).resolve().parent
 
-# Detecta automáticamente si existe el archivo TXT o XLSX
 ruta_fenix_txt = base / "data_raw" / "Digitacion Fenix.txt"
 ruta_fenix_xlsx = base / "data_raw" / "Digitacion Fenix.xlsx"
-
-# Usa el archivo que realmente exista
-if ruta_fenix_txt.exists():
-    ruta_fenix = ruta_fenix_txt
-    print("📁 Detectado archivo Fénix: Digitacion Fenix.txt")
-else:
-    ruta_fenix = ruta_fenix_xlsx
-    print("📁 Detectado archivo Fénix: Digitacion Fenix.xlsx")
-
 ruta_elite = base / "data_raw" / "Planilla Consumos.xlsx"
 ruta_salida = base / "data_clean" / "CONTROL_ALMACEN.xlsx"
+ruta_estado = base / "data_clean" / "ESTADO_CRUCE_ALMACEN.pkl"
 
 
-print("------------------------------------------------------------")
-print("🚀 INICIANDO CRUCE FÉNIX vs ELITE (v3.2)...")
-inicio = time.time()  
-print("------------------------------------------------------------")
+def detectar_ruta_fenix():
+    """Usa Digitacion Fenix.txt si existe; si no, la versión .xlsx."""
+    if ruta_fenix_txt.exists():
+        print("📁 Detectado archivo Fénix: Digitacion Fenix.txt")
+        return ruta_fenix_txt
+    print("📁 Detectado archivo Fénix: Digitacion Fenix.xlsx")
+    return ruta_fenix_xlsx
 
 # ============================================================
-# 3. CARGA DE DATOS
+# 2.1. ESTADO INCREMENTAL POR PEDIDO
 # ============================================================
+# Cambiar la versión invalida el estado guardado (obliga a recalcular todo)
+# cuando se modifiquen las reglas del cruce (equivalencias, complementos...).
+VERSION_CRUCE = "v4.5"
+
+
+def huella_por_pedido(df, columnas):
+    """Devuelve un hash de contenido por pedido (sensible al orden de las líneas).
+
+    Las líneas sin pedido no tienen huella: ejecutar_cruce las recalcula siempre."""
+    if df.empty:
+        return pd.Series(dtype=str)
+    columnas = [c for c in columnas if c in df.columns]
+    hash_filas = pd.util.hash_pandas_object(df[columnas].astype(str), index=False)
+    return hash_filas.groupby(df["pedido"].values, sort=False).agg(
+        lambda h: hashlib.blake2b(h.values.tobytes(), digest_size=16).hexdigest()
+    )
 
+
+def cargar_estado(ruta, completo=False):
+    """Lee el estado del último cruce; None si no existe, es de otra versión o se pidió completo."""
+    if completo:
+        print("🔁 Recalculo completo solicitado (--completo).")
+        return None
+    if not ruta.exists():
+        return None
+    try:
+        estado = pd.read_pickle(ruta)
+    except Exception as e:
+        print(f"⚠️ Estado incremental ilegible, se recalcula todo: {e}")
+        return None
+    if estado.get("version") != VERSION_CRUCE:
+        print("🔁 Estado incremental de otra versión del cruce, se recalcula todo.")
+        return None
+    return estado
+
+
+def guardar_estado(ruta, resultado):
+    try:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(resultado.estado(), ruta)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el estado incremental: {e}")
+
+# ============================================================
+# 3. CARGA Y PREPARACIÓN DE DATOS
+# ============================================================
 columnas_fenix = [
     "pedido", "subz", "municipio", "contrato", "acta", "actividad",
     "fecha_estado", "pagina", "urbrur", "tipre", "red_interna",
@@ -49,8 +130,20 @@ columnas_fenix = [
     "item_res", "cantidad", "vlr_cliente", "valor_costo"
 ]
 
-# --- FÉNIX --- (lectura optimizada)
-try:
+
+def preparar_fenix(df_fenix):
+    """Normaliza la digitación FÉNIX (columnas en minúscula, cantidad numérica)."""
+    df_fenix = df_fenix.copy()
+    df_fenix.columns = df_fenix.columns.str.lower().str.strip()
+    df_fenix = df_fenix[[c for c in columnas_fenix if c in df_fenix.columns]]
+    df_fenix["cantidad_fenix"] = pd.to_numeric(df_fenix["cantidad"], errors="coerce").fillna(0)
+    if "mano_obra" not in df_fenix.columns:
+        df_fenix["mano_obra"] = None
+    return df_fenix
+
+
+def leer_fenix(ruta_fenix):
+    # --- FÉNIX --- (lectura optimizada)
     if ruta_fenix.suffix.lower() == ".txt":
         # ✅ Lectura directa con separador definido (mucho más rápida)
         df_fenix = pd.read_csv(
@@ -64,22 +157,32 @@ try:
     else:
         df_fenix = pd.read_excel(ruta_fenix, dtype=str)
 
-    # Normalización de columnas
-    df_fenix.columns = df_fenix.columns.str.lower().str.strip()
-    df_fenix = df_fenix[[c for c in columnas_fenix if c in df_fenix.columns]]
-    df_fenix["cantidad_fenix"] = pd.to_numeric(df_fenix["cantidad"], errors="coerce").fillna(0)
-    if "mano_obra" not in df_fenix.columns:
-        df_fenix["mano_obra"] = None
+    return preparar_fenix(df_fenix)
 
-except Exception as e:
-    raise SystemExit(f"❌ Error al leer FÉNIX: {e}")
 
-# --- ELITE --- (lectura optimizada)
-try:
+def leer_planilla(ruta_elite):
+    """Lee la Planilla Consumos una sola vez (hoja y fila de encabezado detectadas)."""
+    # --- ELITE --- (lectura optimizada)
     print("🔎 Leyendo Planilla Consumos")
 
     xls = pd.ExcelFile(ruta_elite)
+    hoja_correcta, fila_header = detectar_hoja_planilla(xls)
 
+    # ✅ Leer desde la fila detectada (fila 5 en tu archivo)
+    df_planilla = pd.read_excel(
+        xls,
+        sheet_name=hoja_correcta,
+        dtype=str,
+        skiprows=fila_header
+    )
+    df_planilla = normalizar_encabezados(df_planilla)
+
+    print(f"📋 Encabezados finales: {list(df_planilla.columns)}")
+    return df_planilla
+
+
+def detectar_hoja_planilla(xls):
+    """Hoja de la planilla y fila (0-based) donde está el encabezado real."""
     # ✅ Detección automática de la hoja correcta
     hoja_correcta = None
     for hoja in xls.sheet_names:
@@ -104,26 +207,25 @@ try:
     if fila_header is None:
         raise Exception("No se encontró encabezado con 'pedido' o 'cantidad'.")
 
-    # ✅ Leer desde la fila detectada (fila 5 en tu archivo)
-    df_elite = pd.read_excel(
-        xls,
-        sheet_name=hoja_correcta,
-        dtype=str,
-        skiprows=fila_header
-    )
-
     print(f"📍 Hoja detectada: {hoja_correcta}")
     print(f"📍 Encabezado detectado en fila: {fila_header + 1}")
+    return hoja_correcta, fila_header
+
 
+def normalizar_encabezados(df_planilla):
     # 🔹 Normalizar encabezados
-    df_elite.columns = (
-        df_elite.columns.map(str)
+    df_planilla.columns = (
+        df_planilla.columns.map(str)
         .str.lower()
         .str.strip()
         .str.replace(r"unnamed.*", "", regex=True)
     )
+    return df_planilla
+
 
-    print(f"📋 Encabezados finales: {list(df_elite.columns)}")
+def preparar_elite(df_planilla):
+    """Extrae de la planilla las líneas ELITE (pedido, código, cantidad, técnico)."""
+    df_elite = df_planilla.copy()
 
     # 🔹 Renombrar columnas relevantes
     for col in df_elite.columns:
@@ -133,9 +235,11 @@ try:
             df_elite.rename(columns={col: "codigo"}, inplace=True)
         elif "cantidad" in col:
             df_elite.rename(columns={col: "cantidad_elite"}, inplace=True)
+        elif "tecnico" in col or "técnico" in col:
+            df_elite.rename(columns={col: "tecnico"}, inplace=True)
 
-    # 🔹 Mantener solo columnas necesarias
-    columnas_necesarias = ["pedido", "codigo", "cantidad_elite"]
+    # 🔹 Mantener solo columnas necesarias (técnico solo se usa para detectar cambios)
+    columnas_necesarias = ["pedido", "codigo", "cantidad_elite", "tecnico"]
     df_elite = df_elite[[c for c in columnas_necesarias if c in df_elite.columns]]
 
     # 🔹 Limpieza y conversión
@@ -144,591 +248,1311 @@ try:
     df_elite["cantidad_elite"] = pd.to_numeric(df_elite["cantidad_elite"], errors="coerce").fillna(0)
 
     print(f"✅ Planilla Consumos lista: {len(df_elite)} registros limpios.")
+    return df_elite
+
+def cruzar_pedidos(df_fenix, df_elite, df_planilla):
+    """Cruza FÉNIX vs ELITE y devuelve (df_merge, df_nocruce) de los pedidos recibidos.
+
+    `df_fenix` y `df_elite` vienen de preparar_fenix / preparar_elite y
+    `df_planilla` es la planilla completa (leer_planilla), usada para técnico
+    y cantidades reales en NO_COINCIDEN. Los DataFrames recibidos se modifican.
+    """
+    # ------------------------------------------------------------
+    # 4.0. CRUCE PRINCIPAL
+    # ------------------------------------------------------------
+    print("⚙️ Ejecutando cruce principal FÉNIX vs ELITE...")
+
+    df_fenix.rename(columns={"item_res": "codigo"}, inplace=True)
+
+    # Validar columnas clave
+    for col in ["pedido", "codigo"]:
+        if col not in df_fenix.columns:
+            df_fenix[col] = None
+        if col not in df_elite.columns:
+            df_elite[col] = None
+
+    # Filtrar códigos válidos (solo 6 dígitos)
+    df_elite = df_elite[df_elite["codigo"].astype(str).str.match(r"^\d{6}$", na=False)]
+
+    # ============================================================
+    # 4.1. Normalizar códigos base y complementarios antes del merge
+    # ============================================================
+
+    # 🔹 Definir equivalencias base ↔ complemento
+    equivalencias = {
+        "200492A": "200492",
+        "200384A": "200384"
+    }
 
-except Exception as e:
-    raise SystemExit(f"❌ Error al leer Planilla Consumos: {e}")
+    # 🔹 Crear columna auxiliar con el código base normalizado
+    df_fenix["codigo_equiv"] = df_fenix["codigo"].replace(equivalencias)
+    df_elite["codigo_equiv"] = df_elite["codigo"].replace(equivalencias)
+
+    # 🔹 Agregar columna 'origen' antes del merge (evita KeyError)
+    df_fenix["origen"] = "FENIX"
+    df_elite["origen"] = "ELITE"
+
+    # 🔹 Merge extendido usando el código normalizado
+    df_full = pd.merge(
+        df_fenix,
+        df_elite[["pedido", "codigo_equiv", "cantidad_elite", "origen"]],
+        left_on=["pedido", "codigo_equiv"],
+        right_on=["pedido", "codigo_equiv"],
+        how="outer",
+        indicator=True
+    )
 
-print("✅ Archivos cargados correctamente.")
-time.sleep(0.5)
+    # 🔹 Renombrar para mantener compatibilidad con el resto del código
+    df_full.rename(columns={"codigo_equiv": "codigo"}, inplace=True)
+
+    # ============================================================
+    # 🔧 Limpieza de duplicados tras merge extendido
+    # ============================================================
+    # Eliminar columnas duplicadas (mantiene solo la primera aparición)
+    df_full = df_full.loc[:, ~df_full.columns.duplicated()].copy()
+
+    # En caso de que queden versiones 'codigo_x' o 'codigo_y', unificarlas
+    if "codigo_x" in df_full.columns:
+        df_full["codigo"] = df_full["codigo_x"].combine_first(df_full.get("codigo_y"))
+        df_full.drop(columns=["codigo_x", "codigo_y"], errors="ignore", inplace=True)
+
+
+    # # ============================================================
+    # # 5. CRUCE COMPLETO PARA DETECTAR COINCIDENCIAS Y FALTANTES
+    # # ============================================================
+    # df_fenix["origen"] = "FENIX"
+    # df_elite["origen"] = "ELITE"
+
+    # # Cruce completo (outer join)
+    # df_full = pd.merge(
+    #     df_fenix,
+    #     df_elite[["pedido", "codigo", "cantidad_elite", "origen"]],
+    #     on=["pedido", "codigo"],
+    #     how="outer",
+    #     indicator=True
+    # )
+
+    # ============================================================
+    # 6. GENERAR SUBCONJUNTOS
+    # ============================================================
+    # Coincidencias reales (ambos archivos)
+    df_merge = df_full[df_full["_merge"] == "both"].copy()
+
+    # Sin cruce (solo FENIX o solo ELITE)
+    df_nocruce = df_full[df_full["_merge"] != "both"].copy()
+    df_nocruce["origen"] = df_nocruce["_merge"].replace({
+        "left_only": "Solo en FENIX",
+        "right_only": "Solo en ELITE"
+    })
+
+    # ============================================================
+    # 6.1. REGLA ESPECIAL – Mantener códigos complementarios válidos
+    # ============================================================
+    # No enviar a NO_COINCIDEN el código 200492A (ni sus pares)
+    codigos_validos = ["200492A"]
+
+    # Sacar estos registros de df_nocruce y mantenerlos en df_merge
+    df_extra_validos = df_nocruce[df_nocruce["codigo"].isin(codigos_validos)].copy()
+    if not df_extra_validos.empty:
+        print(f"🧩 Registros especiales mantenidos en CONTROL_ALMACEN: {len(df_extra_validos)}")
+        df_extra_validos["estado"] = "OK – Material Complementario"
+        df_extra_validos["diferencia"] = 0
+        df_merge = pd.concat([df_merge, df_extra_validos], ignore_index=True)
+
+        # Quitar estos del listado de no coincidentes
+        df_nocruce = df_nocruce[~df_nocruce["codigo"].isin(codigos_validos)]
+
+
+    # ============================================================
+    # 7. CÁLCULO DE DIFERENCIA Y ESTADO
+    # ============================================================
+    df_merge["cantidad_fenix"] = pd.to_numeric(df_merge.get("cantidad", 0), errors="coerce").fillna(0)
+    df_merge["cantidad_elite"] = pd.to_numeric(df_merge.get("cantidad_elite", 0), errors="coerce").fillna(0)
+    df_merge["diferencia"] = df_merge["cantidad_fenix"] - df_merge["cantidad_elite"]
+
+    def evaluar(row):
+        if row["diferencia"] == 0:
+            return "OK"
+        elif row["diferencia"] > 0:
+            return "FALTANTE EN ELITE"
+        else:
+            return "EXCESO EN ELITE"
+
+    df_merge["estado"] = df_merge.apply(evaluar, axis=1)
+    # ============================================================
+    # 7.1. AJUSTE DE MATERIALES COMPLEMENTARIOS (mantiene ambos códigos visibles)
+    # ============================================================
+
+    # 🔹 Diccionario base ↔ complemento (Se puede ampliar sin modificar lógica)
+    complementos = {
+        "200492": "200492A",
+        "200384": "200384A"
+    }
 
-# ============================================================
-# 4. CRUCE PRINCIPAL (FÉNIX vs ELITE)
-# ============================================================
-print("⚙️ Ejecutando cruce principal FÉNIX vs ELITE...")
+    ajustes_realizados = 0
 
-df_fenix.rename(columns={"item_res": "codigo"}, inplace=True)
+    # 🔹 1. Ajuste en df_merge (CONTROL_ALMACEN): totales por pedido de cada par base/complemento
+    for base, comp in complementos.items():
+        en_par = df_merge["codigo"].isin([base, comp])
+        if not en_par.any():
+            continue
+        totales = df_merge[en_par].groupby("pedido")[["cantidad_fenix", "cantidad_elite"]].sum()
+
+        # Si Elite tiene igual o más cantidad → marcar ambos como complementarios
+        pedidos_ok = totales.index[
+            (totales["cantidad_elite"] >= totales["cantidad_fenix"]) & (totales["cantidad_fenix"] > 0)
+        ]
+        df_merge.loc[en_par & df_merge["pedido"].isin(pedidos_ok), ["estado", "diferencia"]] = [
+            "OK – Material Complementario", 0
+        ]
+        ajustes_realizados += len(pedidos_ok)
+
+    print(f"🔧 Ajustes aplicados (manteniendo ambos códigos): {ajustes_realizados}")
+
+    # 🔹 2. Ajuste en df_nocruce (NO_COINCIDEN)
+    if not df_nocruce.empty:
+        registros_ajustados = 0
+        for base, comp in complementos.items():
+            df_nocruce = df_nocruce[
+                ~(
+                    (df_nocruce["codigo"].isin([base, comp]))
+                    & (df_nocruce["pedido"].isin(df_merge["pedido"].unique()))
+                )
+            ]
+            registros_ajustados += 1
+        print(f"🧩 Registros eliminados de NO_COINCIDEN por complementarios: {registros_ajustados}")
+    # ============================================================
+    # 8. ORGANIZAR COLUMNAS FINALES
+    # ============================================================
+    columnas_fenix = [
+        "pedido", "subz", "municipio", "contrato", "acta",
+        "actividad", "fecha_estado", "pagina", "urbrur", "tipre",
+        "red_interna", "tipo_operacion", "tipo", "cobro", "suminis",
+        "item_cont", "codigo", "cantidad", "vlr_cliente", "valor_costo"
+    ]
 
-# Validar columnas clave
-for col in ["pedido", "codigo"]:
-    if col not in df_fenix.columns:
-        df_fenix[col] = None
-    if col not in df_elite.columns:
-        df_elite[col] = None
+    # Cambiar el nombre de la columna "estado" a "status" antes del orden
+    if "estado" in df_merge.columns:
+        df_merge.rename(columns={"estado": "status"}, inplace=True)
 
-# Filtrar códigos válidos (solo 6 dígitos)
-df_elite = df_elite[df_elite["codigo"].astype(str).str.match(r"^\d{6}$", na=False)]
+    # De momento NO filtramos columnas aquí — lo haremos al final.
+    # Esto evita que se pierda la columna 'tecnico' tras el merge.
 
-# ============================================================
-# 4.1. Normalizar códigos base y complementarios antes del merge
-# ============================================================
+    # ============================================================
+    # 8.1 AGREGAR COLUMNA TÉCNICO (BUSCARV DESDE PLANILLA CONSUMOS)
+    # ============================================================
+    try:
+        df_tecnicos = df_planilla.copy()
 
-# 🔹 Definir equivalencias base ↔ complemento
-equivalencias = {
-    "200492A": "200492",
-    "200384A": "200384"
-}
+        posibles_cols = ["#pedido", "pedido", "codigu", "codigo", "tecnico", "técnico"]
+        df_tecnicos = df_tecnicos[[c for c in df_tecnicos.columns if any(p in c for p in posibles_cols)]]
 
-# 🔹 Crear columna auxiliar con el código base normalizado
-df_fenix["codigo_equiv"] = df_fenix["codigo"].replace(equivalencias)
-df_elite["codigo_equiv"] = df_elite["codigo"].replace(equivalencias)
+        df_tecnicos.rename(columns={
+            "#pedido": "pedido",
+            "codigu": "codigo",
+            "codigo": "codigo",
+            "tecnico": "tecnico",
+            "técnico": "tecnico",
+        }, inplace=True)
 
-# 🔹 Agregar columna 'origen' antes del merge (evita KeyError)
-df_fenix["origen"] = "FENIX"
-df_elite["origen"] = "ELITE"
+        df_tecnicos = df_tecnicos[["pedido", "tecnico"]].drop_duplicates(subset=["pedido"])
 
-# 🔹 Merge extendido usando el código normalizado
-df_full = pd.merge(
-    df_fenix,
-    df_elite[["pedido", "codigo_equiv", "cantidad_elite", "origen"]],
-    left_on=["pedido", "codigo_equiv"],
-    right_on=["pedido", "codigo_equiv"],
-    how="outer",
-    indicator=True
-)
+        # 🔹 Merge tipo BUSCARV
+        df_merge = df_merge.merge(df_tecnicos, on="pedido", how="left")
 
-# 🔹 Renombrar para mantener compatibilidad con el resto del código
-df_full.rename(columns={"codigo_equiv": "codigo"}, inplace=True)
+        # 🔹 Reemplazar vacíos en la columna técnico por "SIN DATOS"
+        if "tecnico" in df_merge.columns:
+            df_merge["tecnico"] = df_merge["tecnico"].fillna("SIN DATOS").replace("", "SIN DATOS")
 
-# ============================================================
-# 🔧 Limpieza de duplicados tras merge extendido
-# ============================================================
-# Eliminar columnas duplicadas (mantiene solo la primera aparición)
-df_full = df_full.loc[:, ~df_full.columns.duplicated()].copy()
-
-# En caso de que queden versiones 'codigo_x' o 'codigo_y', unificarlas
-if "codigo_x" in df_full.columns:
-    df_full["codigo"] = df_full["codigo_x"].combine_first(df_full.get("codigo_y"))
-    df_full.drop(columns=["codigo_x", "codigo_y"], errors="ignore", inplace=True)
-
-
-# # ============================================================
-# # 5. CRUCE COMPLETO PARA DETECTAR COINCIDENCIAS Y FALTANTES
-# # ============================================================
-# df_fenix["origen"] = "FENIX"
-# df_elite["origen"] = "ELITE"
-
-# # Cruce completo (outer join)
-# df_full = pd.merge(
-#     df_fenix,
-#     df_elite[["pedido", "codigo", "cantidad_elite", "origen"]],
-#     on=["pedido", "codigo"],
-#     how="outer",
-#     indicator=True
-# )
+        # 🔹 Reubicar columna 'tecnico' justo después de 'status'
+        if "tecnico" in df_merge.columns and "status" in df_merge.columns:
+            cols = list(df_merge.columns)
+            idx_status = cols.index("status")
+            cols.insert(idx_status + 1, cols.pop(cols.index("tecnico")))
+            df_merge = df_merge[cols]
 
-# ============================================================
-# 6. GENERAR SUBCONJUNTOS
-# ============================================================
-# Coincidencias reales (ambos archivos)
-df_merge = df_full[df_full["_merge"] == "both"].copy()
+        print("👷 Columna 'TÉCNICO' agregada correctamente desde Planilla Consumos.xlsx.")
 
-# Sin cruce (solo FENIX o solo ELITE)
-df_nocruce = df_full[df_full["_merge"] != "both"].copy()
-df_nocruce["origen"] = df_nocruce["_merge"].replace({
-    "left_only": "Solo en FENIX",
-    "right_only": "Solo en ELITE"
-})
+    except Exception as e:
+        print(f"⚠️ No se pudo agregar la columna 'TÉCNICO': {e}")
 
-# ============================================================
-# 6.1. REGLA ESPECIAL – Mantener códigos complementarios válidos
-# ============================================================
-# No enviar a NO_COINCIDEN el código 200492A (ni sus pares)
-codigos_validos = ["200492A"]
+    # ============================================================
+    # 8.2 ORDEN FINAL DE COLUMNAS (ya con TÉCNICO incluido)
+    # ============================================================
+    columnas_finales = columnas_fenix + ["cantidad_elite", "diferencia", "status", "tecnico"]
+    df_merge = df_merge[[c for c in columnas_finales if c in df_merge.columns]]
 
-# Sacar estos registros de df_nocruce y mantenerlos en df_merge
-df_extra_validos = df_nocruce[df_nocruce["codigo"].isin(codigos_validos)].copy()
-if not df_extra_validos.empty:
-    print(f"🧩 Registros especiales mantenidos en CONTROL_ALMACEN: {len(df_extra_validos)}")
-    df_extra_validos["estado"] = "OK – Material Complementario"
-    df_extra_validos["diferencia"] = 0
-    df_merge = pd.concat([df_merge, df_extra_validos], ignore_index=True)
+    # Para hoja NO_COINCIDEN
+    columnas_nocruce = ["pedido", "codigo", "cantidad", "cantidad_elite", "origen"]
+    df_nocruce = df_nocruce[[c for c in columnas_nocruce if c in df_nocruce.columns]]
+    # ============================================================
+    # 8.3 RECONSTRUCCIÓN FINAL DE HOJA NO_COINCIDEN (v4.0 con cantidad real)
+    # ============================================================
+    try:
+        # --- Planilla con pedido, código, cantidad y técnico ---
+        df_planilla = df_planilla.copy()
+
+        # Renombrar columnas clave
+        df_planilla.rename(columns={
+            "#pedido": "pedido",
+            "codigu": "codigo",
+            "cantidad": "cantidad_elite",
+            "técnico": "tecnico"
+        }, inplace=True)
+
+        # Filtrar columnas relevantes
+        columnas_necesarias = ["pedido", "codigo", "cantidad_elite", "tecnico"]
+        df_planilla = df_planilla[[c for c in df_planilla.columns if c in columnas_necesarias]].copy()
+
+        # Limpieza básica
+        df_planilla["pedido"] = df_planilla["pedido"].astype(str).str.strip()
+        df_planilla["codigo"] = df_planilla["codigo"].astype(str).str.strip()
+        df_planilla["tecnico"] = df_planilla["tecnico"].astype(str).str.strip()
+        df_planilla["cantidad_elite"] = (
+        df_planilla["cantidad_elite"]
+        .astype(str)
+        .str.replace(",", ".", regex=False)
+        .apply(lambda x: float(x) if x.replace(".", "", 1).isdigit() else 0)
+    )
 
-    # Quitar estos del listado de no coincidentes
-    df_nocruce = df_nocruce[~df_nocruce["codigo"].isin(codigos_validos)]
+        df_planilla.dropna(subset=["pedido", "codigo"], inplace=True)
+        df_planilla.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
+
+        # --- Filtrar registros Solo en ELITE ---
+        df_nc_elite = df_nocruce[df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False)].copy()
+        df_nc_otros = df_nocruce[~df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False)].copy()
+
+        if not df_nc_elite.empty:
+            pedidos_elite = df_nc_elite["pedido"].unique().tolist()
+            df_codigos_planilla = df_planilla[df_planilla["pedido"].isin(pedidos_elite)].copy()
+
+            # Crear base limpia con estructura correcta
+            df_nueva_elite = pd.DataFrame({
+                "pedido": df_codigos_planilla["pedido"],
+                "codigo": df_codigos_planilla["codigo"],
+                "cantidad": 0,
+                "cantidad_elite": df_codigos_planilla["cantidad_elite"],
+                "origen": "Solo en ELITE",
+                "tecnico": df_codigos_planilla["tecnico"]
+            })
+
+            # Evitar duplicados reales
+            df_nueva_elite.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
+
+            # Combinar con el resto (Solo FENIX, etc.)
+            df_nocruce = pd.concat([df_nc_otros, df_nueva_elite], ignore_index=True)
+
+        # 🔹 Asegurar orden de columnas
+        columnas_nocruce = ["pedido", "codigo", "cantidad", "cantidad_elite", "origen", "tecnico"]
+        df_nocruce = df_nocruce[[c for c in columnas_nocruce if c in df_nocruce.columns]]
+
+        print("✅ Hoja NO_COINCIDEN reconstruida con cantidades reales y técnico correcto (v4.0).")
+
+    except Exception as e:
+        print(f"⚠️ Error al reconstruir hoja NO_COINCIDEN: {e}")
+
+    # ============================================================
+    # 🔹 LIMPIEZA DE PEDIDOS (evita falsos pedidos 1, 2, 3…)
+    # ============================================================
+    if "pedido" in df_elite.columns:
+        # Normalizar y eliminar filas sin pedido válido
+        df_elite["pedido"] = (
+            df_elite["pedido"]
+            .astype(str)
+            .str.strip()
+            .replace({"nan": None, "": None})
+        )
 
+        # Conservar solo filas con pedidos numéricos reales de 8 dígitos o más
+        df_elite = df_elite[
+            df_elite["pedido"].notna() &
+            df_elite["pedido"].str.match(r"^\d{8,}$", na=False)
+        ]
 
-# ============================================================
-# 7. CÁLCULO DE DIFERENCIA Y ESTADO
-# ============================================================
-df_merge["cantidad_fenix"] = pd.to_numeric(df_merge.get("cantidad", 0), errors="coerce").fillna(0)
-df_merge["cantidad_elite"] = pd.to_numeric(df_merge.get("cantidad_elite", 0), errors="coerce").fillna(0)
-df_merge["diferencia"] = df_merge["cantidad_fenix"] - df_merge["cantidad_elite"]
-
-def evaluar(row):
-    if row["diferencia"] == 0:
-        return "OK"
-    elif row["diferencia"] > 0:
-        return "FALTANTE EN ELITE"
-    else:
-        return "EXCESO EN ELITE"
+        # Eliminar filas vacías restantes
+        df_elite = df_elite.dropna(subset=["pedido"])
 
-df_merge["estado"] = df_merge.apply(evaluar, axis=1)
-# ============================================================
-# 7.1. AJUSTE DE MATERIALES COMPLEMENTARIOS (mantiene ambos códigos visibles)
-# ============================================================
+    # ============================================================
+    # 🔧 Limpieza final: evitar pedidos duplicados entre FÉNIX y ELITE
+    # ============================================================
+    try:
+        if 'df_nocruce' in locals() and not df_nocruce.empty:
+            # Asegurar tipos de datos consistentes
+            df_nocruce["pedido"] = df_nocruce["pedido"].astype(str).str.strip()
+            df_nocruce["origen"] = df_nocruce["origen"].astype(str)
 
-# 🔹 Diccionario base ↔ complemento (Se puede ampliar sin modificar lógica)
-complementos = {
-    "200492": "200492A",
-    "200384": "200384A"
-}
+            # 1️⃣ Obtener todos los pedidos que están en "Solo en ELITE"
+            pedidos_elite = df_nocruce.loc[
+                df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False),
+                "pedido"
+            ].unique()
 
-ajustes_realizados = 0
+            # 2️⃣ Eliminar versiones duplicadas de esos mismos pedidos en "Solo en FENIX"
+            df_nocruce = df_nocruce[
+                ~(
+                    (df_nocruce["pedido"].isin(pedidos_elite)) &
+                    (df_nocruce["origen"].str.contains("Solo en FENIX", case=False, na=False))
+                )
+            ].copy()
 
-# 🔹 1. Ajuste en df_merge (CONTROL_ALMACEN)
-for pedido in df_merge["pedido"].unique():
-    for base, comp in complementos.items():
-        # Filtrar registros del mismo pedido con el código base o su complemento
-        grupo = df_merge[
-            (df_merge["pedido"] == pedido)
-            & (df_merge["codigo"].isin([base, comp]))
-        ]
+            # 3️⃣ Eliminar duplicados exactos (por pedido + código)
+            df_nocruce.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
 
-        if not grupo.empty:
-            total_fenix = grupo["cantidad_fenix"].sum()
-            total_elite = grupo["cantidad_elite"].sum()
+            # 4️⃣ Ordenar por pedido y código
+            df_nocruce.sort_values(by=["pedido", "codigo"], inplace=True, ignore_index=True)
 
-            # Si Elite tiene igual o más cantidad → marcar ambos como complementarios
-            if total_elite >= total_fenix and total_fenix > 0:
-                df_merge.loc[
-                    (df_merge["pedido"] == pedido)
-                    & (df_merge["codigo"].isin([base, comp])),
-                    ["estado", "diferencia"]
-                ] = ["OK – Material Complementario", 0]
-                ajustes_realizados += 1
+            print("🧩 Limpieza aplicada: eliminados duplicados FÉNIX/ELITE por pedido (v4.4).")
+        else:
+            print("⚠️ df_nocruce vacío o no definido, se omite limpieza final.")
+    except Exception as e:
+        print(f"⚠️ Error al limpiar duplicados entre FÉNIX y ELITE: {e}")
 
-print(f"🔧 Ajustes aplicados (manteniendo ambos códigos): {ajustes_realizados}")
 
-# 🔹 2. Ajuste en df_nocruce (NO_COINCIDEN)
-if not df_nocruce.empty:
-    registros_ajustados = 0
-    for base, comp in complementos.items():
-        df_nocruce = df_nocruce[
-            ~(
-                (df_nocruce["codigo"].isin([base, comp]))
-                & (df_nocruce["pedido"].isin(df_merge["pedido"].unique()))
-            )
-        ]
-        registros_ajustados += 1
-    print(f"🧩 Registros eliminados de NO_COINCIDEN por complementarios: {registros_ajustados}")
+    return df_merge, df_nocruce
+
 # ============================================================
-# 8. ORGANIZAR COLUMNAS FINALES
+# 8.4. RESULTADO Y CRUCE INCREMENTAL (solo pedidos con cambios)
 # ============================================================
-columnas_fenix = [
-    "pedido", "subz", "municipio", "contrato", "acta",
-    "actividad", "fecha_estado", "pagina", "urbrur", "tipre",
-    "red_interna", "tipo_operacion", "tipo", "cobro", "suminis",
-    "item_cont", "codigo", "cantidad", "vlr_cliente", "valor_costo"
-]
+@dataclass
+class ResultadoCruce:
+    merge: pd.DataFrame       # hoja CONTROL_ALMACEN
+    nocruce: pd.DataFrame     # hoja NO_COINCIDEN
+    resumen: pd.DataFrame     # hoja RESUMEN
+    huellas: pd.DataFrame     # hash FÉNIX / ELITE por pedido
+    recalculados: int = 0
+    reutilizados: int = 0
+
+    def estado(self):
+        """Estado persistible para el siguiente cruce incremental."""
+        return {
+            "version": VERSION_CRUCE,
+            "huellas": self.huellas,
+            "merge": self.merge,
+            "nocruce": self.nocruce,
+        }
+
+
+def ejecutar_cruce(df_fenix, df_elite, df_planilla, estado=None):
+    """Cruce FÉNIX vs ELITE en memoria.
+
+    Cada pedido se cruza de forma independiente: si se pasa el `estado` de una
+    ejecución anterior, los pedidos cuyas líneas en FÉNIX y en ELITE no
+    cambiaron se reutilizan y solo se recalculan los nuevos o modificados.
+    Los DataFrames de entrada no se modifican.
+    """
+    huellas = pd.DataFrame({
+        "hash_fenix": huella_por_pedido(df_fenix, list(df_fenix.columns)),
+        "hash_elite": huella_por_pedido(df_elite, list(df_elite.columns)),
+    }).fillna("")
+
+    if estado is None:
+        pedidos_cambiados = huellas.index
+        pedidos_reutilizables = huellas.index[:0]
+        df_merge_previo = df_nocruce_previo = None
+    else:
+        huellas_previas = estado["huellas"].reindex(huellas.index)
+        cambio = (
+            (huellas_previas["hash_fenix"] != huellas["hash_fenix"])
+            | (huellas_previas["hash_elite"] != huellas["hash_elite"])
+        )
+        pedidos_cambiados = huellas.index[cambio]
+        pedidos_retirados = estado["huellas"].index.difference(huellas.index)
+
+        # Resultados previos de los pedidos que siguen vigentes y no cambiaron
+        pedidos_reutilizables = huellas.index.difference(pedidos_cambiados)
+        df_merge_previo = estado["merge"][estado["merge"]["pedido"].isin(pedidos_reutilizables)]
+        df_nocruce_previo = estado["nocruce"][estado["nocruce"]["pedido"].isin(pedidos_reutilizables)]
+
+        print(
+            f"♻️ Pedidos reutilizados: {len(pedidos_reutilizables)} | "
+            f"🔁 Recalculados: {len(pedidos_cambiados)} | "
+            f"🗑️ Retirados: {len(pedidos_retirados)}"
+        )
 
-# Cambiar el nombre de la columna "estado" a "status" antes del orden
-if "estado" in df_merge.columns:
-    df_merge.rename(columns={"estado": "status"}, inplace=True)
+    # Las líneas sin pedido no entran en las huellas (groupby descarta NaN): se cruzan
+    # en cada ejecución para que sigan llegando a NO_COINCIDEN
+    fenix_a_cruzar = df_fenix["pedido"].isin(pedidos_cambiados) | df_fenix["pedido"].isna()
+    elite_a_cruzar = df_elite["pedido"].isin(pedidos_cambiados) | df_elite["pedido"].isna()
 
-# De momento NO filtramos columnas aquí — lo haremos al final.
-# Esto evita que se pierda la columna 'tecnico' tras el merge.
+    if fenix_a_cruzar.any() or elite_a_cruzar.any():
+        df_merge, df_nocruce = cruzar_pedidos(
+            df_fenix[fenix_a_cruzar].copy(),
+            df_elite[elite_a_cruzar].copy(),
+            df_planilla,
+        )
+    else:
+        print("✅ Sin cambios en FÉNIX ni ELITE: se reutiliza el cruce anterior.")
+        df_merge = pd.DataFrame(columns=["pedido", "codigo", "status"])
+        df_nocruce = pd.DataFrame(columns=["pedido", "codigo", "origen"])
+
+    if df_merge_previo is not None:
+        df_merge = pd.concat([df_merge_previo, df_merge], ignore_index=True)
+        df_nocruce = pd.concat([df_nocruce_previo, df_nocruce], ignore_index=True)
+
+    # Orden estable por pedido para que la salida no dependa de qué se recalculó
+    df_merge = df_merge.sort_values(by=["pedido", "codigo"], kind="stable", ignore_index=True)
+    df_nocruce = df_nocruce.sort_values(by=["pedido", "codigo"], kind="stable", ignore_index=True)
+
+    return ResultadoCruce(
+        merge=df_merge,
+        nocruce=df_nocruce,
+        resumen=crear_resumen(df_merge),
+        huellas=huellas,
+        recalculados=len(pedidos_cambiados),
+        reutilizados=len(pedidos_reutilizables),
+    )
 
 # ============================================================
-# 8.1 AGREGAR COLUMNA TÉCNICO (BUSCARV DESDE PLANILLA CONSUMOS)
+# 8.5. CRUCE PARTICIONADO EN DISCO (memoria acotada)
 # ============================================================
-try:
-    df_tecnicos = pd.read_excel(ruta_elite, sheet_name=None, dtype=str, header=None)
-    hoja_correcta, fila_header = None, None
-
-    for hoja, df_temp in df_tecnicos.items():
-        for i, fila in df_temp.iterrows():
-            fila_texto = " ".join(str(x).lower() for x in fila.values if pd.notna(x))
-            if "tecnico" in fila_texto or "técnico" in fila_texto:
-                hoja_correcta, fila_header = hoja, i
-                break
-        if hoja_correcta:
-            break
+# Cada pedido se cruza de forma independiente, así que repartir FÉNIX,
+# ELITE y la planilla por hash de pedido y cruzar partición por partición
+# da exactamente el mismo resultado que el cruce en memoria. Las entradas
+# se leen por bloques, cada partición deja su resultado ordenado en un
+# spool y su estado incremental en disco, y el Excel se escribe
+# mezclando los spools: en memoria vive una partición por trabajador.
+FILAS_POR_BLOQUE = 100_000
+# Con --memoria-mb se reparte en cubetas finas que luego se agrupan en
+# particiones según la memoria medida de cada una
+CUBETAS_MEMORIA = 256
+FILAS_POR_GRUPO_SPOOL = 1_000
+
+# Textos que pd.read_excel convierte en vacío (NaN)
+VALORES_VACIOS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+}
 
-    if hoja_correcta is None:
-        raise Exception("No se encontró ninguna hoja con encabezado 'TECNICO'.")
 
-    df_tecnicos = pd.read_excel(
-        ruta_elite,
-        sheet_name=hoja_correcta,
-        dtype=str,
-        skiprows=fila_header
-    )
+def particion_de(pedidos, n_particiones):
+    """Número de partición (0..n-1) de cada pedido, estable entre ejecuciones."""
+    claves = pedidos.astype(str).str.strip().to_numpy(dtype=object)
+    return pd.util.hash_array(claves) % n_particiones
+
+
+def pico_memoria_mb():
+    """Pico de memoria residente (RSS) de este proceso en MB; None si no se puede medir."""
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss viene en bytes en macOS y en KB en Linux
+        return pico / 1024 / 1024 if sys.platform == "darwin" else pico / 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ContadoresMemoria(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        contadores = ContadoresMemoria()
+        contadores.cb = ctypes.sizeof(contadores)
+        proceso = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(proceso, ctypes.byref(contadores), contadores.cb):
+            return contadores.PeakWorkingSetSize / 1024 / 1024
+    return None
+
+
+# ------------------------------------------------------------
+# Lectura por bloques
+# ------------------------------------------------------------
+def texto_celda(valor):
+    """Valor de celda como lo deja pd.read_excel(dtype=str) (None si queda vacío)."""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor)
+    return None if texto in VALORES_VACIOS else texto
+
+
+def nombres_columnas(encabezado):
+    """Nombres de columna como los arma pandas (Unnamed: i, duplicados con .1, .2...)."""
+    nombres, vistos = [], {}
+    for i, valor in enumerate(encabezado):
+        nombre = texto_celda(valor) or f"Unnamed: {i}"
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def bloques_excel(ruta, hoja=None, fila_encabezado=0, filas=FILAS_POR_BLOQUE):
+    """Itera una hoja de Excel en DataFrames de texto sin cargarla completa.
+
+    Usa openpyxl en modo read_only; las filas totalmente vacías se omiten.
+    """
+    wb = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        ws = wb[hoja] if hoja is not None else wb.worksheets[0]
+        filas_hoja = ws.iter_rows(min_row=fila_encabezado + 1, values_only=True)
+        encabezado = list(next(filas_hoja, ()))
+        while encabezado and encabezado[-1] is None:
+            encabezado.pop()
+        if not encabezado:
+            return
+        columnas = nombres_columnas(encabezado)
+        ancho = len(columnas)
+
+        lote = []
+        for fila in filas_hoja:
+            valores = [texto_celda(v) for v in fila[:ancho]]
+            if all(v is None for v in valores):
+                continue
+            lote.append(valores + [None] * (ancho - len(valores)))
+            if len(lote) >= filas:
+                yield pd.DataFrame(lote, columns=columnas, dtype=object)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=columnas, dtype=object)
+    finally:
+        wb.close()
+
+
+def leer_fenix_por_bloques(ruta_fenix, filas=FILAS_POR_BLOQUE):
+    """Itera la digitación FÉNIX en bloques ya preparados (.txt o .xlsx)."""
+    if ruta_fenix.suffix.lower() != ".txt":
+        print(f"⚙️ Archivo Fénix (.xlsx) leído por bloques de {filas} filas")
+        for bloque in bloques_excel(ruta_fenix, filas=filas):
+            yield preparar_fenix(bloque)
+        return
+    print(f"⚙️ Archivo Fénix leído por bloques de {filas} filas (separador '|', Latin-1)")
+    for bloque in pd.read_csv(ruta_fenix, sep="|", dtype=str, encoding="latin-1", chunksize=filas):
+        yield preparar_fenix(bloque)
+
+
+def leer_planilla_por_bloques(ruta_elite, filas=FILAS_POR_BLOQUE):
+    """Itera la Planilla Consumos por bloques (misma hoja, encabezado y nombres que leer_planilla)."""
+    print("🔎 Leyendo Planilla Consumos por bloques")
+    with pd.ExcelFile(ruta_elite) as xls:
+        hoja, fila_header = detectar_hoja_planilla(xls)
+    for n_bloque, bloque in enumerate(bloques_excel(ruta_elite, hoja, fila_header, filas)):
+        bloque = normalizar_encabezados(bloque)
+        if n_bloque == 0:
+            print(f"📋 Encabezados finales: {list(bloque.columns)}")
+        yield bloque
+
+
+# ------------------------------------------------------------
+# Reparto en cubetas y estado incremental por cubeta
+# ------------------------------------------------------------
+def columna_pedido(df):
+    """Columna de pedido de la planilla cruda (la misma que renombra preparar_elite)."""
+    return next((c for c in df.columns if "pedido" in c), None)
+
+
+def memoria_df(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def repartir(df, columna, carpeta, prefijo, n_cubetas, bloque=0):
+    """Guarda `df` en disco dividido por cubeta de pedido (un pickle por cubeta).
+
+    Devuelve la memoria en bytes que ocupa en pandas cada cubeta escrita.
+    """
+    if columna is None:
+        # Sin pedido no hay cómo repartir: las demás particiones perderían sus filas
+        raise ValueError(f"'{prefijo}' no tiene columna de pedido; no se puede repartir por partición.")
+    if bloque == 0:
+        pd.to_pickle(df.iloc[:0], carpeta / f"{prefijo}_esquema.pkl")
+    memoria = {}
+    for i, grupo in df.groupby(particion_de(df[columna], n_cubetas), sort=False):
+        pd.to_pickle(grupo, carpeta / f"{prefijo}_{i:04d}_{bloque:06d}.pkl")
+        memoria[i] = memoria_df(grupo)
+    return memoria
+
+
+def cargar_particion(carpeta, prefijo, cubetas):
+    archivos = [a for i in cubetas for a in sorted(carpeta.glob(f"{prefijo}_{i:04d}_*.pkl"))]
+    if not archivos:
+        return pd.read_pickle(carpeta / f"{prefijo}_esquema.pkl")
+    return pd.concat([pd.read_pickle(a) for a in archivos], ignore_index=True)
+
+
+def repartir_estado(estado, carpeta, n_cubetas, parte=0):
+    """Divide un estado incremental por cubeta (estado_CCCC_PPPPPP.pkl); devuelve la memoria por cubeta."""
+    ids = {
+        "huellas": particion_de(estado["huellas"].index.to_series(), n_cubetas),
+        "merge": particion_de(estado["merge"]["pedido"], n_cubetas),
+        "nocruce": particion_de(estado["nocruce"]["pedido"], n_cubetas),
+    }
+    grupos = {k: dict(list(estado[k].groupby(ids[k], sort=False))) for k in ids}
+    memoria = {}
+    for i in set().union(*grupos.values()):
+        pieza = {k: grupos[k].get(i, estado[k].iloc[:0]) for k in ids}
+        pd.to_pickle(pieza, carpeta / f"estado_{i:04d}_{parte:06d}.pkl")
+        memoria[i] = sum(memoria_df(v) for v in pieza.values())
+    return memoria
+
+
+def cargar_estado_cubetas(carpeta, cubetas):
+    """Estado incremental de un grupo de cubetas (None si no hay nada guardado)."""
+    piezas = [
+        pd.read_pickle(a)
+        for i in cubetas
+        for a in sorted(carpeta.glob(f"estado_{i:04d}_*.pkl"))
+    ]
+    if not piezas:
+        return None
+    estado = {k: pd.concat([p[k] for p in piezas]) for k in ("huellas", "merge", "nocruce")}
+    estado["version"] = VERSION_CRUCE
+    return estado
+
+
+def carpeta_estado_particionado(ruta_estado):
+    """Carpeta del estado por cubetas, junto al .pkl del cruce en memoria."""
+    return ruta_estado.with_suffix("")
+
+
+def preparar_estado_particionado(ruta_estado, carpeta, n_cubetas, completo=False):
+    """Deja el estado previo dividido en `n_cubetas`; devuelve (carpeta con el estado, memoria por cubeta).
+
+    Si el estado guardado ya tiene esas cubetas se usa tal cual (cada trabajador
+    lee solo las suyas). Si no, se redivide pieza por pieza en la carpeta temporal;
+    el .pkl del cruce en memoria se lee completo una sola vez para migrarlo.
+    """
+    if completo:
+        print("🔁 Recalculo completo solicitado (--completo).")
+        return None, {}
+
+    carpeta_estado = carpeta_estado_particionado(ruta_estado)
+    meta = None
+    if (carpeta_estado / "meta.pkl").exists():
+        try:
+            meta = pd.read_pickle(carpeta_estado / "meta.pkl")
+        except Exception as e:
+            print(f"⚠️ Estado particionado ilegible, se recalcula todo: {e}")
+            return None, {}
+        if meta.get("version") != VERSION_CRUCE:
+            print("🔁 Estado incremental de otra versión del cruce, se recalcula todo.")
+            return None, {}
+        if meta["cubetas"] == n_cubetas:
+            return carpeta_estado, meta["memoria"]
+
+    memoria = {}
+    if meta is not None:
+        print(f"♻️ Redividiendo estado de {meta['cubetas']} a {n_cubetas} cubetas...")
+        for parte, archivo in enumerate(sorted(carpeta_estado.glob("estado_*.pkl"))):
+            for i, bytes_cubeta in repartir_estado(pd.read_pickle(archivo), carpeta, n_cubetas, parte).items():
+                memoria[i] = memoria.get(i, 0) + bytes_cubeta
+        return carpeta, memoria
+
+    estado = cargar_estado(ruta_estado)
+    if estado is None:
+        return None, {}
+    print("♻️ Migrando el estado del cruce en memoria a cubetas...")
+    memoria = repartir_estado(estado, carpeta, n_cubetas)
+    return carpeta, memoria
+
+
+def guardar_estado_particionado(carpeta_nueva, ruta_estado, n_cubetas, memoria):
+    """Publica la carpeta de estado recién escrita por los trabajadores."""
+    destino = carpeta_estado_particionado(ruta_estado)
+    try:
+        pd.to_pickle(
+            {"version": VERSION_CRUCE, "cubetas": n_cubetas, "memoria": memoria},
+            carpeta_nueva / "meta.pkl",
+        )
+        if destino.exists():
+            shutil.rmtree(destino)
+        carpeta_nueva.rename(destino)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el estado incremental: {e}")
+
+
+# ------------------------------------------------------------
+# Cruce por partición y spool de resultados
+# ------------------------------------------------------------
+def escribir_spool(df, ruta):
+    """Guarda una hoja parcial como secuencia de lotes pickle de FILAS_POR_GRUPO_SPOOL filas.
+
+    El primer objeto es (columnas, filas). Se usa pickle y no Parquet porque
+    NO_COINCIDEN mezcla números y texto en una misma columna y debe llegar
+    al Excel con los mismos tipos que el cruce en memoria.
+    """
+    with open(ruta, "wb") as f:
+        pickle.dump((list(df.columns), len(df)), f)
+        for inicio in range(0, len(df), FILAS_POR_GRUPO_SPOOL):
+            pickle.dump(df.iloc[inicio:inicio + FILAS_POR_GRUPO_SPOOL], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def leer_spool(ruta):
+    """Itera (encabezado, lote, lote...) de un spool sin cargarlo completo."""
+    with open(ruta, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def cruzar_particion(carpeta, cubetas, carpeta_estado, carpeta_estado_nuevo, n_cubetas, medir=False):
+    """Cruza un grupo de cubetas en un trabajador y deja el resultado en disco.
+
+    Escribe CONTROL_ALMACEN y NO_COINCIDEN ordenados como spool en disco y el
+    estado nuevo de cada cubeta; devuelve solo contadores, avisos y memoria.
+    Con `medir` registra el pico de memoria de pandas (tracemalloc) del cruce.
+    """
+    if medir:
+        tracemalloc.start()
+    info = {
+        "cubetas": cubetas,
+        "avisos": [],
+        "estados": pd.Series(dtype="int64"),
+        "memoria_estado": {},
+        "recalculados": 0,
+        "reutilizados": 0,
+    }
 
-    df_tecnicos.columns = (
-        df_tecnicos.columns.map(str)
-        .str.lower()
-        .str.strip()
-        .str.replace(r"unnamed.*", "", regex=True)
+    df_fenix = cargar_particion(carpeta, "fenix", cubetas)
+    df_elite = cargar_particion(carpeta, "elite", cubetas)
+    if not (df_fenix.empty and df_elite.empty):
+        df_planilla = cargar_particion(carpeta, "planilla", cubetas)
+        estado = None if carpeta_estado is None else cargar_estado_cubetas(carpeta_estado, cubetas)
+
+        # Los mensajes por partición se silencian; solo suben las advertencias
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            resultado = ejecutar_cruce(df_fenix, df_elite, df_planilla, estado=estado)
+        info["avisos"] = [l for l in salida.getvalue().splitlines() if l.startswith("⚠️")]
+
+        escribir_spool(resultado.merge, carpeta / f"merge_{cubetas[0]:04d}.spool")
+        escribir_spool(resultado.nocruce, carpeta / f"nocruce_{cubetas[0]:04d}.spool")
+        info["memoria_estado"] = repartir_estado(resultado.estado(), carpeta_estado_nuevo, n_cubetas)
+        info["estados"] = resultado.merge.groupby("status", dropna=False).size()
+        info["recalculados"] = resultado.recalculados
+        info["reutilizados"] = resultado.reutilizados
+
+    if medir:
+        info["pico_cruce"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    info["pid"] = os.getpid()
+    info["pico_rss_mb"] = pico_memoria_mb()
+    return info
+
+
+def agrupar_cubetas(memoria, presupuesto, expansion):
+    """Agrupa cubetas consecutivas en particiones cuya memoria estimada cabe en `presupuesto`."""
+    grupos, actual, usado = [], [], 0
+    for i in sorted(memoria):
+        costo = memoria[i] * expansion
+        if actual and usado + costo > presupuesto:
+            grupos.append(actual)
+            actual, usado = [], 0
+        actual.append(i)
+        usado += costo
+    if actual:
+        grupos.append(actual)
+    return grupos
+
+
+@dataclass
+class CruceParticionado:
+    """Resultado del cruce particionado: las hojas quedan en spools de `carpeta`."""
+    carpeta: Path
+    spools_merge: list
+    spools_nocruce: list
+    resumen: pd.DataFrame
+    filas: int = 0
+    recalculados: int = 0
+    reutilizados: int = 0
+    pico_trabajadores_mb: float = 0.0
+
+
+def ejecutar_cruce_particionado(bloques_fenix, bloques_planilla, carpeta, ruta_estado,
+                                n_particiones=None, memoria_mb=None, completo=False, procesos=1):
+    """Cruce FÉNIX vs ELITE fuera de memoria.
+
+    `bloques_fenix` y `bloques_planilla` son iterables de DataFrames
+    (leer_fenix_por_bloques / leer_planilla_por_bloques, o simplemente
+    [df_fenix] y [df_planilla]). Se reparten por hash de pedido en `carpeta`
+    y cada partición se cruza con ejecutar_cruce en `procesos` trabajadores.
+    Con `memoria_mb` se mide la memoria de cada cubeta y el pico real de un
+    cruce de prueba, y las cubetas se agrupan para caber en el tope.
+    El estado incremental se guarda por cubeta junto a `ruta_estado`.
+    Devuelve un CruceParticionado (exportar_excel_particionado escribe el Excel).
+    """
+    n_cubetas = n_particiones or (CUBETAS_MEMORIA if memoria_mb else max(procesos, 1))
+    print(f"🧮 Cruce particionado: {n_cubetas} cubetas | {procesos} proceso(s)")
+
+    # 🔹 Reparto de las entradas por bloques (memoria medida por cubeta)
+    memoria = {}
+
+    def sumar(memoria_bloque):
+        for i, bytes_cubeta in memoria_bloque.items():
+            memoria[i] = memoria.get(i, 0) + bytes_cubeta
+
+    filas_fenix = 0
+    for n_bloque, bloque in enumerate(bloques_fenix):
+        sumar(repartir(bloque, "pedido", carpeta, "fenix", n_cubetas, n_bloque))
+        filas_fenix += len(bloque)
+
+    filas_elite = 0
+    for n_bloque, bloque in enumerate(bloques_planilla):
+        sumar(repartir(bloque, columna_pedido(bloque), carpeta, "planilla", n_cubetas, n_bloque))
+        with redirect_stdout(io.StringIO()):
+            df_elite = preparar_elite(bloque)
+        sumar(repartir(df_elite, "pedido", carpeta, "elite", n_cubetas, n_bloque))
+        filas_elite += len(df_elite)
+    print(f"📦 Repartidas {filas_fenix} líneas FÉNIX y {filas_elite} líneas ELITE en disco.")
+
+    # Solo las cubetas con entradas producen resultado; su estado previo suma memoria
+    carpeta_estado, memoria_estado = preparar_estado_particionado(ruta_estado, carpeta, n_cubetas, completo)
+    for i in memoria:
+        memoria[i] += memoria_estado.get(i, 0)
+
+    carpeta_estado_nuevo = carpeta_estado_particionado(ruta_estado).with_name(
+        carpeta_estado_particionado(ruta_estado).name + ".nuevo"
     )
+    if carpeta_estado_nuevo.exists():
+        shutil.rmtree(carpeta_estado_nuevo)
+    carpeta_estado_nuevo.mkdir(parents=True)
+
+    def cruzar(grupos, medir=False):
+        n = len(grupos)
+        argumentos = ([carpeta] * n, grupos, [carpeta_estado] * n, [carpeta_estado_nuevo] * n,
+                      [n_cubetas] * n, [medir] * n)
+        if procesos > 1 and n > 1:
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                return list(pool.map(cruzar_particion, *argumentos))
+        return list(map(cruzar_particion, *argumentos))
+
+    # 🔹 Agrupación por memoria: un cruce de prueba (la cubeta más grande) mide
+    #    cuánta memoria usa pandas por byte de entrada
+    salidas = []
+    if memoria_mb and n_particiones is None and memoria:
+        base_mb = pico_memoria_mb() or 0
+        mayor = max(memoria, key=memoria.get)
+        salidas = cruzar([[mayor]], medir=True)
+        expansion = max(salidas[0]["pico_cruce"] / max(memoria[mayor], 1), 1.0)
+        presupuesto = (memoria_mb - base_mb) * 1024 * 1024 / max(procesos, 1)
+        if presupuesto <= 0:
+            print(f"⚠️ El tope de {memoria_mb} MB no alcanza ni para el proceso base ({base_mb:.0f} MB).")
+            presupuesto = 0
+        resto = {i: m for i, m in memoria.items() if i != mayor}
+        grupos = agrupar_cubetas(resto, presupuesto, expansion)
+        excedidas = sum(1 for i, m in memoria.items() if m * expansion > presupuesto)
+        if excedidas:
+            print(f"⚠️ {excedidas} cubeta(s) superan por sí solas el tope de memoria por trabajador.")
+        print(
+            f"📏 Memoria medida: {sum(memoria.values()) / 1024 / 1024:.0f} MB de entrada | "
+            f"x{expansion:.1f} al cruzar | {len(grupos) + 1} particiones"
+        )
+    else:
+        grupos = [[i] for i in sorted(memoria)]
+    salidas += cruzar(grupos)
+
+    avisos = dict.fromkeys(a for s in salidas for a in s["avisos"])
+    for aviso in avisos:
+        print(aviso)
+
+    memoria_estado_nueva = {}
+    for s in salidas:
+        memoria_estado_nueva.update(s["memoria_estado"])
+    guardar_estado_particionado(carpeta_estado_nuevo, ruta_estado, n_cubetas, memoria_estado_nueva)
+
+    estados = [s["estados"] for s in salidas if len(s["estados"])]
+    conteos = pd.concat(estados).groupby(level=0, dropna=False).sum() if estados else pd.Series(dtype="int64")
+
+    # Pico de cada trabajador (procesos reutilizados: el máximo por pid)
+    picos = {}
+    if procesos > 1:
+        for s in salidas:
+            if s["pid"] != os.getpid() and s["pico_rss_mb"] is not None:
+                picos[s["pid"]] = max(picos.get(s["pid"], 0), s["pico_rss_mb"])
+
+    cruce = CruceParticionado(
+        carpeta=carpeta,
+        spools_merge=sorted(carpeta.glob("merge_*.spool")),
+        spools_nocruce=sorted(carpeta.glob("nocruce_*.spool")),
+        resumen=resumen_de_conteos(conteos),
+        filas=int(conteos.sum()),
+        recalculados=sum(s["recalculados"] for s in salidas),
+        reutilizados=sum(s["reutilizados"] for s in salidas),
+        pico_trabajadores_mb=sum(picos.values()),
+    )
+    print(
+        f"♻️ Pedidos reutilizados: {cruce.reutilizados} | 🔁 Recalculados: {cruce.recalculados}"
+    )
+    print(f"✅ Cruce particionado completado: {cruce.filas} líneas en CONTROL_ALMACEN.")
+    return cruce
+
+
+def informar_memoria(cruce, memoria_mb=None):
+    """Compara el pico de memoria medido (proceso principal + trabajadores) con el tope."""
+    pico = pico_memoria_mb()
+    if pico is None:
+        return
+    pico += cruce.pico_trabajadores_mb
+    if memoria_mb and pico > memoria_mb:
+        print(f"⚠️ Pico de memoria medido: {pico:.0f} MB, por encima del tope de {memoria_mb} MB.")
+    elif memoria_mb:
+        print(f"📈 Pico de memoria medido: {pico:.0f} MB (tope {memoria_mb} MB).")
+    else:
+        print(f"📈 Pico de memoria medido: {pico:.0f} MB.")
 
-    posibles_cols = ["#pedido", "pedido", "codigu", "codigo", "tecnico", "técnico"]
-    df_tecnicos = df_tecnicos[[c for c in df_tecnicos.columns if any(p in c for p in posibles_cols)]]
-
-    df_tecnicos.rename(columns={
-        "#pedido": "pedido",
-        "codigu": "codigo",
-        "codigo": "codigo",
-        "tecnico": "tecnico",
-        "técnico": "tecnico",
-    }, inplace=True)
-
-    df_tecnicos = df_tecnicos[["pedido", "tecnico"]].drop_duplicates(subset=["pedido"])
-
-    # 🔹 Merge tipo BUSCARV
-    df_merge = df_merge.merge(df_tecnicos, on="pedido", how="left")
-
-    # 🔹 Reemplazar vacíos en la columna técnico por "SIN DATOS"
-    if "tecnico" in df_merge.columns:
-        df_merge["tecnico"] = df_merge["tecnico"].fillna("SIN DATOS").replace("", "SIN DATOS")
-
-    # 🔹 Reubicar columna 'tecnico' justo después de 'status'
-    if "tecnico" in df_merge.columns and "status" in df_merge.columns:
-        cols = list(df_merge.columns)
-        idx_status = cols.index("status")
-        cols.insert(idx_status + 1, cols.pop(cols.index("tecnico")))
-        df_merge = df_merge[cols]
+# ============================================================
+# 9. CREAR RESUMEN
+# ============================================================
+def crear_resumen(df_merge):
+    # Agrupamos por la nueva columna "status" en lugar de "estado_final"
+    return resumen_de_conteos(df_merge.groupby("status", dropna=False).size())
 
-    print("👷 Columna 'TÉCNICO' agregada correctamente desde Planilla Consumos.xlsx.")
 
-except Exception as e:
-    print(f"⚠️ No se pudo agregar la columna 'TÉCNICO': {e}")
+def resumen_de_conteos(conteos):
+    """Hoja RESUMEN a partir del número de líneas por status (también por partición)."""
+    resumen = (
+        conteos.rename_axis("status")
+        .reset_index(name="total")
+        .sort_values(by="status")
+    )
+    total_registros = int(conteos.sum())
+    resumen.loc[len(resumen)] = ["TOTAL GENERAL", total_registros]
 
-# ============================================================
-# 8.2 ORDEN FINAL DE COLUMNAS (ya con TÉCNICO incluido)
-# ============================================================
-columnas_finales = columnas_fenix + ["cantidad_elite", "diferencia", "status", "tecnico"]
-df_merge = df_merge[[c for c in columnas_finales if c in df_merge.columns]]
+    # Cambiamos nombre de la columna del resumen a "estado_final"
+    resumen.rename(columns={"status": "estado_final"}, inplace=True)
+    return resumen
 
-# Para hoja NO_COINCIDEN
-columnas_nocruce = ["pedido", "codigo", "cantidad", "cantidad_elite", "origen"]
-df_nocruce = df_nocruce[[c for c in columnas_nocruce if c in df_nocruce.columns]]
 # ============================================================
-# 8.3 RECONSTRUCCIÓN FINAL DE HOJA NO_COINCIDEN (v4.0 con cantidad real)
+# 9.1. FORMATO VISUAL (reglas por columna, sin límite de filas)
 # ============================================================
-try:
-    # --- Leer planilla para obtener pedido, código, cantidad y técnico ---
-    df_planilla = pd.read_excel(ruta_elite, sheet_name=None, dtype=str, header=None)
-    hoja_correcta, fila_header = None, None
-
-    for hoja, df_temp in df_planilla.items():
-        for i, fila in df_temp.iterrows():
-            texto = " ".join(str(x).lower() for x in fila.values if pd.notna(x))
-            if "tecnico" in texto or "técnico" in texto:
-                hoja_correcta, fila_header = hoja, i
-                break
-        if hoja_correcta:
-            break
-
-    if not hoja_correcta:
-        raise Exception("No se encontró hoja con columna técnico.")
+# El libro se escribe en modo solo escritura (write_only): cada columna arma su
+# estilo una vez (alineación + formato numérico según el tipo) y todas sus
+# celdas lo comparten. Los colores se expresan como tabla estructurada y
+# formato condicional sobre el rango completo de cada columna, así que el
+# formato cuesta O(columnas) y cualquier fila del archivo queda cubierta.
+ALINEACION_CENTRO = Alignment(horizontal="center", vertical="center")
+FUENTE_ENCABEZADO = Font(color="FFFFFF", bold=True)
+
+# Mismos formatos que usa pandas.to_excel para fechas
+FORMATO_FECHA_HORA = "YYYY-MM-DD HH:MM:SS"
+FORMATO_FECHA = "YYYY-MM-DD"
+
+# 🎨 Paleta de colores de encabezado
+COLORES_ENCABEZADO = {
+    "default": "004C99",      # azul (FENIX)
+    "elite": "000000",        # negro (ELITE)
+    "diferencia": "000000",   # negro (comparativo)
+    "status": "000000",       # negro (resultado)
+    "tecnico": "000000",      # negro (nueva columna técnico)
+}
 
-    # Leer desde encabezado detectado
-    df_planilla = pd.read_excel(
-        ruta_elite,
-        sheet_name=hoja_correcta,
-        dtype=str,
-        skiprows=fila_header
-    )
 
-    # Normalizar encabezados
-    df_planilla.columns = (
-        df_planilla.columns.map(str)
-        .str.lower()
-        .str.strip()
-        .str.replace(r"unnamed.*", "", regex=True)
+def color_encabezado(nombre):
+    header = str(nombre).lower().strip()
+    if "elite" in header:
+        return COLORES_ENCABEZADO["elite"]
+    if "diferencia" in header:
+        return COLORES_ENCABEZADO["diferencia"]
+    if header == "status":  # evitar confusión con fecha_estado
+        return COLORES_ENCABEZADO["status"]
+    if "tecnico" in header:
+        return COLORES_ENCABEZADO["tecnico"]
+    return COLORES_ENCABEZADO["default"]  # por defecto azul FENIX
+
+
+def formato_numero(serie):
+    """Formato numérico de Excel para una columna según su dtype."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return FORMATO_FECHA_HORA
+    muestra = serie.dropna()
+    if len(muestra):
+        primero = muestra.iloc[0]
+        if isinstance(primero, datetime):
+            return FORMATO_FECHA_HORA
+        if isinstance(primero, date):
+            return FORMATO_FECHA
+    return "General"
+
+
+def letra_columna(columnas, nombre):
+    """Letra de la columna cuyo encabezado coincide con `nombre` (None si no existe)."""
+    for i, col in enumerate(columnas, start=1):
+        if str(col).lower().strip() == nombre:
+            return get_column_letter(i)
+    return None
+
+
+def regla_texto(letra, texto, color_fondo, color_fuente):
+    """Regla condicional: la celda contiene `texto` (sin distinguir mayúsculas)."""
+    return FormulaRule(
+        formula=[f'ISNUMBER(SEARCH("{texto}",${letra}2))'],
+        fill=PatternFill("solid", start_color=color_fondo, end_color=color_fondo),
+        font=Font(color=color_fuente, bold=True),
+        stopIfTrue=True,
     )
 
-    # Renombrar columnas clave
-    df_planilla.rename(columns={
-        "#pedido": "pedido",
-        "codigu": "codigo",
-        "cantidad": "cantidad_elite",
-        "técnico": "tecnico"
-    }, inplace=True)
 
-    # Filtrar columnas relevantes
-    columnas_necesarias = ["pedido", "codigo", "cantidad_elite", "tecnico"]
-    df_planilla = df_planilla[[c for c in df_planilla.columns if c in columnas_necesarias]].copy()
-
-    # Limpieza básica
-    df_planilla["pedido"] = df_planilla["pedido"].astype(str).str.strip()
-    df_planilla["codigo"] = df_planilla["codigo"].astype(str).str.strip()
-    df_planilla["tecnico"] = df_planilla["tecnico"].astype(str).str.strip()
-    df_planilla["cantidad_elite"] = (
-    df_planilla["cantidad_elite"]
-    .astype(str)
-    .str.replace(",", ".", regex=False)
-    .apply(lambda x: float(x) if x.replace(".", "", 1).isdigit() else 0)
-)
-
-    df_planilla.dropna(subset=["pedido", "codigo"], inplace=True)
-    df_planilla.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
-
-    # --- Filtrar registros Solo en ELITE ---
-    df_nc_elite = df_nocruce[df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False)].copy()
-    df_nc_otros = df_nocruce[~df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False)].copy()
-
-    if not df_nc_elite.empty:
-        pedidos_elite = df_nc_elite["pedido"].unique().tolist()
-        df_codigos_planilla = df_planilla[df_planilla["pedido"].isin(pedidos_elite)].copy()
-
-        # Crear base limpia con estructura correcta
-        df_nueva_elite = pd.DataFrame({
-            "pedido": df_codigos_planilla["pedido"],
-            "codigo": df_codigos_planilla["codigo"],
-            "cantidad": 0,
-            "cantidad_elite": df_codigos_planilla["cantidad_elite"],
-            "origen": "Solo en ELITE",
-            "tecnico": df_codigos_planilla["tecnico"]
-        })
-
-        # Evitar duplicados reales
-        df_nueva_elite.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
-
-        # Combinar con el resto (Solo FENIX, etc.)
-        df_nocruce = pd.concat([df_nc_otros, df_nueva_elite], ignore_index=True)
-
-    # 🔹 Asegurar orden de columnas
-    columnas_nocruce = ["pedido", "codigo", "cantidad", "cantidad_elite", "origen", "tecnico"]
-    df_nocruce = df_nocruce[[c for c in columnas_nocruce if c in df_nocruce.columns]]
+def escribir_hoja(wb, nombre_hoja, nombre_tabla, columnas, bloques):
+    """Escribe una hoja en un libro write_only a partir de bloques de DataFrame.
+
+    Devuelve (hoja, filas de datos) para añadir después el formato condicional.
+    """
+    ws = wb.create_sheet(nombre_hoja)
+    letra_final = get_column_letter(len(columnas))
+
+    # 🔹 Alineación centrada también para las filas que se agreguen en Excel
+    for i in range(1, len(columnas) + 1):
+        ws.column_dimensions[get_column_letter(i)].alignment = ALINEACION_CENTRO
+
+    # 🔹 Encabezados coloreados según tipo (una celda por columna)
+    encabezado = []
+    for col in columnas:
+        cell = WriteOnlyCell(ws, value=col)
+        cell.fill = PatternFill("solid", start_color=color_encabezado(col))
+        cell.font = FUENTE_ENCABEZADO
+        cell.alignment = ALINEACION_CENTRO
+        encabezado.append(cell)
+    ws.append(encabezado)
+
+    # 🔹 Filas: el estilo de cada columna se calcula con el primer bloque y las
+    #    celdas comparten ese mismo StyleArray (se serializan al instante)
+    estilos = None
+    filas = 0
+    for bloque in bloques:
+        if bloque.empty:
+            continue
+        bloque = bloque.reindex(columns=columnas)
+        if estilos is None:
+            estilos = []
+            for col in columnas:
+                plantilla = WriteOnlyCell(ws)
+                plantilla.alignment = ALINEACION_CENTRO
+                plantilla.number_format = formato_numero(bloque[col])
+                estilos.append(plantilla._style)
+
+        valores = bloque.astype(object).where(bloque.notna(), None)
+        for fila in valores.itertuples(index=False, name=None):
+            celdas = []
+            for valor, estilo in zip(fila, estilos):
+                cell = WriteOnlyCell(ws, value=valor)
+                cell._style = estilo
+                celdas.append(cell)
+            ws.append(celdas)
+        filas += len(bloque)
+
+    # 🔹 Tabla estructurada (filtros + estilo) sobre todas las filas
+    if filas >= 1:
+        tabla = Table(displayName=nombre_tabla, ref=f"A1:{letra_final}{filas + 1}")
+        # En write_only openpyxl no puede releer el encabezado: se declaran los
+        # nombres aquí (y se silencia el aviso que lo recuerda)
+        tabla.tableColumns = [TableColumn(id=i, name=str(col)) for i, col in enumerate(columnas, start=1)]
+        tabla.tableStyleInfo = TableStyleInfo(
+            name="TableStyleLight1",
+            showFirstColumn=False,
+            showLastColumn=False,
+            showRowStripes=True,
+            showColumnStripes=False
+        )
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="In write-only mode")
+            ws.add_table(tabla)
 
-    print("✅ Hoja NO_COINCIDEN reconstruida con cantidades reales y técnico correcto (v4.0).")
+    return ws, filas
 
-except Exception as e:
-    print(f"⚠️ Error al reconstruir hoja NO_COINCIDEN: {e}")
 
-# ============================================================
-# 9. CREAR RESUMEN
-# ============================================================
-# Agrupamos por la nueva columna "status" en lugar de "estado_final"
-resumen = (
-    df_merge.groupby("status", dropna=False)
-    .size()
-    .reset_index(name="total")
-    .sort_values(by="status")
-)
-total_registros = len(df_merge)
-resumen.loc[len(resumen)] = ["TOTAL GENERAL", total_registros]
-
-# Cambiamos nombre de la columna del resumen a "estado_final"
-resumen.rename(columns={"status": "estado_final"}, inplace=True)
+def escribir_libro(ruta, control, resumen, nocruce):
+    """Escribe y formatea las tres hojas; cada hoja es (columnas, bloques)."""
+    wb = Workbook(write_only=True)
 
-# ============================================================
-# 🔹 LIMPIEZA DE PEDIDOS (evita falsos pedidos 1, 2, 3…)
-# ============================================================
-if "pedido" in df_elite.columns:
-    # Normalizar y eliminar filas sin pedido válido
-    df_elite["pedido"] = (
-        df_elite["pedido"]
-        .astype(str)
-        .str.strip()
-        .replace({"nan": None, "": None})
-    )
+    # === CONTROL_ALMACEN ===
+    columnas, bloques = control
+    ws, filas = escribir_hoja(wb, "CONTROL_ALMACEN", "CONTROL_ALMACEN", columnas, bloques)
 
-    # Conservar solo filas con pedidos numéricos reales de 8 dígitos o más
-    df_elite = df_elite[
-        df_elite["pedido"].notna() &
-        df_elite["pedido"].str.match(r"^\d{8,}$", na=False)
-    ]
+    # Semáforo sobre columna STATUS (formato condicional, todas las filas)
+    letra = letra_columna(columnas, "status")
+    if letra:
+        rango = f"{letra}2:{letra}{max(filas + 1, 2)}"
+        ws.conditional_formatting.add(rango, regla_texto(letra, "OK", "00B050", "FFFFFF"))
+        ws.conditional_formatting.add(rango, regla_texto(letra, "FALTANTE", "FFD966", "000000"))
+        ws.conditional_formatting.add(rango, regla_texto(letra, "EXCESO", "C00000", "FFFFFF"))
 
-    # Eliminar filas vacías restantes
-    df_elite = df_elite.dropna(subset=["pedido"])
+    # === RESUMEN ===
+    columnas, bloques = resumen
+    escribir_hoja(wb, "RESUMEN", "RESUMEN_ALMACEN", columnas, bloques)
 
-# ============================================================
-# 🔧 Limpieza final: evitar pedidos duplicados entre FÉNIX y ELITE
-# ============================================================
-try:
-    if 'df_nocruce' in locals() and not df_nocruce.empty:
-        # Asegurar tipos de datos consistentes
-        df_nocruce["pedido"] = df_nocruce["pedido"].astype(str).str.strip()
-        df_nocruce["origen"] = df_nocruce["origen"].astype(str)
-
-        # 1️⃣ Obtener todos los pedidos que están en "Solo en ELITE"
-        pedidos_elite = df_nocruce.loc[
-            df_nocruce["origen"].str.contains("Solo en ELITE", case=False, na=False),
-            "pedido"
-        ].unique()
-
-        # 2️⃣ Eliminar versiones duplicadas de esos mismos pedidos en "Solo en FENIX"
-        df_nocruce = df_nocruce[
-            ~(
-                (df_nocruce["pedido"].isin(pedidos_elite)) &
-                (df_nocruce["origen"].str.contains("Solo en FENIX", case=False, na=False))
-            )
-        ].copy()
-
-        # 3️⃣ Eliminar duplicados exactos (por pedido + código)
-        df_nocruce.drop_duplicates(subset=["pedido", "codigo"], keep="first", inplace=True)
-
-        # 4️⃣ Ordenar por pedido y código
-        df_nocruce.sort_values(by=["pedido", "codigo"], inplace=True, ignore_index=True)
-
-        print("🧩 Limpieza aplicada: eliminados duplicados FÉNIX/ELITE por pedido (v4.4).")
-    else:
-        print("⚠️ df_nocruce vacío o no definido, se omite limpieza final.")
-except Exception as e:
-    print(f"⚠️ Error al limpiar duplicados entre FÉNIX y ELITE: {e}")
+    # === NO_COINCIDEN ===
+    columnas, bloques = nocruce
+    ws_nc, filas = escribir_hoja(wb, "NO_COINCIDEN", "NO_COINCIDEN", columnas, bloques)
 
-# ============================================================
-# 10. EXPORTAR A EXCEL (manejo de archivo abierto)
-# ============================================================
+    # Color por origen (Solo en ELITE / Solo en FENIX)
+    letra = letra_columna(columnas, "origen") or get_column_letter(len(columnas))
+    rango = f"{letra}2:{letra}{max(filas + 1, 2)}"
+    ws_nc.conditional_formatting.add(rango, regla_texto(letra, "ELITE", "C00000", "FFFFFF"))
+    ws_nc.conditional_formatting.add(rango, regla_texto(letra, "FENIX", "1F4E78", "FFFFFF"))
 
+    wb.save(ruta)
 
-try:
-    ruta_salida.parent.mkdir(parents=True, exist_ok=True)
-    with pd.ExcelWriter(ruta_salida, engine="openpyxl") as writer:
-        df_merge.to_excel(writer, index=False, sheet_name="CONTROL_ALMACEN")
-        resumen.to_excel(writer, index=False, sheet_name="RESUMEN")
-        df_nocruce.to_excel(writer, index=False, sheet_name="NO_COINCIDEN")
 
+# ============================================================
+# 10. EXPORTAR A EXCEL CON FORMATO
+# ============================================================
+def exportar_excel(resultado, ruta):
+    """Escribe CONTROL_ALMACEN / RESUMEN / NO_COINCIDEN con formato (PermissionError si está abierto)."""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
     print("💾 Exportando archivo con hoja de control de pendientes...")
+    escribir_libro(
+        ruta,
+        control=(list(resultado.merge.columns), [resultado.merge]),
+        resumen=(list(resultado.resumen.columns), [resultado.resumen]),
+        nocruce=(list(resultado.nocruce.columns), [resultado.nocruce]),
+    )
 
-except PermissionError:
-    print("⚠️ No se puede guardar el archivo porque está abierto en Excel.")
-    print("🧩 Por favor, cierre 'CONTROL_ALMACEN.xlsx' y ejecute nuevamente el script.")
-    import sys
-    sys.exit(1)
-
-except Exception as e:
-    print(f"❌ Error inesperado al exportar a Excel: {e}")
-    import sys
-    sys.exit(1)
 
+def columnas_spools(rutas, por_defecto):
+    """Columnas de una hoja repartida en spools (mismo orden que el cruce en memoria)."""
+    encabezados = [next(leer_spool(r)) for r in rutas]
+    con_datos = [nombres for nombres, filas in encabezados if filas] or \
+        [nombres for nombres, _ in encabezados[:1]]
+    if not con_datos:
+        return por_defecto
+    columnas = list(max(con_datos, key=len))
+    for nombres in con_datos:
+        columnas += [c for c in nombres if c not in columnas]
+    return columnas
+
+
+def clave_orden(pedido, codigo):
+    """Clave de sort_values(["pedido", "codigo"]) con vacíos al final."""
+    return (pd.isna(pedido), "" if pd.isna(pedido) else pedido,
+            pd.isna(codigo), "" if pd.isna(codigo) else codigo)
+
+
+def bloques_ordenados(rutas, columnas, filas=FILAS_POR_BLOQUE // 10):
+    """Mezcla los spools (ya ordenados por pedido/código) y entrega bloques DataFrame.
+
+    Cada pedido vive en un solo spool, así que la mezcla k-way reproduce el
+    orden del cruce en memoria leyendo un lote pequeño de cada spool a la vez.
+    """
+    def filas_spool(ruta):
+        lotes = leer_spool(ruta)
+        next(lotes)  # encabezado
+        for lote in lotes:
+            df = lote.reindex(columns=columnas)
+            claves = map(clave_orden, df["pedido"], df["codigo"])
+            yield from zip(claves, df.itertuples(index=False, name=None))
+
+    pendientes = []
+    for _, fila in heapq.merge(*(filas_spool(r) for r in rutas), key=lambda x: x[0]):
+        pendientes.append(fila)
+        if len(pendientes) >= filas:
+            yield pd.DataFrame(pendientes, columns=columnas)
+            pendientes = []
+    if pendientes:
+        yield pd.DataFrame(pendientes, columns=columnas)
+
+
+def exportar_excel_particionado(cruce, ruta):
+    """Como exportar_excel, pero leyendo las hojas desde los spools del cruce particionado."""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    print("💾 Exportando archivo con hoja de control de pendientes...")
+    columnas_merge = columnas_spools(cruce.spools_merge, ["pedido", "codigo", "status"])
+    columnas_nocruce = columnas_spools(cruce.spools_nocruce, ["pedido", "codigo", "origen"])
+    escribir_libro(
+        ruta,
+        control=(columnas_merge, bloques_ordenados(cruce.spools_merge, columnas_merge)),
+        resumen=(list(cruce.resumen.columns), [cruce.resumen]),
+        nocruce=(columnas_nocruce, bloques_ordenados(cruce.spools_nocruce, columnas_nocruce)),
+    )
 
 # ============================================================
-# 🔹 NORMALIZAR TIPOS DE DATOS (evita "Recuento" en Excel)
-# ============================================================
-cols_numericas = ["cantidad", "cantidad_elite", "vlr_cliente", "valor_costo", "diferencia"]
-
-for col in cols_numericas:
-    if col in df_merge.columns:
-        df_merge[col] = (
-            pd.to_numeric(df_merge[col], errors="coerce")
-            .fillna(0)
-            .astype(float)
-        )
-# ============================================================
-# 🔹 Normalizar tipos numéricos también en NO_COINCIDEN
+# 11. EJECUCIÓN COMO SCRIPT (CLI)
 # ============================================================
-cols_numericas_nc = ["cantidad", "cantidad_elite"]
-
-for col in cols_numericas_nc:
-    if col in df_nocruce.columns:
-        df_nocruce[col] = (
-            pd.to_numeric(df_nocruce[col], errors="coerce")
-            .fillna(0)
-            .astype(float)
-        )
+def valor_opcion(argv, nombre):
+    """Valor entero de una opción `--nombre N` (None si no se indicó)."""
+    if nombre not in argv:
+        return None
+    try:
+        return int(argv[argv.index(nombre) + 1])
+    except (IndexError, ValueError):
+        raise SystemExit(f"❌ La opción {nombre} requiere un número entero.")
+
+
+def exportar_o_salir(exportar):
+    """Ejecuta la exportación; si el Excel está abierto u ocurre un error, termina con código 1."""
+    try:
+        exportar()
+
+    except PermissionError:
+        print("⚠️ No se puede guardar el archivo porque está abierto en Excel.")
+        print("🧩 Por favor, cierre 'CONTROL_ALMACEN.xlsx' y ejecute nuevamente el script.")
+        sys.exit(1)
+
+    except Exception as e:
+        print(f"❌ Error inesperado al exportar a Excel: {e}")
+        sys.exit(1)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # --completo ignora el estado previo y recalcula todos los pedidos
+    completo = "--completo" in argv
+    # Modo particionado: --particiones N fija las particiones; --memoria-mb M
+    # las agrupa según la memoria medida; --procesos P en paralelo
+    particiones = valor_opcion(argv, "--particiones")
+    memoria_mb = valor_opcion(argv, "--memoria-mb")
+    procesos = valor_opcion(argv, "--procesos") or 1
+
+    print("------------------------------------------------------------")
+    print("🚀 INICIANDO CRUCE FÉNIX vs ELITE (v3.2)...")
+    inicio = time.time()
+    print("------------------------------------------------------------")
+
+    ruta_fenix = detectar_ruta_fenix()
+
+    if particiones is not None or memoria_mb is not None or procesos > 1:
+        with tempfile.TemporaryDirectory(prefix="cruce_almacen_") as tmp:
+            try:
+                cruce = ejecutar_cruce_particionado(
+                    leer_fenix_por_bloques(ruta_fenix), leer_planilla_por_bloques(ruta_elite),
+                    Path(tmp), ruta_estado, n_particiones=particiones, memoria_mb=memoria_mb,
+                    completo=completo, procesos=procesos,
+                )
+            except SystemExit:
+                raise
+            except Exception as e:
+                raise SystemExit(f"❌ Error en el cruce particionado: {e}")
+
+            exportar_o_salir(lambda: exportar_excel_particionado(cruce, ruta_salida))
+        informar_memoria(cruce, memoria_mb)
+    else:
+        try:
+            df_planilla = leer_planilla(ruta_elite)
+            df_elite = preparar_elite(df_planilla)
+        except Exception as e:
+            raise SystemExit(f"❌ Error al leer Planilla Consumos: {e}")
 
-# Asegurar que las columnas numéricas estén en formato numérico real
-for col in ["cantidad", "cantidad_elite", "vlr_cliente", "valor_costo", "diferencia"]:
-    if col in df_merge.columns:
-        df_merge[col] = pd.to_numeric(df_merge[col], errors="coerce").fillna(0)
+        estado = cargar_estado(ruta_estado, completo=completo)
 
-# ============================================================
-# 11. FORMATO VISUAL LIMPIO
-# ============================================================
-wb = load_workbook(ruta_salida)
+        try:
+            df_fenix = leer_fenix(ruta_fenix)
+        except Exception as e:
+            raise SystemExit(f"❌ Error al leer FÉNIX: {e}")
 
-def formato_hoja(ws):
-    from openpyxl.styles import PatternFill, Font, Alignment
+        print("✅ Archivos cargados correctamente.")
 
-    # Limitar formato solo a las primeras 2000 filas para acelerar el pintado
-    max_row = min(ws.max_row, 2000)
-    max_col = ws.max_column
+        resultado = ejecutar_cruce(df_fenix, df_elite, df_planilla, estado=estado)
+        guardar_estado(ruta_estado, resultado)
+        exportar_o_salir(lambda: exportar_excel(resultado, ruta_salida))
 
-    font_encabezado = Font(color="FFFFFF", bold=True)
-    align_center = Alignment(horizontal="center", vertical="center")
+    print("✅ CRUCE FINALIZADO CON ÉXITO (v3.7 con colores de encabezado).")
+    print(f"📁 Archivo generado: {ruta_salida}")
+    print("------------------------------------------------------------")
+    print(f"⏱️ Tiempo total de ejecución: {round(time.time() - inicio, 2)} segundos.")
 
-    # 🎨 Paleta de colores
-    colores = {
-        "default": "004C99",      # azul (FENIX)
-        "elite": "000000",        # negro (ELITE)
-        "diferencia": "000000",   # negro (comparativo)
-        "status": "000000",       # negro (resultado)
-        "tecnico": "000000",      # negro (nueva columna técnico)
-    }
 
-    # 🔹 Colorear encabezados según tipo
-    for idx, cell in enumerate(ws[1], 1):
-        header = str(cell.value).lower().strip()
-        color = colores["default"]  # por defecto azul FENIX
-
-        if "elite" in header:
-            color = colores["elite"]
-        elif "diferencia" in header:
-            color = colores["diferencia"]
-        elif header == "status":  # evitar confusión con fecha_estado
-            color = colores["status"]
-        elif "tecnico" in header:
-            color = colores["tecnico"]    
-
-        cell.fill = PatternFill("solid", start_color=color)
-        cell.font = font_encabezado
-        cell.alignment = align_center
-
-    # 🔹 Alinear celdas del cuerpo
-    for row in ws.iter_rows(min_row=2, max_row=max_row, min_col=1, max_col=max_col):
-        for c in row:
-            c.alignment = align_center
-
-
-# === CONTROL_ALMACEN ===
-ws = wb["CONTROL_ALMACEN"]
-formato_hoja(ws)
-
-# Aplicar semáforo sobre columna STATUS
-col_status = None
-for idx, cell in enumerate(ws[1], 1):
-    if str(cell.value).lower().strip() == "status":
-        col_status = idx
-        break
-
-if col_status:
-    for i in range(2, ws.max_row + 1):
-        c = ws.cell(row=i, column=col_status)
-        text = str(c.value).upper()
-        if "OK" in text:
-            c.fill = PatternFill("solid", start_color="00B050")
-            c.font = Font(color="FFFFFF", bold=True)
-        elif "FALTANTE" in text:
-            c.fill = PatternFill("solid", start_color="FFD966")
-            c.font = Font(color="000000", bold=True)
-        elif "EXCESO" in text:
-            c.fill = PatternFill("solid", start_color="C00000")
-            c.font = Font(color="FFFFFF", bold=True)
-
-# === RESUMEN ===
-ws_resumen = wb["RESUMEN"]
-formato_hoja(ws_resumen)
-
-# === NO_COINCIDEN ===
-ws_nc = wb["NO_COINCIDEN"]
-formato_hoja(ws_nc)
-
-for i in range(2, ws_nc.max_row + 1):
-    c = ws_nc.cell(row=i, column=ws_nc.max_column)
-    if "ELITE" in str(c.value).upper():
-        c.fill = PatternFill("solid", start_color="C00000")
-        c.font = Font(color="FFFFFF", bold=True)
-    elif "FENIX" in str(c.value).upper():
-        c.fill = PatternFill("solid", start_color="1F4E78")
-        c.font = Font(color="FFFFFF", bold=True)
-
-wb.save(ruta_salida)
-wb.close()
-
-print("✅ CRUCE FINALIZADO CON ÉXITO (v3.7 con colores de encabezado).")
-print(f"📁 Archivo generado: {ruta_salida}")
-print("------------------------------------------------------------")
-print(f"⏱️ Tiempo total de ejecución: {round(time.time() - inicio, 2)} segundos.")
+if __name__ == "__main__":
+    main()